@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete, m2m_changed
 
 
 class LeaderboardsConfig(AppConfig):
     name = 'Leaderboards'
+
+    def ready(self):
+        from .models import Player, League
+        from .leaderboards.directory import player_saved_or_deleted, league_membership_changed
+
+        # Keep the PlayerDirectory up to date
+        post_save.connect(player_saved_or_deleted, sender=Player, dispatch_uid="player_directory_save")
+        post_delete.connect(player_saved_or_deleted, sender=Player, dispatch_uid="player_directory_delete")
+        m2m_changed.connect(league_membership_changed, sender=League.players.through, dispatch_uid="player_directory_leagues")
@@ -0,0 +1,44 @@
+from bisect import bisect_right
+
+
+class PlayCountSeries:
+    '''
+    The cumulative play counts of a game over time, as Game.play_counts() returns them, one entry
+    per session in chronological order. Built by Game.play_count_series() so that the counts as at
+    any number of times (typically the times of leaderboard snapshots) are lookups rather than queries.
+    '''
+
+    def __init__(self):
+        self.times = []  # Session date_times in chronological order
+        self.counts = []  # The play counts after the session at the same index
+
+    @staticmethod
+    def empty() -> dict:
+        return {'total': 0, 'max': 0, 'average': 0, 'players': 0, 'sessions': 0}
+
+    def append(self, date_time, counts):
+        '''
+        Records the counts after a session. Sessions must be appended in chronological order.
+
+        :param date_time: The date_time of the session
+        :param counts:    The play counts as at that time
+        '''
+        if self.times and self.times[-1] == date_time:
+            # Two sessions at the same time, the counts after both are the ones we want.
+            self.counts[-1] = counts
+        else:
+            self.times.append(date_time)
+            self.counts.append(counts)
+
+    def asat(self, date_time=None) -> dict:
+        '''
+        The play counts as at a given time (a copy, that the caller can alter).
+
+        :param date_time: A datetime, or None for the latest counts
+        '''
+        if date_time is None:
+            i = len(self.counts)
+        else:
+            i = bisect_right(self.times, date_time)
+
+        return dict(self.counts[i - 1]) if i > 0 else self.empty()
@@ -0,0 +1,159 @@
+'''
+Delta encoding of leaderboard snapshots.
+
+Consecutive snapshots of a game's leaderboard usually differ only by the handful of
+players who played the session between them. So rather than storing each board in full
+we can store a full board (a keyframe) every so often and in between just the delta from
+an earlier board:
+
+    {'changed': [[index, player tuple], ...], 'removed': [pk, ...]}
+
+that is the player tuples that are new or changed, each with its index on the new board,
+and the players no longer on it. A delta is only taken if the players that did not change
+kept their relative order (as players whose rating didn't change do), so that the board
+can be rebuilt exactly: drop the changed and removed players from the earlier board and
+insert the changed ones at their indices, in order.
+
+Player lists are in the LB_PLAYER_LIST_STYLE.data style, player pks first in each tuple.
+'''
+from .enums import LB_STRUCTURE
+from .util import immutable
+
+
+def is_delta(player_list) -> bool:
+    '''
+    True if the player list is a delta (see board_delta) rather than a player list.
+    '''
+    return isinstance(player_list, dict)
+
+
+def board_delta(previous, board, max_changed=0.5):
+    '''
+    Returns the delta (see module docstring) that rebuilds board from previous, or None if
+    the board is not worth storing (or cannot be stored) as a delta of previous.
+
+    :param previous:    A player list, the board to take the delta from
+    :param board:       A player list, the board to take the delta to
+    :param max_changed: The largest fraction of the board that may change for a delta to be worth it
+    '''
+    previous_rows = {row[0]: tuple(row) for row in previous}
+    pks = {row[0] for row in board}
+
+    changed = [[i, row] for i, row in enumerate(board) if previous_rows.get(row[0]) != tuple(row)]
+    changed_pks = {row[0] for i, row in changed}
+    removed = [pk for pk in previous_rows if not pk in pks]
+
+    if len(changed) > max_changed * max(len(board), 1):
+        return None
+
+    # The unchanged players must be in the same order on both boards
+    unchanged = [row[0] for row in board if not row[0] in changed_pks]
+    unchanged_before = [row[0] for row in previous if row[0] in pks and not row[0] in changed_pks]
+
+    if unchanged != unchanged_before:
+        return None
+
+    return {'changed': changed, 'removed': removed}
+
+
+def apply_board_delta(previous, delta) -> tuple:
+    '''
+    Returns the board (an immutable player list) that a delta (see board_delta) rebuilds from previous.
+
+    :param previous: A player list, the board the delta was taken from
+    :param delta:    A delta returned by board_delta
+    '''
+    dropped = set(delta['removed']) | {row[0] for i, row in delta['changed']}
+
+    rows = [immutable(row) for row in previous if not row[0] in dropped]
+    for i, row in sorted(delta['changed'], key=lambda c: c[0]):
+        rows.insert(i, immutable(row))
+
+    return tuple(rows)
+
+
+def snapshot_delta(previous, snapshot):
+    '''
+    Returns the snapshot with its player list replaced by the delta from previous, or None if
+    it is not worth storing (or cannot be stored) as a delta.
+
+    :param previous: A LB_STRUCTURE.session_wrapped_player_list, the snapshot to take the delta from
+    :param snapshot: A LB_STRUCTURE.session_wrapped_player_list, the snapshot to take the delta to
+    '''
+    isd = LB_STRUCTURE.session_data_element.value
+    delta = board_delta(previous[isd], snapshot[isd])
+    return None if delta is None else tuple(snapshot[:isd]) + (delta,) + tuple(snapshot[isd + 1:])
+
+
+def apply_snapshot_delta(previous, snapshot) -> tuple:
+    '''
+    Returns the (immutable) snapshot that a snapshot_delta rebuilds from previous.
+
+    :param previous: A LB_STRUCTURE.session_wrapped_player_list, the snapshot the delta was taken from
+    :param snapshot: A snapshot returned by snapshot_delta
+    '''
+    isd = LB_STRUCTURE.session_data_element.value
+    return immutable(snapshot[:isd]) + (apply_board_delta(previous[isd], snapshot[isd]),) + immutable(snapshot[isd + 1:])
+
+
+def encode_series(snapshots, keyframe_interval) -> list:
+    '''
+    Delta encodes a series of snapshots of a game, in chronological order, storing a keyframe
+    (the snapshot as is) every keyframe_interval snapshots and deltas in between, each from the
+    one before.
+
+    :param snapshots:         A list of LB_STRUCTURE.session_wrapped_player_list
+    :param keyframe_interval: The most snapshots to encode per keyframe
+    '''
+    encoded = []
+    depth = 0
+    for i, snapshot in enumerate(snapshots):
+        delta = snapshot_delta(snapshots[i - 1], snapshot) if i > 0 and depth + 1 < keyframe_interval else None
+        if delta is None:
+            encoded.append(snapshot)
+            depth = 0
+        else:
+            encoded.append(delta)
+            depth += 1
+
+    return encoded
+
+
+def decode_series(encoded) -> list:
+    '''
+    Decodes a series of snapshots encoded by encode_series.
+
+    :param encoded: A list returned by encode_series
+    '''
+    isd = LB_STRUCTURE.session_data_element.value
+
+    snapshots = []
+    for snapshot in encoded:
+        if is_delta(snapshot[isd]):
+            snapshots.append(apply_snapshot_delta(snapshots[-1], snapshot))
+        else:
+            snapshots.append(immutable(snapshot))
+
+    return snapshots
+
+
+def encode_game_snapshots(leaderboard) -> tuple:
+    '''
+    Delta encodes the snapshots in a game wrapper (see encode_series), all from one keyframe. Any
+    order of snapshots will do, though the closer each is to the one before it the smaller the delta.
+
+    :param leaderboard: A LB_STRUCTURE.game_wrapped_session_wrapped_player_list
+    '''
+    igd = LB_STRUCTURE.game_data_element.value
+    snapshots = list(leaderboard[igd])
+    return tuple(leaderboard[:igd]) + (encode_series(snapshots, len(snapshots)),) + tuple(leaderboard[igd + 1:])
+
+
+def decode_game_snapshots(leaderboard) -> tuple:
+    '''
+    Decodes the snapshots in a game wrapper encoded by encode_game_snapshots (or not encoded at all).
+
+    :param leaderboard: A LB_STRUCTURE.game_wrapped_session_wrapped_player_list
+    '''
+    igd = LB_STRUCTURE.game_data_element.value
+    return immutable(leaderboard[:igd]) + (tuple(decode_series(leaderboard[igd])),) + immutable(leaderboard[igd + 1:])
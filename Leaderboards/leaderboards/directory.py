@@ -0,0 +1,223 @@
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from Site.logutils import log
+
+# models imports from this package. To avoid a circular import error we need to import models into its own namespace.
+# which means accessing a model is then models.Model
+from .. import models
+
+
+class PlayerEntry(namedtuple("PlayerEntry", ["pk", "name_nickname", "full_name", "complete_name", "BGGname", "leagues"])):
+    '''
+    What leaderboards need to know about a player, standing in for a Player object in
+    leaderboard code (it renders names as Player.name() does).
+
+    The names are as the viewer they were resolved for may see them (see style.resolve_players)
+    and so live no longer than that viewer's request.
+    '''
+    __slots__ = ()
+
+    @property
+    def name_variants(self):
+        return (self.name_nickname, self.full_name, self.complete_name)
+
+    @property
+    def name_options(self):
+        # As Player.name_options
+        return "{" + f"{self.pk}" + ",".join([v for v in self.name_variants]) + "}"
+
+    @property
+    def name_template(self):
+        # As Player.name_template
+        return fr'{{Player\.{self.pk}}}'
+
+    def name(self, style="full"):
+        return (self.name_nickname if style == "nick"
+           else self.full_name if style == "full"
+           else self.complete_name if style == "complete"
+           else self.name_options if style == "flexi"
+           else self.name_template if style == "template"
+           else "Anonymous")
+
+
+class DirectoryEntry(namedtuple("DirectoryEntry", ["pk", "leagues"])):
+    '''
+    What the PlayerDirectory knows about a player, only what any viewer may see.
+    '''
+    __slots__ = ()
+
+
+class PlayerDirectory:
+    '''
+    A process wide directory of players' league memberships for leaderboard code.
+
+    League memberships almost never change, yet every leaderboard request needs them for every
+    player on every board. So we keep them in memory, in a bounded (least recently used)
+    directory, fetching only the players we don't have yet.
+
+    Player names are not kept here. Player is a PrivacyMixIn model, its names are masked for
+    the viewer they are loaded for, and so they are resolved per request (see style.resolve_players).
+
+    A change to a player or to league memberships (see the signal receivers connected in
+    LeaderboardsConfig.ready) invalidates the directory. Each uwsgi worker has its own, so the
+    directory is versioned through the configured cache backend: an invalidation bumps the
+    shared version, and any worker that finds its directory at an older version flushes it.
+    '''
+    version_key = "player_directory_version"
+
+    _entries = OrderedDict()
+    _version = None
+    _lock = Lock()
+
+    @classmethod
+    def size(cls) -> int:
+        '''
+        The maximum number of players the directory holds.
+        '''
+        return getattr(settings, "PLAYER_DIRECTORY_SIZE", 10000)
+
+    @classmethod
+    def new_version(cls) -> int:
+        '''
+        A version to start from when the cache has none (never used before, so that no process
+        mistakes it for the version it has).
+        '''
+        return int(time() * 1000)
+
+    @classmethod
+    def shared_version(cls) -> int:
+        '''
+        The version of the directory that all processes agree on.
+        '''
+        version = cache.get(cls.version_key)
+        if version is None:
+            # add() so that two processes starting up don't trample a bump
+            cache.add(cls.version_key, cls.new_version(), timeout=None)
+            version = cache.get(cls.version_key)
+        return version
+
+    @classmethod
+    def _sync(cls):
+        '''
+        Flushes this process's directory if another process has invalidated it.
+        '''
+        version = cls.shared_version()
+        if version != cls._version:
+            if settings.DEBUG and cls._version is not None:
+                log.debug(f"Player directory is at version {cls._version}, flushing it for version {version}.")
+            cls._entries.clear()
+            cls._version = version
+
+    @classmethod
+    def _fetch(cls, player_pks) -> dict:
+        '''
+        Fetches the entries for a set of player pks from the database, in two queries.
+
+        :param player_pks: A set of player pks
+        '''
+        Player = models.Player
+
+        # Only the pks, no (private) player fields
+        player_pks = set(Player.objects.filter(pk__in=player_pks).values_list('pk', flat=True))
+
+        leagues = {pk: [] for pk in player_pks}
+        memberships = (Player.leagues.through.objects
+                       .filter(player_id__in=player_pks)
+                       .order_by('league_id')
+                       .values_list('player_id', 'league_id'))
+
+        for player_pk, league_pk in memberships:
+            leagues[player_pk].append(league_pk)
+
+        return {pk: DirectoryEntry(pk, tuple(leagues[pk])) for pk in player_pks}
+
+    @classmethod
+    def get_many(cls, player_pks) -> dict:
+        '''
+        Returns a dict keyed on player pk of DirectoryEntry objects for the requested players.
+        Players that don't exist are not in it.
+
+        :param player_pks: An iterable of player pks
+        '''
+        player_pks = set(player_pks)
+        if not player_pks:
+            return {}
+
+        with cls._lock:
+            cls._sync()
+
+            found = {}
+            for pk in player_pks:
+                if pk in cls._entries:
+                    cls._entries.move_to_end(pk)
+                    found[pk] = cls._entries[pk]
+
+            missing = player_pks - found.keys()
+            if missing:
+                fetched = cls._fetch(missing)
+                found.update(fetched)
+                cls._entries.update(fetched)
+
+                while len(cls._entries) > cls.size():
+                    cls._entries.popitem(last=False)
+
+        return found
+
+    @classmethod
+    def invalidate(cls, player_pks=None):
+        '''
+        Invalidates the directory in this process and all others.
+
+        :param player_pks: The players that changed, else all of them.
+        '''
+        with cls._lock:
+            if player_pks is None:
+                cls._entries.clear()
+            else:
+                for pk in player_pks:
+                    cls._entries.pop(pk, None)
+
+        try:
+            cache.incr(cls.version_key)
+        except ValueError:
+            # The version isn't in the cache (yet, or any more)
+            cache.set(cls.version_key, cls.new_version(), timeout=None)
+
+        if settings.DEBUG:
+            log.debug(f"Invalidated the player directory for {'all players' if player_pks is None else player_pks}.")
+
+
+def invalidate_on_commit(player_pks=None):
+    '''
+    Invalidates the directory once the change is committed (lest another process fetch the
+    old data again after we invalidate it).
+
+    :param player_pks: The players that changed, else all of them.
+    '''
+    transaction.on_commit(lambda: PlayerDirectory.invalidate(player_pks))
+
+
+def player_saved_or_deleted(sender, instance, **kwargs):
+    '''
+    A post_save and post_delete receiver for Player.
+    '''
+    invalidate_on_commit([instance.pk])
+
+
+def league_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    '''
+    An m2m_changed receiver for League.players (the same relation as Player.leagues).
+    '''
+    # The change can be made through a player's leagues or a league's players
+    through_player = isinstance(instance, models.Player)
+
+    if action in ("post_add", "post_remove"):
+        invalidate_on_commit([instance.pk] if through_player else set(pk_set))
+    elif action == "post_clear":
+        invalidate_on_commit([instance.pk] if through_player else None)
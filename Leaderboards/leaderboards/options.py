@@ -955,13 +955,16 @@ class leaderboard_options:
               or self.is_enabled('player_leagues_all')
               or self.is_enabled('select_players'))
 
-    def player_nominated(self, player_pk):
+    def player_nominated(self, player_pk, session_players=()):
         '''
         Returns True if a player was nominated specifically to be listed.
+
+        :param player_pk:       The player's pk (as a string)
+        :param session_players: The pks (as strings) of the players in the session of the snapshot being filtered (see apply)
         '''
         in_or_ex = (self.is_enabled('players_in') or self.is_enabled('players_ex'))
         sel = self.select_players
-        return (in_or_ex and player_pk in self.players) or (sel and player_pk in getattr(self, 'session_players', []))
+        return (in_or_ex and player_pk in self.players) or (sel and player_pk in session_players)
 
     def player_in_league(self, player_pk, league_pks):
         '''
@@ -1032,13 +1035,14 @@ class leaderboard_options:
         leaderboard = leaderboard_snapshot[LB_STRUCTURE.session_data_element.value]
 
         # Capture the session players as a list of PKs (as strings)
+        # (not on self, as the leaderboards of different games may be filtered concurrently)
         player_source = leaderboard_snapshot[LB_STRUCTURE.session_players_element.value]
         if isinstance(player_source, (list, tuple)):
-            self.session_players = [str(p) for p in player_source]
+            session_players = [str(p) for p in player_source]
         elif isinstance(player_source, dict):
-            self.session_players = [str(p) for p in player_source.keys()]
+            session_players = [str(p) for p in player_source.keys()]
         else:
-            self.session_players = []
+            session_players = []
 
         # leaderboard is a well defined list of tuples that contain player info/metadata
         # The list is ordered by ranking.
@@ -1059,8 +1063,8 @@ class leaderboard_options:
                 leagues = p[12]
 
                 # If the player is explicitly nominated respect that
-                if self.player_nominated(pk):
-                    if (pk in self.players) or (self.select_players and pk in self.session_players):
+                if self.player_nominated(pk, session_players):
+                    if (pk in self.players) or (self.select_players and pk in session_players):
                         lbf.append(p)
                     continue
 
@@ -1088,7 +1092,7 @@ class leaderboard_options:
                     # i goes from 0 to lo.num_players_above-1
                     start = rank
                     for i in range(self.num_players_above):
-                        if start + i < len(leaderboard) and self.player_nominated(leaderboard[start + i][1]):
+                        if start + i < len(leaderboard) and self.player_nominated(leaderboard[start + i][1], session_players):
                             lbf.append(p)
                             continue
 
@@ -1101,7 +1105,7 @@ class leaderboard_options:
                     # i goes from 0 to lo.num_players_above-1
                     start = rank - 2
                     for i in range(self.num_players_below):
-                        if start - i >= 0 and self.player_nominated(leaderboard[start - i][1]):
+                        if start - i >= 0 and self.player_nominated(leaderboard[start - i][1], session_players):
                             lbf.append(p)
                             continue
 
@@ -1357,12 +1361,13 @@ class leaderboard_options:
                 gfilter &= Q(sessions__date_time__lte=self.as_at)
 
         # Choose the ordering in preparation for a top n filter
+        # (ending with the pk so that the order is total, and pages of it are stable)
         if self.is_enabled('latest_games'):
-            order_games_by = ('-last_play',)
+            order_games_by = ('-last_play', 'pk')
         # If we want the top n games or not by default sort the games by popularity,
         # We only sort them temporally if explicitlyw anting the n latest games.
         else:
-            order_games_by = ('-play_count', '-session_count')
+            order_games_by = ('-play_count', '-session_count', 'pk')
 
         # Apply the game selector(s)
         filtered_games = games.filter(gfilter).order_by(*order_games_by).distinct()
@@ -0,0 +1,179 @@
+'''
+A compact packed encoding of leaderboard snapshots (for the leaderboard cache).
+
+A snapshot (LB_STRUCTURE.session_wrapped_player_list) with a player list in the
+LB_PLAYER_LIST_STYLE.data style is stored in JSON as nested lists of player tuples,
+which is slow to decode and to convert back to tuples (immutable). Packed, the
+player list is stored in columns instead, parallel arrays of:
+
+    pk, eta, mu, sigma, plays, victories, last_play (as a timestamp and UTC offset)
+
+which unpack with struct in one call each. The session metadata and the HTML headers
+(which in practice all list the same session players with the same data) are stored
+as a small JSON document with a shared table of strings, so each distinct string or
+header data list is stored and decoded only once.
+
+Layout (little-endian):
+
+    MAGIC (3 bytes)
+    length of the JSON document (4 bytes), and the JSON document
+    number of players, n (4 bytes)
+    pk[n], plays[n], victories[n] (unsigned 32 bit)
+    eta[n], mu[n], sigma[n], last_play[n] (64 bit float, last_play NaN for None)
+    last_play offset[n] (signed 16 bit, minutes east of UTC)
+'''
+import json
+import struct
+
+from datetime import datetime, timedelta, timezone
+from math import isnan, nan
+
+from django_rich_views.serializers import TypedEncoder, TypedDecoder
+
+from .enums import LB_STRUCTURE
+from .util import immutable
+
+MAGIC = b'LB\x01'
+
+# The elements of the session wrapper, other than the HTML headers and player list
+_metadata_elements = (0, 1, 2, 3, LB_STRUCTURE.session_players_element.value)
+
+
+class PackingError(ValueError):
+    '''
+    Raised when a snapshot cannot be packed (it is not in the data style) or unpacked (it is not packed).
+    '''
+
+
+def is_packable(snapshot) -> bool:
+    '''
+    True if a snapshot can be packed, that is a session wrapped player list in the data style.
+
+    :param snapshot: A LB_STRUCTURE.session_wrapped_player_list
+    '''
+    if not isinstance(snapshot, (list, tuple)) or len(snapshot) != LB_STRUCTURE.session_data_element.value + 1:
+        return False
+
+    player_list = snapshot[LB_STRUCTURE.session_data_element.value]
+    return all(isinstance(p, (list, tuple)) and len(p) == 7 for p in player_list)
+
+
+def pack_player_list(player_list) -> bytes:
+    '''
+    Packs a player list in the LB_PLAYER_LIST_STYLE.data style into columns.
+
+    :param player_list: A list of (pk, eta, mu, sigma, plays, victories, last_play) tuples
+    '''
+    n = len(player_list)
+    columns = list(zip(*player_list)) if n else [()] * 7
+    (pks, etas, mus, sigmas, plays, victories, last_plays) = columns
+
+    timestamps = [nan if t is None else t.timestamp() for t in last_plays]
+    offsets = [0 if t is None or t.utcoffset() is None else int(t.utcoffset().total_seconds() // 60) for t in last_plays]
+
+    return (struct.pack('<I', n)
+          +struct.pack(f'<{3 * n}I', *pks, *plays, *victories)
+          +struct.pack(f'<{4 * n}d', *etas, *mus, *sigmas, *timestamps)
+          +struct.pack(f'<{n}h', *offsets))
+
+
+def unpack_player_list(data, offset=0) -> tuple:
+    '''
+    Unpacks a player list packed by pack_player_list, as a tuple of player tuples.
+
+    :param data:   The packed bytes
+    :param offset: Where in data the player list starts
+    '''
+    (n,) = struct.unpack_from('<I', data, offset)
+    offset += 4
+
+    integers = struct.unpack_from(f'<{3 * n}I', data, offset)
+    offset += 12 * n
+    floats = struct.unpack_from(f'<{4 * n}d', data, offset)
+    offset += 32 * n
+    offsets = struct.unpack_from(f'<{n}h', data, offset)
+
+    pks, plays, victories = integers[:n], integers[n:2 * n], integers[2 * n:]
+    etas, mus, sigmas, timestamps = floats[:n], floats[n:2 * n], floats[2 * n:3 * n], floats[3 * n:]
+
+    tzs = {}
+
+    def last_play(timestamp, minutes):
+        if isnan(timestamp):
+            return None
+        if not minutes in tzs:
+            tzs[minutes] = timezone(timedelta(minutes=minutes))
+        return datetime.fromtimestamp(timestamp, tz=tzs[minutes])
+
+    return tuple(zip(pks, etas, mus, sigmas, plays, victories, map(last_play, timestamps, offsets)))
+
+
+def pack_snapshot(snapshot) -> bytes:
+    '''
+    Packs a leaderboard snapshot (see the module docstring).
+
+    :param snapshot: A LB_STRUCTURE.session_wrapped_player_list in the LB_PLAYER_LIST_STYLE.data style
+    '''
+    if not is_packable(snapshot):
+        raise PackingError("Only session wrapped player lists in the data style can be packed.")
+
+    strings = []
+    index = {}
+
+    def intern(s):
+        if not s in index:
+            index[s] = len(strings)
+            strings.append(s)
+        return index[s]
+
+    # Each HTML header is an (html, data) pair. The html is a string, and the data we store as
+    # a JSON string, so that identical data (common across the headers) is stored once.
+    headers = [[intern(html), intern(json.dumps(data, cls=TypedEncoder))]
+               for (html, data) in (snapshot[i] for i in LB_STRUCTURE.session_html_elements.value)]
+
+    document = json.dumps({'meta': [snapshot[i] for i in _metadata_elements],
+                           'strings': strings,
+                           'headers': headers}, cls=TypedEncoder).encode()
+
+    try:
+        player_list = pack_player_list(snapshot[LB_STRUCTURE.session_data_element.value])
+    except (struct.error, TypeError, AttributeError) as E:
+        raise PackingError(f"Cannot pack the player list: {E}")
+
+    return (MAGIC
+          +struct.pack('<I', len(document))
+          +document
+          +player_list)
+
+
+def unpack_snapshot(data) -> tuple:
+    '''
+    Unpacks a leaderboard snapshot packed by pack_snapshot, as an immutable snapshot.
+
+    :param data: The packed bytes
+    '''
+    data = bytes(data)  # The database may deliver a memoryview
+
+    if not data.startswith(MAGIC):
+        raise PackingError("Not a packed leaderboard snapshot.")
+
+    offset = len(MAGIC)
+    (length,) = struct.unpack_from('<I', data, offset)
+    offset += 4
+
+    document = json.loads(data[offset:offset + length], cls=TypedDecoder)
+    offset += length
+
+    strings = document['strings']
+    decoded = {}
+
+    def header_data(i):
+        if not i in decoded:
+            decoded[i] = immutable(json.loads(strings[i], cls=TypedDecoder))
+        return decoded[i]
+
+    headers = tuple((strings[html], header_data(header)) for html, header in document['headers'])
+
+    meta = immutable(document['meta'])
+
+    return meta + headers + (unpack_player_list(data, offset),)
@@ -1,12 +1,55 @@
+from crequest.middleware import CrequestMiddleware
+
 from .enums import LB_STRUCTURE, LB_PLAYER_LIST_STYLE
 from .util import mutable, immutable
+from .directory import PlayerDirectory, PlayerEntry
 
 # models imports from this module. To avoid a circular import error we need to import models into its own namespace.
 # which means accessing a model is then models.Model
 from .. import models
 
 
-def styled_player_tuple(player_list_tuple, rank=None, style=LB_PLAYER_LIST_STYLE.rich, names="nick"):
+def resolve_players(player_pks) -> dict:
+    '''
+    Resolves the players with the given pks, at once.
+
+    Styling a leaderboard needs the player of every entry, and styling a leaderboard that
+    is a series of snapshots the player of every entry of every snapshot. Fetching them
+    one at a time costs thousands of queries for a big board, so we collect the pks first
+    and resolve them all at once. Returns a dict keyed on player pk of PlayerEntry objects.
+    Players that don't exist are not in it.
+
+    Player names are private (Player is a PrivacyMixIn model), masked for the viewer of the
+    current request when the players are loaded. So they are fetched for, and remembered on,
+    the current request only, and never shared with another viewer. League memberships, which
+    are not private, come from the process wide PlayerDirectory.
+
+    :param player_pks: An iterable of player pks
+    '''
+    player_pks = set(player_pks)
+
+    request = CrequestMiddleware.get_request()
+    resolved = getattr(request, "_resolved_players", {})
+
+    missing = player_pks - resolved.keys()
+    if missing:
+        directory = PlayerDirectory.get_many(missing)
+
+        for pk, player in models.Player.objects.in_bulk(missing).items():
+            resolved[pk] = PlayerEntry(pk,
+                                       player.name_nickname,
+                                       player.full_name,
+                                       player.complete_name,
+                                       '' if 'BGGname' in player.hidden else player.BGGname,
+                                       directory[pk].leagues if pk in directory else ())
+
+        if request is not None:
+            request._resolved_players = resolved
+
+    return {pk: resolved[pk] for pk in player_pks if pk in resolved}
+
+
+def styled_player_tuple(player_list_tuple, rank=None, style=LB_PLAYER_LIST_STYLE.rich, names="nick", players=None):
     '''
     Takes a tuple styled after LB_PLAYER_LIST_STYLE.data and returns a styled tuple as requested.
 
@@ -17,16 +60,21 @@ def styled_player_tuple(player_list_tuple, rank=None, style=LB_PLAYER_LIST_STYLE
     :param rank:  Rank on the leaderboard 1, 2, 3, 4 etc
     :param style: A LB_PLAYER_LIST_STYLE to return
     :param names: A style for rendering names
+    :param players: Optionally, players resolved already (see resolve_players)
     '''
     (player_pk, trueskill_eta, trueskill_mu, trueskill_sigma, plays, victories, last_play) = player_list_tuple
 
-    player = models.Player.objects.get(pk=player_pk)
+    if style == LB_PLAYER_LIST_STYLE.data:
+        return immutable(player_list_tuple)
+
+    if players is None:
+        players = resolve_players([player_pk])
 
-    try:
-        player = models.Player.objects.get(pk=player_pk)
+    if player_pk in players:
+        player = players[player_pk]
         player_name = player.name(names)
-        player_leagues = player.leagues.all()
-    except models.Player.DoesNotExist:
+        player_leagues = player.leagues
+    else:
         player = None  # TODO: what to do?
         player_name = "<unknown>"
         player_leagues = []
@@ -62,14 +110,14 @@ def styled_player_tuple(player_list_tuple, rank=None, style=LB_PLAYER_LIST_STYLE
                     *name_variants, # Unpacked name variants
                     *trueskill_rating, # Unpacked trueskill rating
                     *play_stats, # Unpacked play stats
-                    [l.pk for l in player_leagues])
+                    list(player_leagues))
     else:
         raise ValueError(f"Programming error in Game.leaderboard(): Illegal style submitted: {style}")
 
     return immutable(lb_entry)
 
 
-def styled_player_list(player_list, style=LB_PLAYER_LIST_STYLE.rich, names="nick"):
+def styled_player_list(player_list, style=LB_PLAYER_LIST_STYLE.rich, names="nick", players=None):
     '''
     Takes a list of tuples styled after LB_PLAYER_LIST_STYLE.data and returns a list of styled tuples as requested.
 
@@ -77,10 +125,14 @@ def styled_player_list(player_list, style=LB_PLAYER_LIST_STYLE.rich, names="nick
     :param rank:  Rank on the leaderboard 1, 2, 3, 4 etc
     :param style: A LB_PLAYER_LIST_STYLE to return
     :param names: A style for rendering names
+    :param players: Optionally, players resolved already (see resolve_players), else they are resolved here in one go
     '''
+    if players is None and style != LB_PLAYER_LIST_STYLE.data:
+        players = resolve_players([player_tuple[0] for player_tuple in player_list])
+
     styled_list = []
     for i, player_tuple in enumerate(player_list):
-        styled_list.append(styled_player_tuple(player_tuple, rank=i + 1, style=style, names=names))
+        styled_list.append(styled_player_tuple(player_tuple, rank=i + 1, style=style, names=names, players=players))
 
     return immutable(styled_list)
 
@@ -124,9 +176,21 @@ def restyle_leaderboard(leaderboards, structure=LB_STRUCTURE.game_wrapped_sessio
         player_lists = [_leaderboards]
 
     # STEP 2:
-    # Restyle the player lists to the target style
+    # Resolve all the players we'll need (those on the player lists and, in the rich style,
+    # the session players) at once, and restyle the player lists to the target style
+    player_pks = {player_tuple[0] for pl in player_lists for player_tuple in pl}
+
+    if style == LB_PLAYER_LIST_STYLE.rich:
+        if structure == LB_STRUCTURE.session_wrapped_player_list:
+            player_pks.update(_leaderboards[isp])
+        elif structure == LB_STRUCTURE.game_wrapped_session_wrapped_player_list:
+            for sw in (_leaderboards[igd] if snaps else [_leaderboards[igd]]):
+                player_pks.update(sw[isp])
+
+    players = resolve_players(player_pks) if style != LB_PLAYER_LIST_STYLE.data else None
+
     for i, pl in enumerate(player_lists):
-        player_lists[i] = styled_player_list(pl, style=style, names=names)
+        player_lists[i] = styled_player_list(pl, style=style, names=names, players=players)
 
     # STEP 3:
     # Now insert the restyled player lits back into the structured lederboards
@@ -162,7 +226,7 @@ def restyle_leaderboard(leaderboards, structure=LB_STRUCTURE.game_wrapped_sessio
             try:
                 sw[isp] = {}
                 for pk in player_pks:
-                    _leaderboards[isp][pk] = models.Player.objects.get(pk=pk).name_variants
+                    _leaderboards[isp][pk] = players[pk].name_variants
             except Exception as E:
                 sw[isp] = player_pks
 
@@ -180,7 +244,7 @@ def restyle_leaderboard(leaderboards, structure=LB_STRUCTURE.game_wrapped_sessio
                 try:
                     sw[isp] = {}
                     for pk in player_pks:
-                        sw[isp][pk] = models.Player.objects.get(pk=pk).name_variants
+                        sw[isp][pk] = players[pk].name_variants
                 except Exception as E:
                     sw[isp] = player_pks
 
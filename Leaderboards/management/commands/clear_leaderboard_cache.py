@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 # code is in the public domain
 #
-# ./manage.py clear_leaderbord_cache
+# ./manage.py clear_leaderbord_cache [--stale]
 u'''
 
 Management command to clear the leaderboard cache
 
-Usage: manage.py clear_leaderbord_cache
+With --stale deletes only the entries that were invalidated (garbage collection).
+
+Usage: manage.py clear_leaderbord_cache [--stale]
 '''
 from django.core.management.base import BaseCommand
 from django.db.transaction import atomic
@@ -14,6 +16,13 @@ from django.db.transaction import atomic
 from Leaderboards.models.leaderboards import Leaderboard_Cache
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', action='store_true', help='Delete only the stale (invalidated) entries')
+
     @atomic
     def handle(self, *args, **options):
-        Leaderboard_Cache.clear()
\ No newline at end of file
+        if options['stale']:
+            deleted = Leaderboard_Cache.collect_garbage()
+            self.stdout.write(f"Deleted {deleted} stale leaderboard cache entries.")
+        else:
+            Leaderboard_Cache.clear()
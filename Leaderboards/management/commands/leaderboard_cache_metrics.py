@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# code is in the public domain
+#
+# ./manage.py leaderboard_cache_metrics [--reset]
+u'''
+
+Management command to report the leaderboard cache metrics
+
+Reports the hits and misses on each tier of the leaderboard cache (see
+Leaderboard_Cache.metrics), counted across all processes since they were last reset.
+
+Usage: manage.py leaderboard_cache_metrics [--reset]
+'''
+from django.core.management.base import BaseCommand
+
+from Leaderboards.models.leaderboards import Leaderboard_Cache
+
+
+class Command(BaseCommand):
+    help = 'Reports the hit rates of the leaderboard cache tiers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the metrics after reporting them')
+
+    def handle(self, *args, **options):
+        metrics = Leaderboard_Cache.metrics()
+
+        def rate(r):
+            return "n/a" if r is None else f"{r:.1%}"
+
+        self.stdout.write(f"L1 (memcached): {metrics['l1_hits']} hits, {metrics['l1_misses']} misses, hit rate {rate(metrics['l1_hit_rate'])}")
+        self.stdout.write(f"L2 (database):  {metrics['l2_hits']} hits, {metrics['l2_misses']} misses, hit rate {rate(metrics['l2_hit_rate'])}")
+        self.stdout.write(f"Overall hit rate {rate(metrics['hit_rate'])}")
+
+        if options['reset']:
+            Leaderboard_Cache.reset_metrics()
+            self.stdout.write("Metrics reset.")
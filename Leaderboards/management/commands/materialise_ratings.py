@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# code is in the public domain
+#
+# ./manage.py materialise_ratings [--game pk] [--player pk]
+u'''
+
+Management command to materialise ratings
+
+Recomputes the Rating rows from the latest Performance of each player at each game
+(see Rating.materialise). No TrueSkill calculations are performed, the ratings are
+simply brought into line with the performances they summarise.
+
+With no options materialises ALL ratings.
+
+Usage: manage.py materialise_ratings [--game pk] [--player pk]
+'''
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from Leaderboards.models import Game, Player, Rating
+
+
+class Command(BaseCommand):
+    help = 'Recomputes ratings from the latest performances, optionally for one game and/or player.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', type=int, help='The pk of a game to materialise ratings for')
+        parser.add_argument('--player', type=int, help='The pk of a player to materialise ratings for')
+
+    def handle(self, *args, **options):
+        games = None
+        if options['game']:
+            if not Game.objects.filter(pk=options['game']).exists():
+                raise CommandError(f"Game {options['game']} does not exist.")
+            games = [options['game']]
+
+        players = None
+        if options['player']:
+            if not Player.objects.filter(pk=options['player']).exists():
+                raise CommandError(f"Player {options['player']} does not exist.")
+            players = [options['player']]
+
+        with transaction.atomic():
+            updated, created = Rating.materialise(games, players)
+
+        self.stdout.write(f"Materialised {updated} ratings and created {created}.")
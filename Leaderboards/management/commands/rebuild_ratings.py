@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# code is in the public domain
+#
+# ./manage.py rebuild_ratings [--game pk] [--from datetime] [--in-memory] [--processes n] [--checkpoint n] [--reason text]
+# ./manage.py rebuild_ratings --resume pk [--checkpoint n]
+u'''
+
+Management command to rebuild ratings
+
+With no options rebuilds ALL ratings. A rebuild of all games can be partitioned
+by game and run in parallel worker processes with --processes.
+
+With --checkpoint the rebuild commits in batches of that many sessions and if it
+dies can be resumed from the last batch with --resume (the pk of its RebuildLog).
+
+After the rebuild it warms the leaderboard cache for the rebuilt sessions (if
+settings.WARM_LEADERBOARD_CACHE_AFTER_REBUILD).
+
+Usage: manage.py rebuild_ratings [--game pk] [--from datetime] [--in-memory] [--processes n] [--checkpoint n] [--reason text]
+       manage.py rebuild_ratings --resume pk [--checkpoint n]
+'''
+from django.core.management.base import BaseCommand, CommandError
+
+from django_rich_views.datetime import decodeDateTime
+
+from Leaderboards.models import Game, Rating, RebuildLog, Leaderboard_Cache, RATING_REBUILD_TRIGGER
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds ratings, optionally for one game and/or from a given time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', type=int, help='The pk of a game to rebuild ratings for')
+        parser.add_argument('--from', dest='from', help='A date/time to rebuild ratings from')
+        parser.add_argument('--in-memory', action='store_true', help='Use the in-memory replay engine')
+        parser.add_argument('--processes', type=int, default=None, help='Partition a rebuild of all games across this many processes')
+        parser.add_argument('--checkpoint', type=int, default=None, help='Commit the rebuild in batches of this many sessions')
+        parser.add_argument('--resume', type=int, default=None, help='The pk of the RebuildLog of a checkpointed rebuild to resume')
+        parser.add_argument('--reason', default="Rebuild requested by management command.")
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                rlog = RebuildLog.objects.get(pk=options['resume'])
+            except RebuildLog.DoesNotExist:
+                raise CommandError(f"RebuildLog {options['resume']} does not exist.")
+
+            if rlog.complete:
+                raise CommandError(f"RebuildLog {rlog.pk} is complete, there is nothing to resume.")
+
+            rlog = Rating.resume(rlog, Checkpoint=options['checkpoint'])
+
+            self.stdout.write(f"Resumed and completed a rebuild of {rlog.ratings} sessions in {rlog.duration} (RebuildLog {rlog.pk}).")
+            self.warm(rlog)
+            return
+
+        game = None
+        if options['game']:
+            try:
+                game = Game.objects.get(pk=options['game'])
+            except Game.DoesNotExist:
+                raise CommandError(f"Game {options['game']} does not exist.")
+
+        From = None
+        if options['from']:
+            try:
+                From = decodeDateTime(options['from'])
+            except Exception:
+                raise CommandError(f"Cannot interpret '{options['from']}' as a date/time.")
+
+        rlog = Rating.rebuild(Game=game, From=From, Reason=options['reason'], Trigger=RATING_REBUILD_TRIGGER.user_request,
+                              InMemory=options['in_memory'], Processes=options['processes'], Checkpoint=options['checkpoint'])
+
+        if rlog is None:
+            self.stdout.write("There were no sessions to rebuild.")
+            return
+
+        self.stdout.write(f"Rebuilt {rlog.ratings} sessions in {rlog.duration} (RebuildLog {rlog.pk}).")
+        for game, duration in rlog.partition_durations.items():
+            self.stdout.write(f"\t{game}: {duration}")
+
+        self.warm(rlog)
+
+    def warm(self, rlog):
+        report = Leaderboard_Cache.warm_after_rebuild(rlog)
+        if report:
+            self.stdout.write(f"Warmed {report['built']} leaderboards in {report['duration']:.1f}s.")
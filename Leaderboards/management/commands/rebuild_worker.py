@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# code is in the public domain
+#
+# ./manage.py rebuild_worker [--once] [--poll seconds] [--in-memory]
+u'''
+
+Management command to run a rating rebuild worker
+
+Performs queued rating rebuilds (RebuildJob) one at a time, oldest first, polling
+the queue for new jobs. Multiple workers can run concurrently, each claims its own
+jobs. After each rebuild it warms the leaderboard cache for the rebuilt sessions (if
+settings.WARM_LEADERBOARD_CACHE_AFTER_REBUILD).
+
+Usage: manage.py rebuild_worker [--once] [--poll seconds] [--in-memory]
+'''
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Leaderboards.models import RebuildJob, Leaderboard_Cache
+
+
+class Command(BaseCommand):
+    help = 'Performs queued rating rebuilds.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Perform the pending jobs and exit')
+        parser.add_argument('--poll', type=float, default=5, help='Seconds to wait between checks of an empty queue')
+        parser.add_argument('--in-memory', action='store_true', help='Use the in-memory replay engine')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = RebuildJob.claim()
+
+            if job:
+                self.stdout.write(f"Rebuilding {job.sessions_total} sessions (RebuildJob {job.pk}): {job.reason}")
+                job.run(InMemory=options['in_memory'])
+                self.stdout.write(f"\t{job}")
+
+                if job.rebuild_log:
+                    report = Leaderboard_Cache.warm_after_rebuild(job.rebuild_log)
+                    if report:
+                        self.stdout.write(f"\tWarmed {report['built']} leaderboards in {report['duration']:.1f}s.")
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['poll'])
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# code is in the public domain
+#
+# ./manage.py warm_leaderboard_cache [--game pk] [--from datetime] [--rebuild pk] [--workers n] [--recreate]
+u'''
+
+Management command to warm the leaderboard cache
+
+Builds the cached leaderboard snapshots (see Leaderboard_Cache.warm) of sessions that
+have none, in parallel worker threads, and reports the cache coverage and timings.
+
+With no options warms the cache for ALL sessions. With --rebuild, for the sessions
+a rating rebuild touched (the pk of its RebuildLog). With --recreate, rebuilds the
+snapshots that are already cached too.
+
+Usage: manage.py warm_leaderboard_cache [--game pk] [--from datetime] [--rebuild pk] [--workers n] [--recreate]
+'''
+from django.core.management.base import BaseCommand, CommandError
+
+from django_rich_views.datetime import decodeDateTime
+
+from Leaderboards.models import Game, Session, RebuildLog
+from Leaderboards.models.leaderboards import Leaderboard_Cache
+
+
+class Command(BaseCommand):
+    help = 'Builds the missing leaderboard cache entries, optionally for one game, from a given time or for one rebuild.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', type=int, help='The pk of a game to warm the cache for')
+        parser.add_argument('--from', dest='from', help='A date/time to warm the cache from')
+        parser.add_argument('--rebuild', type=int, help='The pk of a RebuildLog whose sessions to warm the cache for')
+        parser.add_argument('--workers', type=int, default=None, help='The number of worker threads')
+        parser.add_argument('--recreate', action='store_true', help='Rebuild cache entries that exist too')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            try:
+                sessions = RebuildLog.objects.get(pk=options['rebuild']).rebuilt_sessions
+            except RebuildLog.DoesNotExist:
+                raise CommandError(f"RebuildLog {options['rebuild']} does not exist.")
+        else:
+            sessions = Session.objects.all()
+
+        if options['game']:
+            if not Game.objects.filter(pk=options['game']).exists():
+                raise CommandError(f"Game {options['game']} does not exist.")
+            sessions = sessions.filter(game=options['game'])
+
+        if options['from']:
+            try:
+                sessions = sessions.filter(date_time__gte=decodeDateTime(options['from']))
+            except Exception:
+                raise CommandError(f"Cannot interpret '{options['from']}' as a date/time.")
+
+        def progress(done, total):
+            self.stdout.write(f"\tCached {done} of {total} sessions.")
+
+        report = Leaderboard_Cache.warm(sessions, workers=options['workers'], recreate=options['recreate'], progress=progress)
+
+        self.stdout.write(f"Coverage: {report['cached_before']} of {report['sessions']} sessions were cached, now {report['cached_after']} are.")
+        self.stdout.write(f"Built {report['built']} snapshots ({report['failed']} failed) with {report['workers']} workers in {report['duration']:.1f}s.")
+        if report['built']:
+            self.stdout.write(f"Snapshots took {report['mean_build']:.2f}s on average, the slowest {report['max_build']:.2f}s (session {report['slowest_session']}).")
@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-17 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0012_alter_game_source_alter_game_tourneys_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rebuildlog',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='partitions', to='Leaderboards.rebuildlog'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-17 10:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import timezone_field.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Leaderboards', '0013_rebuildlog_parent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RebuildJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(editable=False, null=True, verbose_name='Time of Creation')),
+                ('created_on_tz', timezone_field.fields.TimeZoneField(default='Australia/Hobart', editable=False, verbose_name='Time of Creation, Timezone')),
+                ('last_edited_on', models.DateTimeField(editable=False, null=True, verbose_name='Time of Last Edit')),
+                ('last_edited_on_tz', timezone_field.fields.TimeZoneField(default='Australia/Hobart', editable=False, verbose_name='Time of Last Edit, Timezone')),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'Pending'), (1, 'Running'), (2, 'Done'), (3, 'Failed')], default=0)),
+                ('trigger', models.PositiveSmallIntegerField(choices=[(0, 'User Request'), (1, 'Session Add'), (2, 'Session Edit'), (3, 'Session Delete')], default=0)),
+                ('reason', models.TextField(verbose_name='Reason for Rebuild')),
+                ('sessions_total', models.PositiveIntegerField(default=0, verbose_name='Number of Sessions to Rebuild')),
+                ('sessions_done', models.PositiveIntegerField(default=0, verbose_name='Number of Sessions Rebuilt')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Time the Rebuild Started')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Time the Rebuild Finished')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Reason for Failure')),
+                ('change_logs', models.ManyToManyField(blank=True, related_name='rebuild_jobs', to='Leaderboards.changelog')),
+                ('created_by', models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)ss_created', to=settings.AUTH_USER_MODEL, verbose_name='Created By')),
+                ('games', models.ManyToManyField(blank=True, related_name='rebuild_jobs', to='Leaderboards.game')),
+                ('last_edited_by', models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)ss_last_edited', to=settings.AUTH_USER_MODEL, verbose_name='Last Edited By')),
+                ('rebuild_log', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rebuild_jobs', to='Leaderboards.rebuildlog')),
+                ('session', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rebuild_jobs_triggered', to='Leaderboards.session', verbose_name='Session')),
+                ('sessions', models.ManyToManyField(blank=True, related_name='rebuild_jobs', to='Leaderboards.session')),
+            ],
+            options={
+                'verbose_name': 'Rebuild Job',
+                'verbose_name_plural': 'Rebuild Jobs',
+                'get_latest_by': 'created_on',
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2 on 2026-10-17 11:40
+
+from django.db import migrations, models
+from django.db.models import Q, F, OuterRef, Exists
+import django.db.models.deletion
+
+
+def link_performances(apps, schema_editor):
+    '''
+    Builds the adjacency index (previous, latest_victory) for all existing performances.
+    The same walk as Performance.link(), but on the historic models.
+    '''
+    Performance = apps.get_model('Leaderboards', 'Performance')
+    Rank = apps.get_model('Leaderboards', 'Rank')
+
+    sfilter = Q(session=OuterRef('session')) & Q(rank=1)
+    pfilter = Q(player=OuterRef('player')) | Q(team__players=OuterRef('player'))
+    won = Exists(Rank.objects.filter(sfilter & pfilter))
+
+    performances = (Performance.objects.filter(player__isnull=False)
+                    .annotate(won=won, game_pk=F('session__game'))
+                    .order_by('game_pk', 'player_id', 'session__date_time', 'session_id')
+                    .only('pk', 'player_id', 'previous_id', 'latest_victory_id'))
+
+    changed = []
+    last = {}
+    for performance in performances.iterator(chunk_size=2000):
+        key = (performance.game_pk, performance.player_id)
+        previous, victory = last.get(key, (None, None))
+
+        if performance.won:
+            victory = performance.pk
+
+        performance.previous_id = previous
+        performance.latest_victory_id = victory
+        changed.append(performance)
+
+        last[key] = (performance.pk, victory)
+
+    Performance.objects.bulk_update(changed, ['previous', 'latest_victory'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0014_rebuildjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='performance',
+            name='previous',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='following', to='Leaderboards.performance', verbose_name='Previous Performance'),
+        ),
+        migrations.AddField(
+            model_name='performance',
+            name='latest_victory',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Leaderboards.performance', verbose_name='Latest Victory'),
+        ),
+        migrations.RunPython(link_performances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-17 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0015_performance_adjacency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trueskillsettings',
+            name='effective_from',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Time these settings take effect'),
+        ),
+        migrations.AlterField(
+            model_name='rebuildlog',
+            name='trigger',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'User Request'), (1, 'Session Add'), (2, 'Session Edit'), (3, 'Session Delete'), (4, 'Settings Change')], default=0),
+        ),
+        migrations.AlterField(
+            model_name='rebuildjob',
+            name='trigger',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'User Request'), (1, 'Session Add'), (2, 'Session Edit'), (3, 'Session Delete'), (4, 'Settings Change')], default=0),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-17 14:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0016_trueskillsettings_effective_from'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backuprating',
+            name='rebuild_log',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rating_snapshots', to='Leaderboards.rebuildlog', verbose_name='Rebuild Log'),
+        ),
+    ]
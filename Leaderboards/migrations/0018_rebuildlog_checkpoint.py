@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-17 14:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0017_backuprating_rebuild_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rebuildlog',
+            name='checkpoint',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Leaderboards.session', verbose_name='Last Session Rebuilt'),
+        ),
+        migrations.AddField(
+            model_name='rebuildlog',
+            name='complete',
+            field=models.BooleanField(default=True, verbose_name='Rebuild Completed'),
+        ),
+    ]
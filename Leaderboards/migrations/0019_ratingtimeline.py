@@ -0,0 +1,78 @@
+# Generated by Django 4.2 on 2026-10-17 15:40
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.expressions import Window
+from django.db.models.functions import Lead
+import django.db.models.deletion
+import timezone_field.fields
+
+
+def record_timelines(apps, schema_editor):
+    '''
+    Records the rating timeline for all existing performances.
+    The same as RatingTimeline.record(), but on the historic models.
+    '''
+    Performance = apps.get_model('Leaderboards', 'Performance')
+    RatingTimeline = apps.get_model('Leaderboards', 'RatingTimeline')
+
+    performances = (Performance.objects.filter(player__isnull=False, session__game__isnull=False)
+                    .order_by()
+                    .annotate(game_pk=F('session__game'),
+                              date_time=F('session__date_time'),
+                              date_time_tz=F('session__date_time_tz'),
+                              next_play=Window(expression=Lead('session__date_time'),
+                                               partition_by=[F('player'), F('session__game')],
+                                               order_by=F('session__date_time').asc()))
+                    .values('pk', 'player_id', 'game_pk', 'date_time', 'date_time_tz', 'next_play',
+                            'trueskill_eta_after', 'trueskill_mu_after', 'trueskill_sigma_after',
+                            'play_number', 'victory_count'))
+
+    intervals = [RatingTimeline(game_id=p['game_pk'],
+                                player_id=p['player_id'],
+                                performance_id=p['pk'],
+                                valid_from=p['date_time'],
+                                valid_from_tz=p['date_time_tz'],
+                                valid_to=p['next_play'],
+                                trueskill_eta=p['trueskill_eta_after'],
+                                trueskill_mu=p['trueskill_mu_after'],
+                                trueskill_sigma=p['trueskill_sigma_after'],
+                                plays=p['play_number'],
+                                victories=p['victory_count'])
+                 for p in performances.iterator(chunk_size=2000)]
+
+    RatingTimeline.objects.bulk_create(intervals, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0018_rebuildlog_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingTimeline',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valid_from', models.DateTimeField(verbose_name='Time this Rating was Set')),
+                ('valid_from_tz', timezone_field.fields.TimeZoneField(default='Australia/Hobart', editable=False, verbose_name='Time this Rating was Set, Timezone')),
+                ('valid_to', models.DateTimeField(blank=True, null=True, verbose_name='Time this Rating was Superseded')),
+                ('trueskill_eta', models.FloatField(verbose_name='Trueskill Rating (η)')),
+                ('trueskill_mu', models.FloatField(verbose_name='Trueskill Mean (µ)')),
+                ('trueskill_sigma', models.FloatField(verbose_name='Trueskill Standard Deviation (σ)')),
+                ('plays', models.PositiveIntegerField(verbose_name='Play Count')),
+                ('victories', models.PositiveIntegerField(verbose_name='Victory Count')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_timeline', to='Leaderboards.game', verbose_name='Game')),
+                ('performance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rating_timeline', to='Leaderboards.performance', verbose_name='Performance')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_timeline', to='Leaderboards.player', verbose_name='Player')),
+            ],
+            options={
+                'verbose_name': 'Rating Timeline',
+                'verbose_name_plural': 'Rating Timelines',
+                'ordering': ['game', 'player', 'valid_from'],
+                'indexes': [models.Index(fields=['game', 'valid_from'], name='timeline_game_from'), models.Index(fields=['game', 'player', 'valid_from'], name='timeline_game_player_from')],
+            },
+        ),
+        migrations.RunPython(record_timelines, migrations.RunPython.noop),
+    ]
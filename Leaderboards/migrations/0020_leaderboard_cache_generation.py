@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-17 16:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0019_ratingtimeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leaderboard_cache',
+            name='generation',
+            field=models.PositiveIntegerField(default=0, verbose_name='Cache Generation'),
+        ),
+        migrations.CreateModel(
+            name='Leaderboard_Cache_Invalidation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_time_from', models.DateTimeField(blank=True, null=True, verbose_name='Invalidated From')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_cache_invalidations', to='Leaderboards.game', verbose_name='Game')),
+            ],
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2 on 2026-10-17 16:45
+
+from django.db import migrations, models
+
+from Leaderboards.leaderboards.packing import is_packable, pack_snapshot, unpack_snapshot
+
+
+def pack_boards(apps, schema_editor):
+    '''
+    Packs the cached boards that can be (see Leaderboard_Cache.entry).
+    '''
+    Leaderboard_Cache = apps.get_model('Leaderboards', 'Leaderboard_Cache')
+
+    packed = []
+    for entry in Leaderboard_Cache.objects.filter(board__isnull=False).iterator(chunk_size=500):
+        if is_packable(entry.board):
+            entry.packed = pack_snapshot(entry.board)
+            entry.board = None
+            packed.append(entry)
+
+    Leaderboard_Cache.objects.bulk_update(packed, ['board', 'packed'], batch_size=500)
+
+
+def unpack_boards(apps, schema_editor):
+    '''
+    Restores the packed boards as JSON.
+    '''
+    Leaderboard_Cache = apps.get_model('Leaderboards', 'Leaderboard_Cache')
+
+    unpacked = []
+    for entry in Leaderboard_Cache.objects.filter(packed__isnull=False).iterator(chunk_size=500):
+        entry.board = unpack_snapshot(entry.packed)
+        entry.packed = None
+        unpacked.append(entry)
+
+    Leaderboard_Cache.objects.bulk_update(unpacked, ['board', 'packed'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0020_leaderboard_cache_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leaderboard_cache',
+            name='packed',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(pack_boards, unpack_boards),
+    ]
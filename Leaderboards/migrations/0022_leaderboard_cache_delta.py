@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-17 17:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0021_leaderboard_cache_packed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leaderboard_cache',
+            name='base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Leaderboards.session', verbose_name='Base Session'),
+        ),
+        migrations.AddField(
+            model_name='leaderboard_cache',
+            name='keyframe',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Leaderboards.session', verbose_name='Keyframe Session'),
+        ),
+        migrations.AddField(
+            model_name='leaderboard_cache',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Deltas from Keyframe'),
+        ),
+    ]
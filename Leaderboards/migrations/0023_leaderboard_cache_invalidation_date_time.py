@@ -0,0 +1,20 @@
+# Generated by Django 4.2 on 2026-10-17 18:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0022_leaderboard_cache_delta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leaderboard_cache_invalidation',
+            name='date_time',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Invalidated At'),
+            preserve_default=False,
+        ),
+    ]
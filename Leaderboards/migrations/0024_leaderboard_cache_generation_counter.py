@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-17 19:40
+
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+
+
+def count_generations(apps, schema_editor):
+    '''
+    The generations were the invalidations' pks, carry them over (so that existing entries keep theirs).
+    '''
+    Invalidation = apps.get_model('Leaderboards', 'Leaderboard_Cache_Invalidation')
+    Generation = apps.get_model('Leaderboards', 'Leaderboard_Cache_Generation')
+
+    Invalidation.objects.update(generation=models.F('pk'))
+
+    latest = Invalidation.objects.values('game').annotate(generation=Max('pk'), date_time=Max('date_time'))
+    Generation.objects.bulk_create([Generation(game_id=g['game'], generation=g['generation'], date_time=g['date_time']) for g in latest])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Leaderboards', '0023_leaderboard_cache_invalidation_date_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leaderboard_cache_invalidation',
+            name='generation',
+            field=models.PositiveIntegerField(default=0, verbose_name='Cache Generation'),
+        ),
+        migrations.CreateModel(
+            name='Leaderboard_Cache_Generation',
+            fields=[
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='leaderboard_cache_generation', serialize=False, to='Leaderboards.game', verbose_name='Game')),
+                ('generation', models.PositiveIntegerField(default=0, verbose_name='Cache Generation')),
+                ('date_time', models.DateTimeField(auto_now=True, verbose_name='Bumped At')),
+            ],
+        ),
+        migrations.RunPython(count_generations, migrations.RunPython.noop),
+    ]
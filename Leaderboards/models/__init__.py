@@ -59,12 +59,32 @@ class RATING_REBUILD_TRIGGER(Enum):
     session_add = 1  # A rating rebuild was triggered by a newly added session
     session_edit = 2  # A rating rebuild was triggered by a session edit
     session_delete = 3  # A rating rebuild was triggered by a session deletion
+    settings_change = 4  # A rating rebuild was triggered by a change to the TrueSkill settings
 
     choices = (
         (user_request, 'User Request'),
         (session_add, 'Session Add'),
         (session_edit, 'Session Edit'),
-        (session_delete, 'Session Delete')
+        (session_delete, 'Session Delete'),
+        (settings_change, 'Settings Change')
+    )
+
+    labels = {c[0]:c[1] for c in choices}
+
+#===============================================================================
+# The life cycle of a queued rating rebuild (see RebuildJob)
+#===============================================================================
+class REBUILD_JOB_STATUS(Enum):
+    pending = 0  # Waiting for a worker to pick it up
+    running = 1  # A worker is rebuilding the ratings
+    done = 2  # The ratings were rebuilt
+    failed = 3  # The rebuild failed (and the job records why)
+
+    choices = (
+        (pending, 'Pending'),
+        (running, 'Running'),
+        (done, 'Done'),
+        (failed, 'Failed')
     )
 
     labels = {c[0]:c[1] for c in choices}
@@ -94,8 +114,10 @@ from .game import Game
 from .rank import Rank
 from .performance import Performance
 from .session import Session
+from .timeline import RatingTimeline
 
 from .event import Event
 from .log import RebuildLog, ChangeLog
+from .rebuild_job import RebuildJob
 
-from .leaderboards import Leaderboard_Cache
+from .leaderboards import Leaderboard_Cache, Leaderboard_Cache_Generation, Leaderboard_Cache_Invalidation
@@ -2,6 +2,8 @@ from . import APP, ALL_LEAGUES, FLOAT_TOLERANCE, MAX_NAME_LENGTH
 
 from ..leaderboards.enums import LB_PLAYER_LIST_STYLE
 from ..leaderboards.style import styled_player_list
+from ..leaderboards.counts import PlayCountSeries
+from ..leaderboards.directory import PlayerDirectory
 
 from Import.models import Import
 
@@ -12,6 +14,8 @@ from django.conf import settings
 from django.urls import reverse
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 
+from django_cte import With
+
 from django_model_admin_fields import AdminModel
 
 from django_rich_views.decorators import property_method
@@ -118,13 +122,7 @@ class Game(AdminModel, NotesMixIn):
         '''
         Returns a dictionary keyed on league, with a list of sessions that played this game as the value.
         '''
-        League = apps.get_model(APP, "League")
-        leagues = League.objects.all()
-        sl = {}
-        sl[ALL_LEAGUES] = self.session_list()
-        for league in leagues:
-            sl[league] = self.session_list(league)
-        return sl
+        return {league: partition['sessions'] for league, partition in self.league_partitions(boards=False).items()}
 
     @property
     def global_plays(self) -> dict:
@@ -141,13 +139,7 @@ class Game(AdminModel, NotesMixIn):
             players: is a count of players who played this game at least once
             session: is a count of the number of sessions this game has been played
         '''
-        League = apps.get_model(APP, "League")
-        leagues = League.objects.all()
-        pc = {}
-        pc[ALL_LEAGUES] = self.play_counts()
-        for league in leagues:
-            pc[league] = self.play_counts(league)
-        return pc
+        return {league: partition['plays'] for league, partition in self.league_partitions(boards=False).items()}
 
     @property
     def league_leaderboards(self) -> dict:
@@ -158,13 +150,92 @@ class Game(AdminModel, NotesMixIn):
         Each leaderboard is an ordered list of (player,rating, plays) tuples
         for the league.
         '''
+        return {league: partition['leaderboard'] for league, partition in self.league_partitions().items()}
+
+    def league_partitions(self, asat=None, names="nick", style=LB_PLAYER_LIST_STYLE.simple, boards=True) -> dict:
+        '''
+        The leaderboard, play counts and session list of this game for every league (and globally),
+        in one pass.
+
+        Rather than query each league in turn, we load the global leaderboard, the sessions and the
+        performances once, along with every player's league memberships (from the PlayerDirectory),
+        and partition them by league. Equivalent to calling leaderboard(league), play_counts(league)
+        and session_list(league) for every league.
+
+        Returns a dict keyed on League (and ALL_LEAGUES for the global partition) of dicts with keys
+        'leaderboard', 'plays' and 'sessions'.
+
+        :param asat:   Optionally, partition the game as at this time rather than now
+        :param names:  Specifies how names should be rendered in the leaderboards, one of the Player.name() options.
+        :param style:  The style of leaderboards to return, a LB_PLAYER_LIST_STYLE value
+        :param boards: If False, skip the leaderboards (only counts and sessions are wanted)
+        '''
         League = apps.get_model(APP, "League")
-        leagues = League.objects.all()
-        lb = {}
-        lb[ALL_LEAGUES] = self.leaderboard()
-        for league in leagues:
-            lb[league] = self.leaderboard(league)
-        return lb
+        Session = apps.get_model(APP, "Session")
+        Performance = apps.get_model(APP, "Performance")
+
+        leagues = {l.pk: l for l in League.objects.all()}
+
+        sfilter = Q(game=self)
+        pfilter = Q(session__game=self, player__isnull=False)
+        if not asat is None:
+            sfilter &= Q(date_time__lte=asat)
+            pfilter &= Q(session__date_time__lte=asat)
+
+        sessions = list(Session.objects.filter(sfilter))
+        performances = list(Performance.objects.filter(pfilter)
+                            .order_by('session__date_time', 'session_id')
+                            .values_list('session__league_id', 'player_id', 'play_number'))
+
+        board = self.leaderboard(asat=asat, style=LB_PLAYER_LIST_STYLE.data) if boards else None
+
+        player_pks = {player for league, player, play_number in performances}
+        if board:
+            player_pks.update(player_tuple[0] for player_tuple in board)
+        directory = PlayerDirectory.get_many(player_pks)
+        member_of = {pk: set(entry.leagues) for pk, entry in directory.items()}
+
+        partitions = {key: {'leaderboard': None, 'plays': PlayCountSeries.empty(), 'sessions': []}
+                      for key in [ALL_LEAGUES] + list(leagues)}
+
+        # Sessions are partitioned on the league they were played in
+        for session in sessions:
+            partitions[ALL_LEAGUES]['sessions'].append(session)
+            if session.league_id in partitions:
+                partitions[session.league_id]['sessions'].append(session)
+
+        # Global counts are over each player's last performance, as in play_counts(), and league
+        # counts over the performances in that league's sessions by that league's players.
+        last_play = {}
+        for league, player, play_number in performances:
+            last_play[player] = play_number
+
+            if league in leagues and league in member_of.get(player, ()):
+                counts = partitions[league]['plays']
+                counts['total'] += play_number
+                counts['players'] += 1
+                counts['max'] = max(counts['max'], play_number)
+
+        counts = partitions[ALL_LEAGUES]['plays']
+        counts['total'] = sum(last_play.values())
+        counts['players'] = len(last_play)
+        counts['max'] = max(last_play.values(), default=0)
+
+        for key, partition in partitions.items():
+            counts = partition['plays']
+            counts['average'] = counts['total'] / counts['players'] if counts['players'] else 0
+            counts['sessions'] = len(partition['sessions'])
+
+        # Leaderboards are partitioned on the leagues the players are in (in global order)
+        if board:
+            partitions[ALL_LEAGUES]['leaderboard'] = styled_player_list(board, style=style, names=names, players=directory)
+            for league in leagues:
+                league_board = [player_tuple for player_tuple in board if league in member_of.get(player_tuple[0], ())]
+                if league_board:
+                    partitions[league]['leaderboard'] = styled_player_list(league_board, style=style, names=names, players=directory)
+
+        # Key on League objects as the league_ properties always have
+        return {leagues.get(key, key): partition for key, partition in partitions.items()}
 
     @property
     def global_leaderboard(self) -> list:
@@ -362,6 +433,94 @@ class Game(AdminModel, NotesMixIn):
 
         return pc
 
+    def play_count_series(self, leagues=[], broad=False) -> PlayCountSeries:
+        '''
+        Returns the play counts of this game (as play_counts() does) after every session, as a
+        PlayCountSeries. Its asat() method then provides the counts as at any time without a query.
+
+        Built with one query (and the PlayerDirectory for league memberships), and kept on the
+        game instance for reuse.
+
+        :param leagues: Counts considering the specified league or leagues or all leagues if none is specified.
+        :param broad: basic play counts are for all sessions in any of the provided leagues, broad play counts include all sessions played in by members of an of the specified leagues,
+        '''
+        League = apps.get_model(APP, "League")
+        Performance = apps.get_model(APP, "Performance")
+
+        # If a single league was provided make a list with one entry.
+        if not isinstance(leagues, list):
+            if leagues:
+                leagues = [leagues]
+            else:
+                leagues = []
+
+        # We can accept leagues as League instances or PKs but want a PK set for membership tests.
+        leagues = {l.pk if isinstance(l, League) else int(l) for l in leagues}
+
+        key = (frozenset(leagues), broad)
+        if not hasattr(self, "_play_count_series"):
+            self._play_count_series = {}
+        elif key in self._play_count_series:
+            return self._play_count_series[key]
+
+        performances = (Performance.objects.filter(session__game=self, player__isnull=False)
+                        .order_by('session__date_time', 'session_id')
+                        .values_list('session_id', 'session__date_time', 'session__league_id', 'player_id', 'play_number'))
+
+        # Group the performances by session (they arrive in session order)
+        sessions = []
+        for session, date_time, league, player, play_number in performances:
+            if not sessions or sessions[-1][0] != session:
+                sessions.append((session, date_time, league, []))
+            sessions[-1][3].append((player, play_number))
+
+        if leagues:
+            directory = PlayerDirectory.get_many({p for s in sessions for p, n in s[3]})
+            # play_counts() joins on player__leagues__in so a player counts once for each of the leagues they're in
+            weight = {pk: len(leagues.intersection(entry.leagues)) for pk, entry in directory.items()}
+
+        series = PlayCountSeries()
+        counts = PlayCountSeries.empty()
+        last_play = {}  # The latest play number of each player (for all leagues)
+
+        for session, date_time, league, plays in sessions:
+            if leagues:
+                # Mirror the performance aggregate of play_counts(): over all the performances
+                # in the sessions considered by the players in the leagues considered.
+                if broad:
+                    considered = any(weight.get(player, 0) for player, play_number in plays)
+                else:
+                    considered = league in leagues
+
+                if not considered:
+                    continue
+
+                counts['sessions'] += 1
+                for player, play_number in plays:
+                    w = weight.get(player, 0)
+                    if w:
+                        counts['total'] += w * play_number
+                        counts['players'] += w
+                        counts['max'] = max(counts['max'], play_number)
+            else:
+                # Mirror the aggregate of play_counts() over the last performance of each player
+                counts['sessions'] += 1
+                for player, play_number in plays:
+                    counts['total'] += play_number - last_play.get(player, 0)
+                    counts['max'] = max(counts['max'], play_number)
+                    last_play[player] = play_number
+                counts['players'] = len(last_play)
+
+            counts['average'] = counts['total'] / counts['players'] if counts['players'] else 0
+            series.append(date_time, dict(counts))
+
+        self._play_count_series[key] = series
+
+        if settings.DEBUG:
+            log.debug(f"Built the play count series for game '{self.name}' for leagues {leagues} (broad={broad}) over {len(sessions)} sessions.")
+
+        return series
+
     @property_method
     def leaderboard(self, leagues=[], asat=None, names="nick", style=LB_PLAYER_LIST_STYLE.simple, data=None) -> tuple:
         '''
@@ -388,6 +547,7 @@ class Game(AdminModel, NotesMixIn):
         League = apps.get_model(APP, "League")
         Rating = apps.get_model(APP, "Rating")
         Performance = apps.get_model(APP, "Performance")
+        RatingTimeline = apps.get_model(APP, "RatingTimeline")
 
         # If a single league was provided make a list with one entry.
         if not isinstance(leagues, list):
@@ -429,11 +589,11 @@ class Game(AdminModel, NotesMixIn):
                 ratings = data
         elif asat:
             # Build leaderboard as at a given time as specified
-            # Can't use the Ratings model as that stores current ratings. Instead use the Performance
-            # model which records ratings after every game session and the sessions have a date/time
-            # so the information can be extracted therefrom. These are returned in order -eta as well
-            # so in the right order for a leaderboard (descending skill rating)
-            ratings = self.last_performances(leagues=leagues, asat=asat)
+            # Can't use the Ratings model as that stores current ratings. Instead use the RatingTimeline
+            # model which records the interval over which every rating (after every game session) held.
+            # These are returned in order -eta as well so in the right order for a leaderboard (descending
+            # skill rating)
+            ratings = RatingTimeline.asat(self, asat, leagues=leagues)
         else:
             # We only want ratings from this game
             lb_filter = Q(game=self)
@@ -464,6 +624,14 @@ class Game(AdminModel, NotesMixIn):
                 plays = r.plays
                 victories = r.victories
                 last_play = r.last_play_local
+            elif isinstance(r, RatingTimeline):
+                player_pk = r.player_id
+                trueskill_eta = r.trueskill_eta
+                trueskill_mu = r.trueskill_mu
+                trueskill_sigma = r.trueskill_sigma
+                plays = r.plays
+                victories = r.victories
+                last_play = r.last_play_local
             elif isinstance(r, Performance):
                 player = r.player
                 player_pk = player.pk
@@ -576,10 +744,11 @@ class Game(AdminModel, NotesMixIn):
                 raise ValueError("Database error: more than one rating for {} at {}".format(player.name_nickname, self.name))
             return r
         else:
-            # Use the Performance model (and time stamped associated sessions) to construct
-            # a rating object as at a specific date/time
-            # TODO: Implement
-            pass
+            # Use the RatingTimeline to construct a rating object as at a specific date/time
+            RatingTimeline = apps.get_model(APP, "RatingTimeline")
+
+            interval = RatingTimeline.asat(self, asat, players=[player]).select_related('performance__latest_victory__session').first()
+            return Rating.create(player=player, game=self) if interval is None else interval.as_rating()
 
     def future_sessions(self, asat, players=None) -> list:
         '''
@@ -589,53 +758,58 @@ class Game(AdminModel, NotesMixIn):
         This is needed for rebuilding ratings when a historic game session
         detail changes.
 
-        Returns a list not a QuerySet because there is a tree of future influence
-        that a QuerySet cannot represent. The basic tree begins with all sessions
-        in the future that one of this session's players particpated in. Each of
-        those sessions though can rope in new players who add branches to the tree.
+        The sessions are a tree of future influence. The basic tree begins with all
+        sessions in the future that one of the players particpated in. Each of those
+        sessions though can rope in new players who add branches to the tree (their
+        sessions in the future of that session). That transitive closure is found
+        with one recursive CTE, in one round trip to the database.
 
         :param asat:       a datetime from which persepective the "future" is.
         :param players:    a QuerySet of Players or a list of Players.
         '''
         Session = apps.get_model(APP, "Session")
 
-        # We want session in the future only of course
-        dfilter = Q(date_time__gt=asat)
+        # We want only sessions for this game, in the future of course
+        future_sessions = Session.objects.filter(game=self, date_time__gt=asat)
 
-        # We want only sessions for this game
-        gfilter = Q(game=self)
+        # If no players were provided we want ALL the future sessions of this game
+        if not players:
+            return list(future_sessions.order_by('date_time'))
 
-        # For each player we find all future sessions playing this game
-        pfilter = Q(performances__player__in=players) if players else Q()
-
-        # Combine the filters
-        filters = dfilter & gfilter & pfilter
+        # If we specified some players, then the future sessions that involved those players
+        # seed the tree, and any session that shares a player with a session in the tree and is
+        # in its future, is in the tree too. As a recursive CTE that is:
+        #
+        #    WITH RECURSIVE influenced AS (
+        #        SELECT id, date_time FROM sessions of this game after asat with one of players
+        #        UNION
+        #        SELECT id, date_time FROM sessions of this game joined via shared players to
+        #            influenced WHERE their date_time > influenced.date_time
+        #    )
+        #
+        # UNION (not UNION ALL) discards sessions already found and so guarantees termination.
+        # Ordering is explicitly cleared on both terms as Session has a default ordering and
+        # ORDER BY does not belong in the terms of a UNION.
+        def influence(influenced):
+            seeds = (future_sessions
+                     .filter(performances__player__in=players)
+                     .order_by()
+                     .values('id', 'date_time'))
 
-        future_sessions = Session.objects.filter(filters).distinct().order_by('date_time')
+            spread = (influenced.join(Session, performances__player__performances__session_id=influenced.col.id)
+                      .filter(game=self, date_time__gt=influenced.col.date_time)
+                      .order_by()
+                      .values('id', 'date_time'))
 
-        sessions_so_far = list(future_sessions)
+            return seeds.union(spread, all=False)
 
-        # If no players were provided we already have ALL the future sessions of this game
-        # If we specified some players, then we only have those that involved those players
-        # We need recursively to examine that list because any player not in our list who
-        # appears in a session with one these players has a whole future tree of influence
-        # themselves.
-        if players and future_sessions.count() > 0:
-            # The new future sessions may involve new players which
-            # requires that we scan them for new future sessions too
-            for session in future_sessions:
-                # session._get_future_sessions looks for new sessions (excluding sessions_so_far)
-                # If it find any it adds them to sessions_so far and returns the complete list.
-                new_sessions_so_far = session._get_future_sessions(sessions_so_far)
+        influenced = With.recursive(influence, name="influenced")
 
-                # The returned list is bigger if any were added, else same size.
-                # If it's bigger, sort it bu data_time and use that for the time
-                # round the loop (of future_sessions)
-                if len(new_sessions_so_far) > len(sessions_so_far):
-                    sessions_so_far = sorted(new_sessions_so_far, key=lambda s: s.date_time)
+        sessions = (influenced.join(Session, id=influenced.col.id)
+                    .with_cte(influenced)
+                    .order_by('date_time'))
 
-        # After examining all future sessions, sessions_so_far is the complete list
-        return sessions_so_far
+        return list(sessions)
 
     selector_field = "name"
 
@@ -1,6 +1,25 @@
-from django.db.models import Model, JSONField, OneToOneField, CASCADE
+from . import APP
+
+from ..leaderboards.enums import LB_PLAYER_LIST_STYLE
+from ..leaderboards.packing import is_packable, pack_snapshot, unpack_snapshot
+from ..leaderboards.delta import snapshot_delta, apply_snapshot_delta
+from ..leaderboards.util import immutable
+
+from django.db import connection, transaction
+from django.core.cache import cache, caches
+from django.db.models import Model, JSONField, BinaryField, OneToOneField, ForeignKey, DateTimeField, PositiveIntegerField, PositiveSmallIntegerField, CASCADE, Q, F, Max, Sum, Exists, OuterRef
+from django.utils.timezone import now
+from django.apps import apps
+from django.conf import settings
+
 from django_rich_views.serializers import TypedEncoder, TypedDecoder
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from time import perf_counter
+
+from Site.logutils import log
+
 
 class Leaderboard_Cache(Model):
     '''
@@ -22,6 +41,23 @@ class Leaderboard_Cache(Model):
 
     Leaderboards.leaderboards.enums.LB_STRUCTURE and it is the `session_wrapped_player_list`
     that is cached here in JSON format for rapid retrieval delivery and delivery.
+
+    Entries are invalidated by generation rather than deleted. Each entry is stamped with the
+    generation of its game's cache when it was built (see Leaderboard_Cache_Generation), and an
+    invalidation (see Leaderboard_Cache_Invalidation) bumps the generation of a game from a given
+    time. An entry is stale if its game was invalidated at or before its session after it was
+    built. Stale entries are ignored on read (see Leaderboard_Cache.fresh) and deleted in bulk,
+    with the invalidations that no longer cover any entry (see Leaderboard_Cache.collect_garbage).
+
+    Consecutive snapshots of a game differ only by the players who played in between, and so
+    most entries store only the delta from an earlier snapshot of the game, their base (see
+    Leaderboards.leaderboards.delta), with a full board, a keyframe, every so often. An entry
+    is rebuilt from its keyframe through the chain of deltas to it (see Leaderboard_Cache.snapshots).
+
+    This table is the second tier of a two tier cache. In front of it is a Django cache (memcached,
+    see settings.LEADERBOARD_L1_CACHE) holding rebuilt boards, keyed on session and the generation of
+    its game's cache. Read through with Leaderboard_Cache.fetch and write through with
+    Leaderboard_Cache.put. The hits and misses on each tier are counted (see Leaderboard_Cache.metrics).
     '''
     session = OneToOneField('Session', verbose_name='Session', related_name='leaderboard_cache', primary_key=True, on_delete=CASCADE)  # if the session is deleted, delete this cache entry can be too
 
@@ -31,42 +67,580 @@ class Leaderboard_Cache(Model):
     # rights to other players privat data.
     board = JSONField(null=True, encoder=TypedEncoder, decoder=TypedDecoder)
 
+    # Or, more compactly and much faster to decode, the board packed (see Leaderboards.leaderboards.packing).
+    # Only one of board and packed is set, see Leaderboard_Cache.entry and Leaderboard_Cache.snapshot
+    packed = BinaryField(null=True)
+
+    # The generation of the game's cache this board was built in (see Leaderboard_Cache.generations)
+    generation = PositiveIntegerField('Cache Generation', default=0)
+
+    # If board is a delta, the session whose board it was taken from, and the keyframe its chain of
+    # deltas starts from, and how many deltas it is from it. A keyframe has neither (and depth 0).
+    base = ForeignKey('Session', verbose_name='Base Session', related_name='+', null=True, blank=True, on_delete=CASCADE)  # if the base is deleted, this board can't be rebuilt
+    keyframe = ForeignKey('Session', verbose_name='Keyframe Session', related_name='+', null=True, blank=True, on_delete=CASCADE)  # if the keyframe is deleted, this board can't be rebuilt
+    depth = PositiveSmallIntegerField('Deltas from Keyframe', default=0)
+
+    @property
+    def is_keyframe(self) -> bool:
+        return self.base_id is None
+
+    @property
+    def snapshot(self) -> tuple:
+        '''
+        The cached board, an (immutable) LB_STRUCTURE.session_wrapped_player_list, or None if
+        it is a delta that can't be rebuilt.
+        '''
+        if self.is_keyframe:
+            return unpack_snapshot(self.packed) if self.packed is not None else immutable(self.board)
+        else:
+            return self.snapshots({self.pk: self}).get(self.pk, None)
+
     @classmethod
-    def create(cls, session, recreate=True):
+    def snapshots(cls, entries) -> dict:
         '''
-        Creates a chace entry session
+        Rebuilds the boards of cache entries, and returns them in a dict keyed on session pk.
 
-        :param session: a Session object
+        The keyframes and deltas that the requested entries need are fetched in one query. Entries
+        whose chain is broken (an entry in it is missing or stale) are not in the returned dict.
+
+        :param entries: a dict of fresh entries keyed on session pk (as fresh().in_bulk() returns)
+        '''
+        requested = entries
+
+        chains = {e.keyframe_id for e in entries.values() if not e.is_keyframe}
+        if chains:
+            entries = {**cls.fresh().filter(Q(session__in=chains) | Q(keyframe__in=chains)).in_bulk(), **entries}
+
+        boards = {}
+
+        def rebuild(pk):
+            if not pk in boards:
+                entry = entries.get(pk, None)
+                if entry is None:
+                    boards[pk] = None
+                elif entry.is_keyframe:
+                    boards[pk] = entry.snapshot
+                else:
+                    base = rebuild(entry.base_id)
+                    boards[pk] = None if base is None else apply_snapshot_delta(base, entry.board)
+            return boards[pk]
+
+        # Build chains in order (keyframes first) to keep the recursion shallow
+        for entry in sorted(entries.values(), key=lambda e: e.depth):
+            rebuild(entry.pk)
+
+        return {pk: boards[pk] for pk in requested if boards[pk] is not None}
+
+    @classmethod
+    def entry(cls, session, snapshot, generation=0, base=None, base_snapshot=None) -> 'Leaderboard_Cache':
+        '''
+        Returns an (unsaved) cache entry for a session's board. Stored as a delta from a base board if
+        one is provided and the delta is worth it (and the chain from the keyframe isn't too long, see
+        settings.LEADERBOARD_CACHE_KEYFRAME_INTERVAL). Else as a keyframe, packed if it can be (and
+        settings.PACK_LEADERBOARD_CACHE allows).
+
+        :param session:       a Session object (or pk)
+        :param snapshot:      the session's board (as Session.leaderboard_snapshot returns it)
+        :param generation:    the generation of the game's cache the board was built in
+        :param base:          optionally, the cache entry of an earlier board of the same game
+        :param base_snapshot: the board base stores (required with base)
+        '''
+        entry = cls(session_id=getattr(session, 'pk', session), generation=generation)
+        entry.built = snapshot  # Not stored, but for the L1 cache and as a base for the next entry
+
+        if base is not None and base_snapshot is not None and base.depth + 1 < getattr(settings, "LEADERBOARD_CACHE_KEYFRAME_INTERVAL", 16):
+            delta = snapshot_delta(base_snapshot, snapshot)
+            if delta is not None:
+                entry.board = delta
+                entry.base_id = base.session_id
+                entry.keyframe_id = base.session_id if base.is_keyframe else base.keyframe_id
+                entry.depth = base.depth + 1
+                return entry
+
+        if getattr(settings, "PACK_LEADERBOARD_CACHE", True) and is_packable(snapshot):
+            entry.packed = pack_snapshot(snapshot)
+        else:
+            entry.board = snapshot
+
+        return entry
+
+    metrics_key = "leaderboard_cache_metrics"
+    metrics_counters = ("l1_hits", "l1_misses", "l2_hits", "l2_misses")
+
+    @classmethod
+    def _l1(cls):
+        return caches[getattr(settings, "LEADERBOARD_L1_CACHE", "default")]
+
+    @classmethod
+    def _l1_key(cls, session_pk, generation) -> str:
+        return f"leaderboard_snapshot:{session_pk}:{generation}"
+
+    @classmethod
+    def _l1_value(cls, entry) -> tuple:
+        # The board (built) and what it takes to use the entry as a base (see Leaderboard_Cache.entry)
+        return (entry.built, entry.base_id, entry.keyframe_id, entry.depth)
+
+    @classmethod
+    def _l1_set(cls, values):
+        '''
+        Writes to the L1 cache.
+
+        :param values: a dict of _l1_value()s keyed on _l1_key()s
         '''
         try:
-            cache = cls.objects.get(session=session)
-            exists = True
-        except cls.DoesNotExist:
-            exists = False
+            cls._l1().set_many(values)
+        except Exception as E:
+            # The L1 cache is an optimisation, we can do without it
+            log.warning(f"Failed to write to the L1 leaderboard cache: {E}")
 
-        if not exists or recreate:
-            # TODO: Create one
-            pass
+    @classmethod
+    def _count(cls, **counts):
+        '''
+        Adds counts to the shared metrics (see Leaderboard_Cache.metrics).
+        '''
+        for counter, n in counts.items():
+            if n:
+                key = f"{cls.metrics_key}:{counter}"
+                try:
+                    cache.incr(key, n)
+                except ValueError:
+                    # Not in the cache (yet, or any more)
+                    if not cache.add(key, n, timeout=None):
+                        cache.incr(key, n)
+                except Exception as E:
+                    log.warning(f"Failed to count leaderboard cache {counter}: {E}")
+
+    @classmethod
+    def metrics(cls) -> dict:
+        '''
+        Returns the hits and misses on each tier of the cache (across all processes since the metrics
+        were last reset) and the hit rates, of each tier and overall.
+        '''
+        keys = {f"{cls.metrics_key}:{c}": c for c in cls.metrics_counters}
+        counts = {c: 0 for c in cls.metrics_counters}
+        counts.update({keys[k]: v for k, v in cache.get_many(keys.keys()).items()})
+
+        def rate(hits, misses):
+            return hits / (hits + misses) if hits + misses else None
+
+        counts['l1_hit_rate'] = rate(counts['l1_hits'], counts['l1_misses'])
+        counts['l2_hit_rate'] = rate(counts['l2_hits'], counts['l2_misses'])
+        counts['hit_rate'] = rate(counts['l1_hits'] + counts['l2_hits'], counts['l2_misses'])
+        return counts
+
+    @classmethod
+    def reset_metrics(cls):
+        cache.delete_many([f"{cls.metrics_key}:{c}" for c in cls.metrics_counters])
+
+    @classmethod
+    def fetch(cls, sessions, generations) -> dict:
+        '''
+        Reads the boards of sessions through both tiers of the cache. Returns a dict keyed on session
+        pk of (entry, board) tuples for the sessions found, the entry being the one to use as the base
+        of a following board (see Leaderboard_Cache.entry). Boards found only in the table are written
+        to the L1 cache.
+
+        :param sessions:    a list of Session objects
+        :param generations: the current generations of their games (as Leaderboard_Cache.generations returns them)
+        '''
+        keys = {cls._l1_key(s.pk, generations.get(s.game_id, 0)): s for s in sessions}
+
+        try:
+            l1 = cls._l1().get_many(keys.keys())
+        except Exception as E:
+            log.warning(f"Failed to read the L1 leaderboard cache: {E}")
+            l1 = {}
+
+        found = {}
+        for key, (board, base, keyframe, depth) in l1.items():
+            session = keys[key]
+            found[session.pk] = (cls(session_id=session.pk, generation=generations.get(session.game_id, 0), base_id=base, keyframe_id=keyframe, depth=depth), board)
+
+        missing = [s.pk for s in sessions if not s.pk in found]
+        entries = cls.fresh().in_bulk(missing) if missing else {}
+        boards = cls.snapshots(entries)
+
+        l2 = {}
+        for pk, board in boards.items():
+            entries[pk].built = board
+            l2[pk] = (entries[pk], board)
+
+        # Read through, keyed on the current generation (that reads look for) as they're still fresh
+        cls._l1_set({key: cls._l1_value(l2[s.pk][0]) for key, s in keys.items() if s.pk in l2})
+
+        cls._count(l1_hits=len(found), l1_misses=len(missing), l2_hits=len(l2), l2_misses=len(missing) - len(l2))
+
+        if settings.DEBUG:
+            log.debug(f"Leaderboard cache: {len(found)} L1 hits, {len(l2)} L2 hits and {len(missing) - len(l2)} misses.")
+
+        return {**found, **l2}
+
+    @classmethod
+    def put(cls, entries):
+        '''
+        Writes new entries through both tiers of the cache, replacing any that exist for their sessions
+        (stale entries whose garbage is not yet collected, or deltas whose chain is broken).
+
+        :param entries: a list of Leaderboard_Cache objects (as Leaderboard_Cache.entry returns them)
+        '''
+        if entries:
+            # Replace the existing entries in one transaction, so that readers see the old entry or
+            # ours and never a miss between the delete and the insert. The delete locks the rows that
+            # exist, and if another request inserts an entry meanwhile for a session that had none,
+            # that entry is kept (it is built from the same data and as good as ours).
+            with transaction.atomic():
+                cls.objects.filter(session__in=[e.session_id for e in entries]).delete()
+                cls.objects.bulk_create(entries, ignore_conflicts=True)
+            cls._l1_set({cls._l1_key(e.session_id, e.generation): cls._l1_value(e) for e in entries})
+
+    @classmethod
+    def stale(cls):
+        '''
+        Returns a QuerySet of the stale entries (invalidated after they were built).
+        '''
+        return cls.objects.filter(Exists(Leaderboard_Cache_Invalidation.covering(OuterRef('session__game'), OuterRef('session__date_time'), OuterRef('generation'))))
+
+    @classmethod
+    def fresh(cls):
+        '''
+        Returns a QuerySet of the entries that are not stale, the only ones that should be read.
+        '''
+        return cls.objects.exclude(Exists(Leaderboard_Cache_Invalidation.covering(OuterRef('session__game'), OuterRef('session__date_time'), OuterRef('generation'))))
+
+    @classmethod
+    def generations(cls, games) -> dict:
+        '''
+        Returns a dict keyed on game pk of the current generation of each game's cache (games that
+        were never invalidated are at generation 0). Entries built now are stamped with it.
+
+        :param games: a list or QuerySet of Games (or pks)
+        '''
+        return dict(Leaderboard_Cache_Generation.objects.filter(game__in=games).values_list('game', 'generation'))
+
+    @classmethod
+    def data_stamp(cls) -> tuple:
+        '''
+        Returns a (generation, date_time) stamp of the leaderboard data, that changes whenever a
+        session is added, edited or deleted or ratings are rebuilt (all of which invalidate the
+        cache). The sum of the games' generations and the time of the latest invalidation, or
+        (0, None) if none.
+
+        A cheap validator for responses built from leaderboard data (see views.conditional).
+        '''
+        stamp = Leaderboard_Cache_Generation.objects.aggregate(generation=Sum('generation'), date_time=Max('date_time'))
+        return (stamp['generation'] or 0, stamp['date_time'])
+
+    @classmethod
+    def create(cls, session, recreate=True, base=None, base_snapshot=None):
+        '''
+        Creates a cache entry for a session, and returns it (or None if the session has no leaderboard).
+
+        :param session:       a Session object
+        :param recreate:      if False, an existing entry is returned as is, else it is rebuilt
+        :param base:          optionally, the cache entry of an earlier board of the same game (see Leaderboard_Cache.entry)
+        :param base_snapshot: the board base stores
+        '''
+        if not recreate:
+            try:
+                return cls.fresh().get(session=session)
+            except cls.DoesNotExist:
+                pass
+
+        # Read before we build, so that an invalidation while we build leaves the entry stale
+        generation = cls.generations([session.game_id]).get(session.game_id, 0)
+
+        board = session.leaderboard_snapshot(style=LB_PLAYER_LIST_STYLE.data)
+
+        if not board:
+            return None
+
+        entry = cls.entry(session, board, generation, base, base_snapshot)
+
+        cache, created = cls.objects.update_or_create(session=session, defaults={'board': entry.board,
+                                                                                 'packed': entry.packed,
+                                                                                 'generation': generation,
+                                                                                 'base_id': entry.base_id,
+                                                                                 'keyframe_id': entry.keyframe_id,
+                                                                                 'depth': entry.depth})
+        cache.built = board  # So that a caller can use it as the base of the next entry
+        cls._l1_set({cls._l1_key(cache.session_id, generation): cls._l1_value(cache)})
+        return cache
+
+    @classmethod
+    def coverage(cls, sessions) -> tuple:
+        '''
+        Returns a tuple of (cached, total), the number of the given sessions that have a fresh cache entry.
+
+        :param sessions: a QuerySet of Session objects
+        '''
+        return (cls.fresh().filter(session__in=sessions).count(), sessions.count())
+
+    @classmethod
+    def _warm_sessions(cls, session_pks, recreate) -> list:
+        '''
+        A warming worker (see Leaderboard_Cache.warm). Creates the cache entries for a list of
+        sessions and returns a list of (session pk, seconds, succeeded) tuples.
+
+        Each game's sessions are cached in chronological order, each board stored as a delta
+        from the one before it where that's worth it.
+
+        :param session_pks: a list of Session pks, all of the sessions of the games among them
+        :param recreate:    passed to Leaderboard_Cache.create
+        '''
+        Session = apps.get_model(APP, "Session")
+
+        timings = []
+        try:
+            base, game = None, None
+            for session in Session.objects.filter(pk__in=session_pks).select_related('game').order_by('game', 'date_time'):
+                if session.game_id != game:
+                    base, game = None, session.game_id
+
+                start = perf_counter()
+                try:
+                    base = cls.create(session, recreate, base, getattr(base, 'built', None))
+                    succeeded = True
+                except Exception as E:
+                    log.error(f"Failed to cache the leaderboard for session {session.pk}: {E}")
+                    base = None
+                    succeeded = False
+                timings.append((session.pk, perf_counter() - start, succeeded))
+        finally:
+            # Each worker thread has its own database connection, which Django won't close for us.
+            connection.close()
+
+        return timings
+
+    @classmethod
+    def warm(cls, sessions, workers=None, recreate=False, progress=None) -> dict:
+        '''
+        Fills the cache for a set of sessions, building their snapshots in parallel worker threads.
+        So that the first visitor to a leaderboard after a rebuild doesn't wait for it to be built.
+
+        Returns a report (a dict) of coverage and timings.
+
+        :param sessions: a QuerySet of Session objects
+        :param workers:  the number of worker threads (settings.LEADERBOARD_CACHE_WARMERS by default)
+        :param recreate: if True, rebuilds entries that exist too, else only builds the missing ones
+        :param progress: optionally a callable that receives (sessions done, sessions total) as sessions are cached
+        '''
+        workers = workers or getattr(settings, "LEADERBOARD_CACHE_WARMERS", 4)
+
+        start = perf_counter()
+        cls.collect_garbage()
+        cached, total = cls.coverage(sessions)
+
+        todo = sessions if recreate else sessions.filter(leaderboard_cache__isnull=True)
+        todo = list(todo.order_by('-date_time').values_list('pk', 'game'))
+
+        # A game's boards are built in one worker (in chronological order) so that they can be
+        # stored as deltas of each other.
+        games = {}
+        for pk, game in todo:
+            games.setdefault(game, []).append(pk)
+
+        batches = [[] for i in range(workers)]
+        for i, pks in enumerate(games.values()):
+            batches[i % workers].extend(pks)
+        batches = [batch for batch in batches if batch]
+
+        timings = []
+        if batches:
+            with ThreadPoolExecutor(max_workers=len(batches)) as pool:
+                futures = [pool.submit(cls._warm_sessions, batch, recreate) for batch in batches]
+
+                for future in as_completed(futures):
+                    timings.extend(future.result())
+                    if progress:
+                        progress(len(timings), len(todo))
+
+        built = [t for t in timings if t[2]]
+        seconds = [t[1] for t in built]
+
+        report = {
+            'sessions': total,
+            'cached_before': cached,
+            'cached_after': cls.coverage(sessions)[0],
+            'built': len(built),
+            'failed': len(timings) - len(built),
+            'workers': len(batches),
+            'duration': perf_counter() - start,
+            'mean_build': sum(seconds) / len(seconds) if seconds else 0,
+            'max_build': max(seconds) if seconds else 0,
+            'slowest_session': max(built, key=lambda t: t[1])[0] if built else None
+        }
+
+        if settings.DEBUG:
+            log.debug(f"Warmed the leaderboard cache: {report}")
+
+        return report
+
+    @classmethod
+    def warm_after_rebuild(cls, rebuild_log):
+        '''
+        The post-rebuild hook. Warms the cache for the sessions a committed rebuild rebuilt, and
+        returns the report of Leaderboard_Cache.warm (or None if not configured to).
+
+        It takes as long as warming does, and so is called by the processes that rebuild outside
+        of requests (manage.py rebuild_worker and manage.py rebuild_ratings), never by the web
+        process (a rebuild there leaves the cache to fill as leaderboards are viewed).
+
+        Configured by settings.WARM_LEADERBOARD_CACHE_AFTER_REBUILD
+
+        :param rebuild_log: the RebuildLog of a completed rebuild
+        '''
+        if not (settings.USE_LEADERBOARD_CACHE and getattr(settings, "WARM_LEADERBOARD_CACHE_AFTER_REBUILD", False)):
+            return None
+
+        return cls.warm(rebuild_log.rebuilt_sessions)
 
     @classmethod
     def invalidate(cls, session):
         '''
-        Removes the the cache for the specified session. Called if a session is edited or any
-        rebuild of ratings impacting this sessions leaderboard cache record was requested.
+        Invalidates the cache for the specified session (and the later sessions of its game, whose
+        boards it affects). Called if a session is edited.
 
         :param session: a Session object
         '''
-        try:
-            cache = cls.objects.get(session=session)
-            cache.delete()
-        except cls.DoesNotExist:
-            pass
+        cls.invalidate_from(session.game, session.date_time)
+
+    @classmethod
+    def invalidate_from(cls, game, From=None):
+        '''
+        Invalidates the cache for a game from a given time, by bumping the game's generation.
+        A counter bump and an insert, however many entries it invalidates.
+
+        :param game: a Game object (or pk)
+        :param From: a datetime, the cache of sessions from then on is invalidated. All of them if None.
+        '''
+        game = getattr(game, 'pk', game)
+        with transaction.atomic():
+            generation = Leaderboard_Cache_Generation.bump([game])[game]
+            Leaderboard_Cache_Invalidation.objects.create(game_id=game, date_time_from=From, generation=generation)
+
+        if settings.DEBUG:
+            log.debug(f"Invalidated the leaderboard cache for game {game} from {From}.")
+
+    @classmethod
+    def invalidate_sessions(cls, sessions):
+        '''
+        Invalidates the cache for a set of sessions (and the later sessions of their games), bumping the
+        generation of each game once from its earliest session in the set. One bump and one insert for all the games.
+
+        Called by rating rebuilds.
+
+        :param sessions: a list or QuerySet of Session objects
+        '''
+        From = {}
+        for session in sessions:
+            if session.game_id not in From or session.date_time < From[session.game_id]:
+                From[session.game_id] = session.date_time
+
+        with transaction.atomic():
+            generations = Leaderboard_Cache_Generation.bump(From.keys())
+            Leaderboard_Cache_Invalidation.objects.bulk_create([Leaderboard_Cache_Invalidation(game_id=game, date_time_from=date_time, generation=generations[game])
+                                                                for game, date_time in From.items()])
+
+        if settings.DEBUG:
+            log.debug(f"Invalidated the leaderboard cache for {len(From)} games.")
 
+    @classmethod
+    def collect_garbage(cls) -> int:
+        '''
+        Deletes the stale entries, and the invalidations that no longer cover any entry (see
+        Leaderboard_Cache_Invalidation.prune), and returns the number of entries deleted.
+        '''
+        deleted, _ = cls.stale().delete()
+        pruned = Leaderboard_Cache_Invalidation.prune()
+
+        if settings.DEBUG:
+            log.debug(f"Deleted {deleted} stale leaderboard cache entries and pruned {pruned} invalidations.")
+
+        return deleted
 
     @classmethod
     def clear(cls):
         '''
-        Empties the cache entirely.
+        Empties the cache entirely (the games keep their generations).
         '''
         cls.objects.all().delete()
+        Leaderboard_Cache_Invalidation.objects.all().delete()
+
+
+class Leaderboard_Cache_Generation(Model):
+    '''
+    The current generation of a game's leaderboard cache (see Leaderboard_Cache.generations).
+
+    A counter that an invalidation bumps with the game's row locked until it commits, so that a
+    game's generations are committed in the order they are handed out. A sequence hands them out
+    on insert, and a reader could see a later one commit first, stamp an entry with it and miss
+    the earlier invalidation committed after.
+    '''
+    game = OneToOneField('Game', verbose_name='Game', related_name='leaderboard_cache_generation', primary_key=True, on_delete=CASCADE)
+    generation = PositiveIntegerField('Cache Generation', default=0)
+    date_time = DateTimeField('Bumped At', auto_now=True)
+
+    @classmethod
+    def bump(cls, games) -> dict:
+        '''
+        Bumps the generations of games, and returns their new generations in a dict keyed on game pk.
+        The games' counters stay locked until the transaction commits (and are locked in pk order,
+        lest two transactions bumping the same games deadlock).
+
+        :param games: a list of Games (or pks)
+        '''
+        games = sorted({getattr(game, 'pk', game) for game in games})
+
+        with transaction.atomic():
+            cls.objects.bulk_create([cls(game_id=game) for game in games], ignore_conflicts=True)
+            list(cls.objects.select_for_update().filter(game__in=games).order_by('pk').values_list('pk', flat=True))
+            cls.objects.filter(game__in=games).update(generation=F('generation') + 1, date_time=now())
+            return dict(cls.objects.filter(game__in=games).values_list('game', 'generation'))
+
+    def __str__(self): return f'Generation {self.generation} of {self.game}'
+
+
+class Leaderboard_Cache_Invalidation(Model):
+    '''
+    An invalidation of the leaderboard cache of a game from a given time (see Leaderboard_Cache).
+
+    It starts a generation of the game's cache (see Leaderboard_Cache_Generation), and makes the
+    entries of earlier generations from that time stale. Once it covers no entry (they were deleted
+    or rebuilt) it is of no further use, and is pruned (see Leaderboard_Cache_Invalidation.prune).
+    '''
+    game = ForeignKey('Game', verbose_name='Game', related_name='leaderboard_cache_invalidations', on_delete=CASCADE)  # if the game is deleted so are its sessions and their cache entries
+    date_time_from = DateTimeField('Invalidated From', null=True, blank=True)  # null invalidates all the game's sessions
+    date_time = DateTimeField('Invalidated At', auto_now_add=True)
+    generation = PositiveIntegerField('Cache Generation', default=0)
+
+    # How long an invalidation is kept regardless (an entry being built as it was made is stamped
+    # with an earlier generation, and may be saved after it is found to cover nothing).
+    kept_for = timedelta(hours=1)
+
+    @classmethod
+    def covering(cls, game, date_time, generation):
+        '''
+        Returns a QuerySet of the invalidations that make an entry stale.
+
+        :param game:       the entry's game (or an OuterRef to it)
+        :param date_time:  the entry's session date_time (or an OuterRef to it)
+        :param generation: the entry's generation (or an OuterRef to it)
+        '''
+        return cls.objects.filter(Q(game=game) & Q(generation__gt=generation) & (Q(date_time_from__isnull=True) | Q(date_time_from__lte=date_time)))
+
+    @classmethod
+    def prune(cls) -> int:
+        '''
+        Deletes the invalidations (older than kept_for) that cover no entry, and returns the number deleted.
+        '''
+        old = cls.objects.filter(date_time__lt=now() - cls.kept_for)
+
+        earlier = Leaderboard_Cache.objects.filter(session__game=OuterRef('game'), generation__lt=OuterRef('generation'))
+        covered = earlier.filter(session__date_time__gte=OuterRef('date_time_from'))
+
+        pruned, _ = old.filter(date_time_from__isnull=True).exclude(Exists(earlier)).delete()
+        pruned_from, _ = old.filter(date_time_from__isnull=False).exclude(Exists(covered)).delete()
+
+        return pruned + pruned_from
 
+    def __str__(self): return f'Generation {self.generation} of {self.game} from {self.date_time_from}'
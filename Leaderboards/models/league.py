@@ -1,6 +1,7 @@
 from . import APP, MAX_NAME_LENGTH, ALL_LEAGUES
 
 from ..leaderboards import LB_PLAYER_LIST_STYLE
+from ..leaderboards.style import styled_player_list, resolve_players
 
 from django.db import models
 from django.apps import apps
@@ -10,6 +11,7 @@ from django.core.validators import RegexValidator
 from django_model_admin_fields import AdminModel
 
 from django_rich_views.model import field_render, NotesMixIn
+from django_rich_views.datetime import safe_tz
 from django_rich_views.decorators import property_method
 
 
@@ -50,14 +52,37 @@ class League(AdminModel, NotesMixIn):
         '''
         Return a leaderboard for a specified game or if no game is provided, a dictionary of such
         lists keyed on game.
+
+        The boards of all games (as at now) are built from one query of the ratings of this
+        league's players, partitioned by game, rather than one query per game.
         '''
         Game = apps.get_model(APP, "Game")
+        Rating = apps.get_model(APP, "Rating")
+
+        if game is None and asat is None:
+            games = Game.objects.filter(leagues=self)
+
+            ratings = (Rating.objects.filter(game__in=games, player__leagues=self)
+                       .order_by('game', '-trueskill_eta')
+                       .values_list('game_id', 'player_id', 'trueskill_eta', 'trueskill_mu', 'trueskill_sigma',
+                                    'plays', 'victories', 'last_play', 'last_play_tz'))
 
-        if game is None:
+            boards = {}
+            for game_pk, player, eta, mu, sigma, plays, victories, last_play, last_play_tz in ratings:
+                last_play_local = last_play.astimezone(safe_tz(last_play_tz))
+                boards.setdefault(game_pk, []).append((player, eta, mu, sigma, plays, victories, last_play_local))
+
+            players = resolve_players({player_tuple[0] for board in boards.values() for player_tuple in board})
+
+            lb = {}
+            for game in games:
+                board = boards.get(game.pk, [])
+                lb[game] = styled_player_list(board, style=style, players=players) if board else None
+        elif game is None:
             lb = {}
             games = Game.objects.filter(leagues=self)
             for game in games:
-                lb[game] = self.leaderboard(game)
+                lb[game] = game.leaderboard(leagues=self, asat=asat, style=style)
         else:
             lb = game.leaderboard(leagues=self, asat=asat, style=style)
 
@@ -5,6 +5,7 @@ from ..leaderboards.util import immutable
 from ..leaderboards.style import restyle_leaderboard
 from ..leaderboards.player import player_ratings, player_rankings
 from ..leaderboards import augment_with_deltas
+from ..leaderboards.delta import encode_game_snapshots, decode_game_snapshots
 
 from django.db import models
 from django.conf import settings
@@ -61,12 +62,12 @@ class ChangeLog(AdminModel):
     identical. In the rather odd case of a logged change that has no impact on the after boards they
     will  be identical too (though hard to imagine a change worth logging that has no impact!).
 
-    TODO: This is a place to store impacts for reporting and presentation for review before
-    confirming a commit. That will rely on a transaction manager (in the making) which can hold
-    a database transaction open across a few views.
+    So each impact stores its second snapshot as a delta of the first (see Leaderboards.leaderboards.delta).
 
-    The idea is that we can store impacts in this model with a key so that they can be calculated,
-    saved, and the key passed to a confirmation view where the change can be committed or rolled back.
+    Impacts for review before confirming a commit need not be stored here, nor rely on a
+    database transaction held open across a few views. TrueSkillWhatIf evaluates the impact of
+    a proposed session (a Session.dict_from_form dict) in memory without saving anything (see
+    the json/whatif view).
     '''
 
     # The session that caused the impact (if it still exists) - if it was deleted it won't be around any more.
@@ -118,7 +119,7 @@ class ChangeLog(AdminModel):
         if self.leaderboard_impact_before_change:
             igd = LB_STRUCTURE.game_data_element.value
             isd = LB_STRUCTURE.session_data_element.value
-            leaderboard = immutable(json.loads(self.leaderboard_impact_before_change))
+            leaderboard = decode_game_snapshots(json.loads(self.leaderboard_impact_before_change))
             has_before = len(leaderboard[igd]) > 1  # The first session added for a game never has a before board!
             if unwrap == "before":
                 return leaderboard[igd][0][isd] if has_before else None
@@ -147,7 +148,7 @@ class ChangeLog(AdminModel):
         if self.leaderboard_impact_after_change:
             igd = LB_STRUCTURE.game_data_element.value
             isd = LB_STRUCTURE.session_data_element.value
-            leaderboard = immutable(json.loads(self.leaderboard_impact_after_change))
+            leaderboard = decode_game_snapshots(json.loads(self.leaderboard_impact_after_change))
             has_before = len(leaderboard[igd]) > 1  # The first session added for a game never has a before board!
             if unwrap == "before":
                 return leaderboard[igd][0][isd] if has_before else None
@@ -242,7 +243,7 @@ class ChangeLog(AdminModel):
 
             self.game_before_change = session.game
             # Saves in LB_STRUCTURE. game_wrapped_session_wrapped_player_list with LB_PLAYER_LIST_STYLE.data
-            self.leaderboard_impact_before_change = json.dumps(session.leaderboard_impact(LB_PLAYER_LIST_STYLE.data), cls=DjangoJSONEncoder)
+            self.leaderboard_impact_before_change = json.dumps(encode_game_snapshots(session.leaderboard_impact(LB_PLAYER_LIST_STYLE.data)), cls=DjangoJSONEncoder)
         else:
             # The change is a session submission (no session object exists yet, if it's created then self.update() can add it)
             pass
@@ -293,7 +294,7 @@ class ChangeLog(AdminModel):
 
         self.game_after_change = session.game
         # Saves in LB_STRUCTURE. game_wrapped_session_wrapped_player_list with LB_PLAYER_LIST_STYLE.data
-        self.leaderboard_impact_after_change = json.dumps(session.leaderboard_impact(LB_PLAYER_LIST_STYLE.data), cls=DjangoJSONEncoder)
+        self.leaderboard_impact_after_change = json.dumps(encode_game_snapshots(session.leaderboard_impact(LB_PLAYER_LIST_STYLE.data)), cls=DjangoJSONEncoder)
 
         if isinstance(change_summary, str):
             self.changes = change_summary
@@ -368,6 +369,15 @@ class RebuildLog(AdminModel):
     date_time_from = models.DateTimeField('Game', null=True, blank=True)
     sessions = models.ManyToManyField('Session', blank=True, related_name='rating_rebuild_requests')
 
+    # A rebuild can be partitioned by game and run in parallel (see Rating.rebuild), in which case each game
+    # has its own log (recording its own duration) and they all point to a parent log for the whole rebuild.
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='partitions', on_delete=models.CASCADE)  # If the parent is deleted delete its partitions
+
+    # A rebuild can commit in checkpointed batches of sessions (see Rating.rebuild), recording the last session
+    # it has rebuilt as it goes, so that should it die it can be resumed from there (see Rating.resume).
+    checkpoint = models.ForeignKey('Session', verbose_name='Last Session Rebuilt', related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    complete = models.BooleanField('Rebuild Completed', default=True)
+
     # We'd like to store JSON leaderboard impact of the rebuild. As the rebuild can cover the whole database this
     # can be large beyond simple database storage, and so we should use fileystem storage!
     rebuild_log_dir = "logs/rating_rebuilds"
@@ -375,26 +385,71 @@ class RebuildLog(AdminModel):
     leaderboards_after_rebuild = RelativeFilePathField(path=rebuild_log_dir, null=True, blank=True)
 
     @property
-    def leaderboards_before(self) -> dict:
-        log_file = os.path.join(settings.BASE_DIR, self.leaderboards_before_rebuild)
+    def is_partitioned(self) -> bool:
+        '''
+        True if this rebuild was partitioned by game (its leaderboards are stored by the partitions)
+        '''
+        return self.partitions.exists()
+
+    @property
+    def rebuilt_sessions(self):
+        '''
+        Returns a QuerySet of the sessions rebuilt (by this rebuild or, if partitioned, its partitions)
+        '''
+        Session = apps.get_model(APP, "Session")
+        return Session.objects.filter(models.Q(rating_rebuild_requests=self) | models.Q(rating_rebuild_requests__parent=self)).distinct()
+
+    def _load_leaderboards(self, context) -> dict:
+        '''
+        Loads the saved leaderboards (see save_leaderboards) for a given context.
+
+        For a partitioned rebuild, merges the leaderboards of each partition.
+
+        :param context:  "before" or "after"
+        '''
+        if self.is_partitioned:
+            leaderboards = {}
+            for partition in self.partitions.all():
+                leaderboards.update(partition._load_leaderboards(context))
+            return leaderboards
+
+        log_file = self.leaderboards_before_rebuild if context == "before" else self.leaderboards_after_rebuild
         try:
-            with open(log_file, 'r') as f:
+            with open(os.path.join(settings.BASE_DIR, log_file), 'r') as f:
                 leaderboards = json.load(f)
         except:
             leaderboards = {}
 
         return pythonify(leaderboards)
 
+    @property
+    def leaderboards_before(self) -> dict:
+        return self._load_leaderboards("before")
+
     @property
     def leaderboards_after(self) -> dict:
-        log_file = os.path.join(settings.BASE_DIR, self.leaderboards_after_rebuild)
-        try:
-            with open(log_file, 'r') as f:
-                leaderboards = json.load(f)
-        except:
-            leaderboards = {}
+        return self._load_leaderboards("after")
 
-        return pythonify(leaderboards)
+    @property
+    def is_resumable(self) -> bool:
+        '''
+        True if this is a checkpointed rebuild that did not complete
+        '''
+        return not self.complete
+
+    @classmethod
+    def incomplete(cls):
+        '''
+        Returns a QuerySet of the checkpointed rebuilds that did not complete (and can be resumed).
+        '''
+        return cls.objects.filter(complete=False)
+
+    @property
+    def partition_durations(self) -> dict:
+        '''
+        Returns a dict keyed on game of the duration of each partition of a partitioned rebuild.
+        '''
+        return {p.game: p.duration for p in self.partitions.all().select_related('game')}
 
     @property
     def games(self):
@@ -477,7 +532,9 @@ class RebuildLog(AdminModel):
         content = json.dumps(leaderboards, indent='\t', cls=DjangoJSONEncoder)
 
         abs_directory = os.path.join(settings.BASE_DIR, self.rebuild_log_dir)
-        filename = f"{self.created_on_local:%Y-%m-%d-%H-%M-%S}-{self.created_by.username}-{self.pk}-{context}.json"
+        # Rebuilds run outside of a request (by a worker or management command) have no user
+        username = getattr(self.created_by, 'username', 'system')
+        filename = f"{self.created_on_local:%Y-%m-%d-%H-%M-%S}-{username}-{self.pk}-{context}.json"
         abs_filename = os.path.join(abs_directory, filename)
         rel_filename = os.path.join(self.rebuild_log_dir, filename)
 
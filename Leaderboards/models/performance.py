@@ -2,8 +2,9 @@ from . import APP, FLOAT_TOLERANCE, TrueskillSettings
 from .rank import Rank
 
 from django.db import models
-from django.db.models import Q, OuterRef, QuerySet, Subquery
+from django.db.models import Q, OuterRef, QuerySet, Subquery, Exists
 from django.apps import apps
+from django.conf import settings
 from django.urls import reverse
 from django.core.exceptions import ValidationError
 
@@ -19,6 +20,8 @@ import trueskill
 from math import isclose
 from datetime import datetime
 
+from Site.logutils import log
+
 
 class Performance(AdminModel):
     '''
@@ -79,6 +82,13 @@ class Performance(AdminModel):
     trueskill_tau = models.FloatField('TrueSkill Dynamics Factor (τ)', default=trueskill.TAU, editable=False)
     trueskill_p = models.FloatField('TrueSkill Draw Probability (p)', default=trueskill.DRAW_PROBABILITY, editable=False)
 
+    # An adjacency index. The previous performance of this player at this game, and the latest
+    # performance of this player at this game at or before this one that was a victory (which may
+    # be this one). Both are maintained by Performance.link() so that finding the previous play or
+    # previous victory of a player is a single indexed fetch rather than a scan of the game's history.
+    previous = models.ForeignKey('self', verbose_name='Previous Performance', related_name='following', null=True, blank=True, editable=False, on_delete=models.SET_NULL)
+    latest_victory = models.ForeignKey('self', verbose_name='Latest Victory', related_name='+', null=True, blank=True, editable=False, on_delete=models.SET_NULL)
+
     Game = apps.get_model(APP, "Game", require_ready=False)
     Rank = apps.get_model(APP, "Rank", require_ready=False)
     Rating = apps.get_model(APP, "Rating", require_ready=False)
@@ -140,19 +150,89 @@ class Performance(AdminModel):
         '''
         Returns the previous performance object that this player played this game in.
         '''
-        return self.session.previous_performance(self.player)
+        return self.previous
 
     @property
     def previous_win(self) -> 'Performance':
         '''
         Returns the previous performance object that this player played this game in and one in
         '''
-        return self.session.previous_victory(self.player)
+        return self.latest_victory
+
+    @property
+    def trueskill_settings(self) -> TrueskillSettings:
+        '''
+        The global TrueSkill settings this performance was rated with (unsaved, for comparison).
+        '''
+        return TrueskillSettings(mu0=self.trueskill_mu0, sigma0=self.trueskill_sigma0, delta=self.trueskill_delta)
 
     @property
     def link_internal(self) -> str:
         return reverse('view', kwargs={"model":self._meta.model.__name__, "pk": self.pk})
 
+    @classmethod
+    def link(cls, game, players=None, From=None) -> int:
+        '''
+        Maintains the adjacency index (previous and latest_victory) on the performances
+        of the nominated game, walking each player's plays in chronological order.
+
+        Returns the number of performances whose links changed (and were saved).
+
+        :param game:    A Game object (or pk)
+        :param players: Optionally, a list or QuerySet of Players (or pks) to link. All players if not provided.
+        :param From:    Optionally, a datetime. Performances before it are assumed to be linked already,
+                        and the latest of them seeds the links of the ones from then on.
+        '''
+        Rank = apps.get_model(APP, "Rank")
+
+        performances = cls.objects.filter(session__game=game, player__isnull=False)
+
+        if players:
+            performances = performances.filter(player__in=players)
+
+        # The latest performance before From for each player seeds the walk.
+        # (DISTINCT ON, which needs PostgreSQL). Sessions at the same time are
+        # ordered by pk, here and in the walk, so that the links are deterministic.
+        last = {}
+        if From:
+            seeds = (performances.filter(session__date_time__lt=From)
+                     .order_by('player_id', '-session__date_time', '-session_id')
+                     .distinct('player_id')
+                     .values_list('player_id', 'pk', 'latest_victory_id'))
+
+            last = {player: (pk, victory) for player, pk, victory in seeds}
+            performances = performances.filter(session__date_time__gte=From)
+
+        # A performance is a victory if the player, or their team, ranked first
+        sfilter = Q(session=OuterRef('session')) & Q(rank=1)
+        pfilter = Q(player=OuterRef('player')) | Q(team__players=OuterRef('player'))
+        won = Exists(Rank.objects.filter(sfilter & pfilter))
+
+        performances = (performances.annotate(won=won)
+                        .order_by('player_id', 'session__date_time', 'session_id')
+                        .only('pk', 'player_id', 'previous_id', 'latest_victory_id'))
+
+        changed = []
+        for performance in performances:
+            previous, victory = last.get(performance.player_id, (None, None))
+
+            if performance.won:
+                victory = performance.pk
+
+            if performance.previous_id != previous or performance.latest_victory_id != victory:
+                performance.previous_id = previous
+                performance.latest_victory_id = victory
+                changed.append(performance)
+
+            last[performance.player_id] = (performance.pk, victory)
+
+        cls.objects.bulk_update(changed, ['previous', 'latest_victory'], batch_size=500)
+
+        if settings.DEBUG:
+            log.debug(f"Linked {len(changed)} performances of game {getattr(game, 'pk', game)}.")
+
+        return len(changed)
+
     def initialise(self, save=False):
         '''
         Initialises the performance object.
@@ -164,14 +244,16 @@ class Performance(AdminModel):
         performance object for that player.
         '''
 
-        previous = self.session.previous_performance(self.player)
+        previous = self.previous
+
+        # The settings in the era this performance falls in
+        TS = TrueskillSettings.asat(self.session.date_time)
 
         if previous is None:
-            TSS = TrueskillSettings()
             self.play_number = 1
             self.victory_count = 1 if self.session.rank(self.player).rank == 1 else 0
-            self.trueskill_mu_before = TSS.mu0
-            self.trueskill_sigma_before = TSS.sigma0
+            self.trueskill_mu_before = TS.mu0
+            self.trueskill_sigma_before = TS.sigma0
             self.trueskill_eta_before = 0
 
         else:
@@ -181,8 +263,11 @@ class Performance(AdminModel):
             self.trueskill_sigma_before = previous.trueskill_sigma_after
             self.trueskill_eta_before = previous.trueskill_eta_after
 
+            # Crossing into a new settings era, eta (a function of µ0 and σ0) is rated anew.
+            if not TS.same_as(previous.trueskill_settings):
+                self.trueskill_eta_before = self.trueskill_mu_before - TS.mu0 / TS.sigma0 * self.trueskill_sigma_before  # µ − (µ0 ÷ σ0) × σ
+
         # Capture the Trueskill settings that are in place now too.
-        TS = TrueskillSettings()
         self.trueskill_mu0 = TS.mu0
         self.trueskill_sigma0 = TS.sigma0
         self.trueskill_delta = TS.delta
@@ -205,9 +290,10 @@ class Performance(AdminModel):
         performance = self
         previous = self.previous_play
 
-        if previous is None:
-            TS = TrueskillSettings()
+        # The settings in the era this performance falls in
+        TS = TrueskillSettings.asat(performance.session.date_time)
 
+        if previous is None:
             trueskill_eta = TS.mu0 - TS.mu0 / TS.sigma0 * TS.sigma0
 
             L.Assert(isclose(performance.trueskill_mu_before, TS.mu0, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance µ mismatch. Before at {performance.session.date_time} is {performance.trueskill_mu_before} and After on previous at Never is {TS.mu0} (the default)")
@@ -216,15 +302,17 @@ class Performance(AdminModel):
         else:
             L.Assert(isclose(performance.trueskill_mu_before, previous.trueskill_mu_after, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance µ mismatch. Before at {performance.session.date_time} is {performance.trueskill_mu_before} and After on previous at {previous.session.date_time} is {previous.trueskill_mu_after}")
             L.Assert(isclose(performance.trueskill_sigma_before, previous.trueskill_sigma_after, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance σ mismatch. Before at {performance.session.date_time} is {performance.trueskill_sigma_before} and After on previous at {previous.session.date_time} is {previous.trueskill_sigma_after}")
-            L.Assert(isclose(performance.trueskill_eta_before, previous.trueskill_eta_after, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance η mismatch. Before at {performance.session.date_time} is {performance.trueskill_eta_before} and After on previous at {previous.session.date_time} is {previous.trueskill_eta_after}")
-
-        # Check that the Trueskill settings are consistent with previous play too
-        if previous is None:
-            TS = TrueskillSettings()
-
-            L.Assert(isclose(performance.trueskill_mu0, TS.mu0, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance µ0 mismatch. At {performance.session.date_time} is {performance.trueskill_mu0} and previous at Never is {TS.mu0}")
-            L.Assert(isclose(performance.trueskill_sigma0, TS.sigma0, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance σ0 mismatch. At {performance.session.date_time} is {performance.trueskill_sigma0} and on previous at Never is {TS.sigma0}")
-            L.Assert(isclose(performance.trueskill_delta, TS.delta, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance δ mismatch. At {performance.session.date_time} is {performance.trueskill_delta} and previous at Never is {TS.delta}")
+            if TS.same_as(previous.trueskill_settings):
+                L.Assert(isclose(performance.trueskill_eta_before, previous.trueskill_eta_after, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance η mismatch. Before at {performance.session.date_time} is {performance.trueskill_eta_before} and After on previous at {previous.session.date_time} is {previous.trueskill_eta_after}")
+            else:
+                trueskill_eta = performance.trueskill_mu_before - TS.mu0 / TS.sigma0 * performance.trueskill_sigma_before
+                L.Assert(isclose(performance.trueskill_eta_before, trueskill_eta, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance η mismatch. Before at {performance.session.date_time} is {performance.trueskill_eta_before} and rated anew in a new settings era is {trueskill_eta}")
+
+        # Check that the Trueskill settings are consistent with the era and previous play too
+        if previous is None or not TS.same_as(previous.trueskill_settings):
+            L.Assert(isclose(performance.trueskill_mu0, TS.mu0, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance µ0 mismatch. At {performance.session.date_time} is {performance.trueskill_mu0} and in its settings era is {TS.mu0}")
+            L.Assert(isclose(performance.trueskill_sigma0, TS.sigma0, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance σ0 mismatch. At {performance.session.date_time} is {performance.trueskill_sigma0} and in its settings era is {TS.sigma0}")
+            L.Assert(isclose(performance.trueskill_delta, TS.delta, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance δ mismatch. At {performance.session.date_time} is {performance.trueskill_delta} and in its settings era is {TS.delta}")
         else:
             L.Assert(isclose(performance.trueskill_mu0, previous.trueskill_mu0, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance µ0 mismatch. At {performance.session.date_time} is {performance.trueskill_mu0} and previous at {previous.session.date_time} is {previous.trueskill_mu0}")
             L.Assert(isclose(performance.trueskill_sigma0, previous.trueskill_sigma0, abs_tol=FLOAT_TOLERANCE), f"{pfx} Performance σ0 mismatch. At {performance.session.date_time} is {performance.trueskill_sigma0} and previous at {previous.session.date_time} is {previous.trueskill_sigma0}")
@@ -257,7 +345,7 @@ class Performance(AdminModel):
         previous = self.previous_play
 
         if previous is None:
-            TS = TrueskillSettings()
+            TS = TrueskillSettings.asat(self.session.date_time)
 
             self.trueskill_mu_before = TS.mu0
             self.trueskill_sigma_before = TS.sigma0
@@ -268,7 +356,7 @@ class Performance(AdminModel):
             self.trueskill_eta_before = previous.trueskill_eta_after
 
         # Catch the Trueskill settings in effect now.
-        TS = TrueskillSettings()
+        TS = TrueskillSettings.asat(self.session.date_time)
         self.trueskill_mu0 = TS.mu0
         self.trueskill_sigma0 = TS.sigma0
         self.trueskill_beta = TS.beta
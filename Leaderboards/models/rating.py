@@ -2,11 +2,14 @@ from . import APP, FLOAT_TOLERANCE, RATING_REBUILD_TRIGGER, TrueskillSettings
 
 from ..leaderboards import LB_PLAYER_LIST_STYLE
 from ..models.leaderboards import Leaderboard_Cache
+from ..trueskill_replay import TrueSkillReplay
 
 import trueskill
 
-from django.db import models, IntegrityError, DataError
-from django.db.models import ExpressionWrapper, Q, F
+from django.db import models, connection, connections, transaction, IntegrityError
+from django.db.models import ExpressionWrapper, Count, Max, Q, F, Case, When, OuterRef, Exists, Value
+from django.db.models.expressions import Window
+from django.db.models.functions import RowNumber
 from django.urls import reverse
 from django.apps import apps
 from django.conf import settings
@@ -20,10 +23,14 @@ from django_rich_views.html import NEVER
 from django_rich_views.model import TimeZoneMixIn, field_render
 from django_rich_views.datetime import safe_tz
 
+from django_cte import With
+
 from math import isclose
 from datetime import timedelta, datetime
 from statistics import mean, stdev
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
 
 from timezone_field import TimeZoneField
 
@@ -118,27 +125,19 @@ class Rating(RatingModel):
     def last_performance(self) -> 'Performance':
         '''
         Returns the latest performance object that this player played this game in.
-        '''
-        game = self.game
-        player = self.player
-        Session = apps.get_model(APP, "Session")
 
-        plays = Session.objects.filter(Q(game=game) & (Q(ranks__player=player) | Q(ranks__team__players=player))).order_by('-date_time')
-
-        return None if (plays is None or plays.count() == 0) else plays[0].performance(player)
+        That is the one no other performance follows (see Performance.link).
+        '''
+        Performance = apps.get_model(APP, "Performance")
+        return Performance.objects.filter(player=self.player, session__game=self.game, following__isnull=True).select_related('session').first()
 
     @property
     def last_winning_performance(self) -> 'Performance':
         '''
         Returns the latest performance object that this player played this game in and won.
         '''
-        game = self.game
-        player = self.player
-        Session = apps.get_model(APP, "Session")
-
-        wins = Session.objects.filter(Q(game=game) & Q(ranks__rank=1) & (Q(ranks__player=player) | Q(ranks__team__players=player))).order_by('-date_time')
-
-        return None if (wins is None or wins.count() == 0) else wins[0].performance(player)
+        last_performance = self.last_performance
+        return None if last_performance is None else last_performance.latest_victory
 
     @property
     def link_internal(self) -> str:
@@ -172,11 +171,9 @@ class Rating(RatingModel):
 
             self.last_play = session.date_time
 
-            if performance.is_victory:
-                self.last_victory = session.date_time
-            else:
-                last_victory = session.previous_victory(performance.player)
-                self.last_victory = NEVER if last_victory is None else last_victory.session.date_time
+            # The latest victory at or before this performance (see Performance.link)
+            last_victory = performance.latest_victory
+            self.last_victory = NEVER if last_victory is None else last_victory.session.date_time
 
             self.trueskill_mu = performance.trueskill_mu_after
             self.trueskill_sigma = performance.trueskill_sigma_after
@@ -205,7 +202,7 @@ class Rating(RatingModel):
         to override it for new Ratings.
         '''
 
-        TS = TrueskillSettings()
+        TS = TrueskillSettings.current()
 
         trueskill_mu = TS.mu0 if mu == None else mu
         trueskill_sigma = TS.sigma0 if sigma == None else sigma
@@ -237,8 +234,6 @@ class Rating(RatingModel):
         :param player: a Player object
         :param game:   a Game object
         '''
-        TS = TrueskillSettings()
-
         try:
             r = Rating.objects.get(player=player, game=game)
         except ObjectDoesNotExist:
@@ -246,6 +241,9 @@ class Rating(RatingModel):
         except MultipleObjectsReturned:
             raise IntegrityError("Integrity error: more than one rating for {} at {}".format(player.name_nickname, game.name))
 
+        # The settings in the era of the last play (that the rating should reflect)
+        TS = TrueskillSettings.asat(r.last_play) if r.plays else TrueskillSettings.current()
+
         if not (isclose(r.trueskill_mu0, TS.mu0, abs_tol=FLOAT_TOLERANCE)
          and isclose(r.trueskill_sigma0, TS.sigma0, abs_tol=FLOAT_TOLERANCE)
          and isclose(r.trueskill_delta, TS.delta, abs_tol=FLOAT_TOLERANCE)
@@ -254,14 +252,133 @@ class Rating(RatingModel):
          and isclose(r.trueskill_p, game.trueskill_p, abs_tol=FLOAT_TOLERANCE)):
             SettingsWere = "µ0: {}, σ0: {}, ß: {}, δ: {}, τ: {}, p: {}".format(r.trueskill_mu0, r.trueskill_sigma0, r.trueskill_delta, r.trueskill_beta, r.trueskill_tau, r.trueskill_p)
             SettingsAre = "µ0: {}, σ0: {}, ß: {}, δ: {}, τ: {}, p: {}".format(TS.mu0, TS.sigma0, TS.delta, game.trueskill_beta, game.trueskill_tau, game.trueskill_p)
-            raise DataError("Data error: A trueskill setting has changed since the last rating was saved. They were ({}) and now are ({})".format(SettingsWere, SettingsAre))
-            # TODO: Issue warning to the registrar more cleanly than this
-            # Email admins with notification and suggested action (fixing settings or rebuilding ratings).
-            # If only game specific settings changed on that game is impacted of course.
-            # If global settings are changed all ratings are affected.
+            # A change in settings re-rates the sessions it affects in bulk (see TrueskillSettings.save)
+            # so we need not fail here, the rating is consistent again once that's done.
+            log.warning("A trueskill setting has changed since the last rating for {} at {} was saved. They were ({}) and now are ({})".format(player, game, SettingsWere, SettingsAre))
 
         return r
 
+    # The Rating fields that materialise() (re)calculates.
+    materialised_fields = ['plays', 'victories',
+                           'last_play', 'last_play_tz', 'last_victory', 'last_victory_tz',
+                           'trueskill_mu', 'trueskill_sigma', 'trueskill_eta',
+                           'trueskill_mu0', 'trueskill_sigma0', 'trueskill_delta',
+                           'trueskill_beta', 'trueskill_tau', 'trueskill_p']
+
+    @classmethod
+    def materialise(cls, games=None, players=None) -> tuple:
+        '''
+        Recomputes Rating rows from the Performances they summarise, in bulk.
+
+        A Rating is just a rapid access copy of the latest Performance of a player at a game
+        (see reset()). Rather than reset ratings one by one (a handful of queries each) this
+        finds the latest Performance of every player/game pair with one window query, along with
+        play and victory counts over the same partition, and upserts the ratings from it with
+        bulk_update and bulk_create.
+
+        Ratings (in scope) that no longer have any Performance behind them are reset to defaults.
+
+        Returns a tuple of (ratings updated, ratings created).
+
+        :param games:   Optionally, a list or QuerySet of Games (or pks). All games if not provided.
+        :param players: Optionally, a list or QuerySet of Players (or pks). All players if not provided.
+        '''
+        Performance = apps.get_model(APP, "Performance")
+        Rank = apps.get_model(APP, "Rank")
+
+        performances = Performance.objects.filter(player__isnull=False, session__game__isnull=False)
+        ratings = cls.objects.all()
+
+        if games:
+            performances = performances.filter(session__game__in=games)
+            ratings = ratings.filter(game__in=games)
+        if players:
+            performances = performances.filter(player__in=players)
+            ratings = ratings.filter(player__in=players)
+
+        # A performance is a victory if the player, or their team, ranked first (as in Performance.link)
+        sfilter = Q(session=OuterRef('session')) & Q(rank=1)
+        pfilter = Q(player=OuterRef('player')) | Q(team__players=OuterRef('player'))
+        won = Exists(Rank.objects.filter(sfilter & pfilter))
+
+        # Windows can't be filtered on (before Django 4.2) so, as in Event.events, we number
+        # the plays in each partition in a CTE and select the latest ones from it.
+        partition = [F('player'), F('session__game')]
+        performances = (performances.order_by()
+                        .annotate(won=won)
+                        .annotate(game_pk=F('session__game'),
+                                  date_time=F('session__date_time'),
+                                  date_time_tz=F('session__date_time_tz'),
+                                  victory_date_time=F('latest_victory__session__date_time'),
+                                  victory_date_time_tz=F('latest_victory__session__date_time_tz'),
+                                  recency=Window(expression=RowNumber(), partition_by=partition, order_by=F('session__date_time').desc()),
+                                  play_count=Window(expression=Count('pk'), partition_by=partition),
+                                  win_count=Window(expression=Count(Case(When(won=True, then=1))), partition_by=partition)))
+
+        performances = With(performances, "latest_performances")
+
+        latest = (performances.queryset().with_cte(performances)
+                  .annotate(recent=performances.col.recency)
+                  .filter(recent=1)
+                  .annotate(plays=performances.col.play_count,
+                            victories=performances.col.win_count,
+                            last_play=performances.col.date_time,
+                            last_play_tz=performances.col.date_time_tz,
+                            last_victory=performances.col.victory_date_time,
+                            last_victory_tz=performances.col.victory_date_time_tz,
+                            game_id=performances.col.game_pk)
+                  .values('player_id', 'game_id', 'plays', 'victories',
+                          'last_play', 'last_play_tz', 'last_victory', 'last_victory_tz',
+                          'trueskill_mu_after', 'trueskill_sigma_after', 'trueskill_eta_after',
+                          'trueskill_mu0', 'trueskill_sigma0', 'trueskill_delta',
+                          'trueskill_beta', 'trueskill_tau', 'trueskill_p'))
+
+        latest = {(row['player_id'], row['game_id']): row for row in latest}
+
+        def materialise_rating(rating, row):
+            rating.plays = row['plays']
+            rating.victories = row['victories']
+            rating.last_play = row['last_play']
+            rating.last_play_tz = row['last_play_tz']
+            rating.last_victory = NEVER if row['last_victory'] is None else row['last_victory']
+            rating.last_victory_tz = settings.TIME_ZONE if row['last_victory_tz'] is None else row['last_victory_tz']
+            rating.trueskill_mu = row['trueskill_mu_after']
+            rating.trueskill_sigma = row['trueskill_sigma_after']
+            rating.trueskill_eta = row['trueskill_eta_after']
+            rating.trueskill_mu0 = row['trueskill_mu0']
+            rating.trueskill_sigma0 = row['trueskill_sigma0']
+            rating.trueskill_delta = row['trueskill_delta']
+            rating.trueskill_beta = row['trueskill_beta']
+            rating.trueskill_tau = row['trueskill_tau']
+            rating.trueskill_p = row['trueskill_p']
+
+        existing = []
+        for rating in ratings.select_related('player', 'game'):
+            row = latest.pop((rating.player_id, rating.game_id), None)
+            if row:
+                materialise_rating(rating, row)
+            else:
+                # No performances, so the player never played the game (any more).
+                default = cls.create(rating.player, rating.game)
+                for field in cls.materialised_fields:
+                    setattr(rating, field, getattr(default, field))
+            existing.append(rating)
+
+        # What's left in latest are the player/game pairs that have no rating yet
+        created = []
+        for (player, game), row in latest.items():
+            rating = cls(player_id=player, game_id=game)
+            materialise_rating(rating, row)
+            created.append(rating)
+
+        cls.objects.bulk_update(existing, cls.materialised_fields, batch_size=500)
+        cls.objects.bulk_create(created, batch_size=500)
+
+        if settings.DEBUG:
+            log.debug(f"Materialised {len(existing)} ratings and created {len(created)}.")
+
+        return len(existing), len(created)
+
     @classmethod
     def leaderboards(cls, games, style=LB_PLAYER_LIST_STYLE.none) -> dict:
         '''
@@ -275,13 +392,22 @@ class Rating(RatingModel):
         return {g.pk: g.leaderboard(style=style) for g in games}
 
     @classmethod
-    def update(cls, session):
+    def update(cls, session, link=True):
         '''
         Update the ratings for all the players of a given session.
 
         :param session:   A Session object
+        :param link:      If True, first links the session's performances into the adjacency
+                          index (see Performance.link) and finally records their rating timeline
+                          (see RatingTimeline.record), invalidating the leaderboard cache from
+                          this session on. A rebuild does all three for whole games.
         '''
-        TS = TrueskillSettings()
+        Performance = apps.get_model(APP, "Performance")
+
+        TS = TrueskillSettings.asat(session.date_time)
+
+        if link:
+            Performance.link(session.game, session.performances.values('player'), From=session.date_time)
 
         # Check to see if this is the latest play for each player
         # And capture the current rating for each player (which we will update)
@@ -304,11 +430,10 @@ class Rating(RatingModel):
         # This updates the Performance objects associated with that session.
         impact = session.calculate_trueskill_impacts()
 
-        # Invalidate any cache that may exist for this session
-        # Any dwonstream dependent sessions will be covered by
-        # the calling rebuildder - this method only handles this
-        # specific indivual session.
-        Leaderboard_Cache.invalidate(session)
+        # Invalidate any cache that may exist for this session (and the later sessions of its
+        # game). A rebuild (link=False) invalidates the cache of all its sessions at once.
+        if link:
+            Leaderboard_Cache.invalidate(session)
 
         # Update the rating for this player/game combo
         # So this regardless of the sessions status as latest for any players
@@ -351,12 +476,160 @@ class Rating(RatingModel):
 
                 r.save()
 
+        if link:
+            RatingTimeline = apps.get_model(APP, "RatingTimeline")
+            RatingTimeline.record(session.game, session.performances.values('player'), From=session.date_time)
+
+    @classmethod
+    def _record_timelines(cls, sessions):
+        '''
+        Records the rating timeline (see RatingTimeline) of every game the nominated sessions
+        are in, from the first of them in each game.
+
+        :param sessions: A list or QuerySet of Session objects
+        '''
+        RatingTimeline = apps.get_model(APP, "RatingTimeline")
+
+        From = {}
+        for s in sessions:
+            if not s.game_id in From or s.date_time < From[s.game_id]:
+                From[s.game_id] = s.date_time
+
+        for game, date_time in From.items():
+            RatingTimeline.record(game, From=date_time)
+
     @classmethod
-    def rebuild(cls, Game=None, From=None, Sessions=None, Reason=None, Trigger=None, Session=None):
+    def _rebuild_sessions(cls, sessions, progress=None):
+        '''
+        Rebuilds the ratings of the nominated sessions one by one, in chronological order
+        (the traditional path for Rating.rebuild).
+
+        :param sessions: A list or QuerySet of Session objects, ordered by date_time.
+        :param progress: Optionally a callable that receives (sessions done, sessions total) as sessions are rebuilt
+        '''
+        # Traverse sessions in chronological order (order_by is the time of the session) and update ratings from each session
+        ratings_to_reset = set()  # Use a set to avoid duplicity
+        total = len(sessions)
+        for i, s in enumerate(sessions, 1):
+            cls.update(s, link=False)
+            for p in s.players:
+                ratings_to_reset.add((p, s.game))  # Collect a set of player, game tuples.
+
+            if progress:
+                progress(i, total)
+
+        # After having updated all the sessions we need to ensure
+        # that the Rating objects are up to date. They are set to
+        # that after the last played session of their player/game
+        # pair, in bulk.
+        if ratings_to_reset:
+            players = {p.pk for p, g in ratings_to_reset}
+            games = {g.pk for p, g in ratings_to_reset}
+            cls.materialise(games, players)
+
+    # The default number of sessions a checkpointed rebuild commits in each batch
+    checkpoint = 500
+
+    @classmethod
+    def _rebuild_checkpointed(cls, rlog, sessions, checkpoint, progress=None, done=0):
+        '''
+        Rebuilds the ratings of the nominated sessions in batches, committing each batch and
+        recording the last session of it on the RebuildLog as a checkpoint.
+
+        Each batch is replayed in memory (see TrueSkillReplay) and only its Performances are
+        written, the replay of the next batch picking up from them. The Ratings are materialised
+        from the Performances once all batches are done, so they are only exposed when the rebuild
+        completes.
+
+        Must be called outside of a transaction (or the batches cannot commit).
+
+        :param rlog:       The RebuildLog of the rebuild
+        :param sessions:   A list of Session objects, ordered by date_time.
+        :param checkpoint: The number of sessions to commit in each batch
+        :param progress:   Optionally a callable that receives (sessions done, sessions total) as sessions are rebuilt
+        :param done:       The number of sessions already rebuilt (when resuming)
+        '''
+        RebuildLog = apps.get_model(APP, "RebuildLog")
+
+        total = done + len(sessions)
+        games = {s.game_id for s in rlog.sessions.all()}
+
+        for i in range(0, len(sessions), checkpoint):
+            batch = sessions[i:i + checkpoint]
+            before = done + i
+
+            with transaction.atomic():
+                replay = TrueSkillReplay(batch)
+                replay.run(progress=(lambda d, t: progress(before + d, total)) if progress else None)
+                replay.save(ratings=False)
+
+                rlog.checkpoint = batch[-1]
+                RebuildLog.objects.filter(pk=rlog.pk).update(checkpoint=rlog.checkpoint)
+
+            if settings.DEBUG:
+                log.debug(f"Checkpoint: rebuilt {before + len(batch)} of {total} sessions (RebuildLog {rlog.pk}).")
+
+        # All the performances are rebuilt, expose the ratings.
+        with transaction.atomic():
+            cls.materialise(games)
+            cls._record_timelines(rlog.sessions.all())
+
+            # Invalidate any cache that may exist for these sessions (one generation bump per game)
+            Leaderboard_Cache.invalidate_sessions(rlog.sessions.all())
+
+            rlog.complete = True
+            RebuildLog.objects.filter(pk=rlog.pk).update(complete=True)
+
+    @classmethod
+    def resume(cls, rlog, Checkpoint=None, Progress=None):
+        '''
+        Resumes a checkpointed rebuild (see Rating.rebuild) that did not complete, from its
+        last checkpoint, and returns its RebuildLog.
+
+        :param rlog:       A RebuildLog object (or pk), of a rebuild that did not complete
+        :param Checkpoint: The number of sessions to commit in each batch
+        :param Progress:   Optionally a callable that receives (sessions done, sessions total) as sessions are rebuilt
+        '''
+        RebuildLog = apps.get_model(APP, "RebuildLog")
+
+        if not isinstance(rlog, RebuildLog):
+            rlog = RebuildLog.objects.get(pk=rlog)
+
+        assert not rlog.complete, f"RebuildLog {rlog.pk} is complete, there is nothing to resume."
+        assert not connection.in_atomic_block, "Cannot resume a checkpointed rebuild inside a transaction."
+
+        # The same order the rebuild took (a replay orders sessions by time, stably)
+        sessions = list(rlog.sessions.order_by('date_time', 'pk').select_related('game'))
+
+        done = 0
+        if rlog.checkpoint_id:
+            done = [s.pk for s in sessions].index(rlog.checkpoint_id) + 1
+
+        if settings.DEBUG:
+            log.debug(f"Resuming RebuildLog {rlog.pk} after {done} of {len(sessions)} sessions.")
+
+        cls.__bypass_admin__ = True
+        start = localtime()
+
+        cls._rebuild_checkpointed(rlog, sessions[done:], Checkpoint or cls.checkpoint, progress=Progress, done=done)
+
+        cls.__bypass_admin__ = False
+
+        rlog.save_leaderboards({s.game for s in sessions}, "after")
+
+        end = localtime()
+        rlog.duration = (rlog.duration or timedelta(0)) + (end - start)
+        rlog.save()
+
+        return rlog
+
+    @classmethod
+    def rebuild(cls, Game=None, From=None, Sessions=None, Reason=None, Trigger=None, Session=None, InMemory=False, Processes=None, Parent=None, Progress=None, Checkpoint=None):
         '''
         Rebuild the ratings for a specific game from a specific time.
 
-        Returns a RebuildLog instance (with an html attribute if not triggered by a session)
+        Returns a RebuildLog instance (with an html attribute if not triggered by a session), or
+        None if there are no sessions to rebuild.
 
         If neither Game nor From nor Sessions are specified, rebuilds ALL ratings
         If both Game and From specified rebuilds ratings only for that game for sessions from that datetime
@@ -364,15 +637,45 @@ class Rating(RatingModel):
         If only From is specified rebuilds ratings for all games from that datetime
         If only Sessions is specified rebuilds only the nominated Sessions
 
+        If InMemory is True, the rebuild bulk loads all the data it needs up front, replays
+        the TrueSkill calculations in memory and writes the results back in bulk (see
+        TrueSkillReplay). The results are identical, it is just much faster on large rebuilds.
+
+        If Processes is more than 1 and no Game or Sessions are specified, the rebuild is
+        partitioned by game (ratings are keyed on player and game, so each game is an
+        independent rating universe) and the games are rebuilt in a pool of that many worker
+        processes. Each game gets its own RebuildLog, as a partition of the returned parent log.
+        Forking is for processes that don't serve requests (manage.py rebuild_ratings) only.
+
+        If Checkpoint is provided (and we are not in a transaction) the rebuild commits in batches of
+        that many sessions, recording the last session of each on the RebuildLog. Should the rebuild
+        die (a worker timeout or running out of memory) it can be resumed from there with
+        Rating.resume(). The ratings are only updated once all the sessions are rebuilt. A
+        checkpointed rebuild always uses the in-memory replay engine.
+
         :param Game:     A Game object
         :param From:     A datetime
         :param Sessions: A list of Session objects or a QuerySet of Sessions.
         :param Reason:   A string, to log as a reason for the rebuild
         :param Trigger:  A RATING_REBUILD_TRIGGER value
         :param Session:  A Session object if an edit (create or update) of a session triggered this rebuild
+        :param InMemory: If True use the in-memory replay engine rather than updating sessions one by one
+        :param Processes: The number of worker processes to partition a rebuild of all games across
+        :param Parent:   The pk of a parent RebuildLog if this is one partition of a partitioned rebuild
+        :param Progress: Optionally a callable that receives (sessions done, sessions total) as sessions are rebuilt
+        :param Checkpoint: If provided, commit the rebuild in batches of this many sessions (see below)
         '''
         SessionModel = apps.get_model(APP, "Session")
 
+        if Processes and Processes > 1 and not Game and not Sessions:
+            # Workers write to the database on their own connections and cannot see an uncommitted
+            # parent log (or anything else uncommitted here), so we only partition outside of transactions.
+            if connection.in_atomic_block:
+                if settings.DEBUG:
+                    log.debug("Cannot partition a rebuild inside a transaction. Rebuilding in this process.")
+            else:
+                return cls._rebuild_partitioned(From=From, Reason=Reason, Trigger=Trigger, InMemory=InMemory, Processes=Processes)
+
         # If ever performed keep a record of duration overall and per
         # session to permit a cost estimate should it happen again.
         # On a large database this could be a costly exercise, causing
@@ -407,6 +710,12 @@ class Rating(RatingModel):
             sessions = SessionModel.objects.filter(sfilterg & sfilterf).order_by('date_time')
             first_session = sessions.first()
 
+        if first_session is None:
+            cls.__bypass_admin__ = False
+            if settings.DEBUG:
+                log.debug("No sessions to rebuild ratings for.")
+            return None
+
         affected_games = set([s.game for s in sessions])
         if settings.DEBUG:
             log.debug(f"{len(sessions)} Sessions to process, affecting {len(affected_games)} games.")
@@ -428,6 +737,18 @@ class Rating(RatingModel):
             if not Session is None:
                 rlog.session = Session
 
+        if Parent:
+            rlog.parent_id = Parent
+
+        # Batches can only commit outside of a transaction
+        if Checkpoint and connection.in_atomic_block:
+            if settings.DEBUG:
+                log.debug("Cannot checkpoint a rebuild inside a transaction. Rebuilding in one go.")
+            Checkpoint = None
+
+        if Checkpoint:
+            rlog.complete = False
+
         # Need to save it to get a PK before we can attach the sessions set to the log entry.
         rlog.save()
         rlog.sessions.set(sessions)
@@ -438,44 +759,35 @@ class Rating(RatingModel):
         # Now save the leaderboards for all affected games.
         rlog.save_leaderboards(affected_games, "before")
 
-        # Delete all BackupRating objects
-        BackupRating.reset()
+        # Make sure the adjacency index (previous plays and victories) is up to date for the
+        # affected games, so that the rebuild (and lookups after it) can rely on it.
+        PerformanceModel = apps.get_model(APP, "Performance")
+        for game in affected_games:
+            PerformanceModel.link(game)
+
+        # Snapshot the ratings of the affected games so the rebuild can be compared with them
+        # (a partitioned rebuild takes one snapshot of all games, in the parent)
+        if not Parent:
+            BackupRating.snapshot(rlog, affected_games)
+
+        if Checkpoint:
+            # In the order Rating.resume() will expect
+            sessions = sorted(sessions, key=lambda s: (s.date_time, s.pk))
+            cls._rebuild_checkpointed(rlog, sessions, Checkpoint, progress=Progress)
+        elif InMemory:
+            replay = TrueSkillReplay(sessions)
+            replay.load()
+            replay.run(progress=Progress)
+            replay.save()
+        else:
+            cls._rebuild_sessions(sessions, progress=Progress)
 
-        # Traverse sessions in chronological order (order_by is the time of the session) and update ratings from each session
-        ratings_to_reset = set()  # Use a set to avoid duplicity
-        backedup = set()
-        for s in sessions:
-            # Backup a rating only the first time we encounter it
-            # Ratings apply to a player/game pair and we want a backup
-            # of the rating before this rebuild process starts to
-            # compare the final ratings to. We only want to backup
-            # ratings that are being updated though hence first time
-            # see a player/game pair in the rebuild process, nab a
-            # backup.
-            for p in s.performances.all():
-                rkey = (p.player, s.game)
-                if not rkey in backedup:
-                    try:
-                        rating = Rating.get(p.player, s.game)
-                        BackupRating.clone(rating)
-                    except:
-                        # Ignore errors, We just won't record that rating as backedup.
-                        pass
-                    else:
-                        backedup.add(rkey)
-
-            cls.update(s)
-            for p in s.players:
-                ratings_to_reset.add((p, s.game))  # Collect a set of player, game tuples.
+        # A checkpointed rebuild records the timelines and invalidates the cache when it completes
+        if not Checkpoint:
+            cls._record_timelines(sessions)
 
-        # After having updated all the sessions we need to ensure
-        # that the Rating objects are up to date.
-        for rating in ratings_to_reset:
-            if settings.DEBUG:
-                log.debug(f"Resetting rating for {rating}")
-            r = Rating.get(*rating)  # Unpack the tuple to player, game
-            r.reset()  # Sets the rating to that after the ast played session in that game/player that the rating is for
-            r.save()
+            # Invalidate any cache that may exist for these sessions (one generation bump per game)
+            Leaderboard_Cache.invalidate_sessions(sessions)
 
         # Desist from bypassing admin field updates
         cls.__bypass_admin__ = False
@@ -490,18 +802,94 @@ class Rating(RatingModel):
         # And save the complete Rebuild Log entry
         rlog.save()
 
-        if Trigger == RATING_REBUILD_TRIGGER.user_request:
+        if Trigger == RATING_REBUILD_TRIGGER.user_request and not Parent:
             if settings.DEBUG:
                 log.debug("Generating HTML diff.")
 
             # Add an html attribute to rlog (not a database field) so that the caller can render a report.
-            rlog.html = BackupRating.html_diff()
+            rlog.html = BackupRating.html_diff(rlog)
 
         if settings.DEBUG:
             log.debug("Done.")
 
         return rlog
 
+    @classmethod
+    def _rebuild_partitioned(cls, From=None, Reason=None, Trigger=None, InMemory=False, Processes=2):
+        '''
+        Rebuilds the ratings of all games (from a given time) partitioning the work by game across
+        a pool of worker processes. See Rating.rebuild().
+
+        Returns the parent RebuildLog, whose partitions are the RebuildLogs of each game, or None
+        if there are no sessions to rebuild.
+
+        :param From:      A datetime
+        :param Reason:    A string, to log as a reason for the rebuild
+        :param Trigger:   A RATING_REBUILD_TRIGGER value
+        :param InMemory:  If True each game is rebuilt with the in-memory replay engine
+        :param Processes: The number of worker processes to use
+        '''
+        SessionModel = apps.get_model(APP, "Session")
+        RebuildLog = apps.get_model(APP, "RebuildLog")
+
+        sfilter = Q(date_time__gte=From) if isinstance(From, datetime) else Q()
+        sessions = SessionModel.objects.filter(sfilter)
+        first_session = sessions.order_by('date_time').first()
+
+        if first_session is None:
+            if settings.DEBUG:
+                log.debug(f"No sessions to rebuild ratings for from {From}.")
+            return None
+
+        # Submit the biggest games first, so that the pool isn't left waiting on one at the end.
+        games = sessions.order_by().values('game').annotate(sessions=Count('pk')).order_by('-sessions')
+        games = [g['game'] for g in games]
+
+        if settings.DEBUG:
+            log.debug(f"Rebuilding leaderboard ratings for {len(games)} games from {From} in {Processes} processes.")
+
+        # The parent log records the whole rebuild, the partitions record the sessions
+        # they rebuilt and their leaderboards before and after.
+        rlog = RebuildLog(game=None,
+                          date_time_from=first_session.date_time_local,
+                          ratings=sessions.count(),
+                          reason=Reason)
+
+        if not Trigger is None:
+            rlog.trigger = Trigger.value
+
+        rlog.save()
+
+        # One snapshot of all the games, that the partitions rebuild
+        BackupRating.snapshot(rlog, games)
+
+        start = localtime()
+
+        # Each worker needs its own database connection. Forked workers inherit ours, so we
+        # close it first and they each open their own on first use (as will we, afterwards).
+        connections.close_all()
+
+        with ProcessPoolExecutor(max_workers=Processes, mp_context=get_context('fork')) as pool:
+            futures = [pool.submit(_rebuild_partition, game, From, Reason, Trigger, rlog.pk, InMemory) for game in games]
+
+            for future in as_completed(futures):
+                game, partition, duration = future.result()
+                if settings.DEBUG:
+                    log.debug(f"Rebuilt ratings for game {game} in {duration} (RebuildLog {partition}).")
+
+        end = localtime()
+        rlog.duration = end - start
+        rlog.save()
+
+        if settings.DEBUG:
+            log.debug(f"Rebuilt ratings for {len(games)} games in {rlog.duration} (the sum of game durations is {sum(rlog.partition_durations.values(), timedelta())}).")
+
+        if Trigger == RATING_REBUILD_TRIGGER.user_request:
+            # Add an html attribute to rlog (not a database field) so that the caller can render a report.
+            rlog.html = BackupRating.html_diff(rlog)
+
+        return rlog
+
     @classmethod
     def estimate_rebuild_cost(cls, n=1):
         '''
@@ -511,13 +899,15 @@ class Rating(RatingModel):
         '''
         RebuildLog = apps.get_model(APP, "RebuildLog")
 
+        # The parent log of a partitioned rebuild records the elapsed time of a parallel rebuild,
+        # we learn from the partitions (the cost of each game) and from unpartitioned rebuilds only.
         Cost = ExpressionWrapper(F('duration') / F('ratings'), output_field=models.DurationField())
-        Costs = RebuildLog.objects.all().annotate(cost=Cost).values_list('cost', flat=True)
+        Costs = RebuildLog.objects.filter(partitions__isnull=True, duration__isnull=False).annotate(cost=Cost).values_list('cost', flat=True)
 
         if Costs:
             costs = [c.total_seconds() for c in Costs]
             mean_cost = mean(costs)
-            nstdev_cost = stdev(costs) / mean_cost
+            nstdev_cost = stdev(costs) / mean_cost if len(costs) > 1 else 0
 
             cost_estimate = timedelta(seconds=n * mean_cost)  # The predicted cost of prebuilding n sessions
             cost_variance = timedelta(seconds=nstdev_cost)  # The coeeficient of variance (0 to 1)
@@ -587,81 +977,169 @@ class Rating(RatingModel):
         verbose_name_plural = "Ratings"
 
 
+def _rebuild_partition(game, From, Reason, Trigger, parent, InMemory):
+    '''
+    A worker process task for a partitioned rebuild (see Rating.rebuild). Rebuilds the
+    ratings for one game and returns a tuple of (game pk, RebuildLog pk, duration).
+
+    :param game:     A Game pk
+    :param From:     A datetime or None
+    :param Reason:   A string, to log as a reason for the rebuild
+    :param Trigger:  A RATING_REBUILD_TRIGGER value
+    :param parent:   The pk of the parent RebuildLog
+    :param InMemory: If True use the in-memory replay engine
+    '''
+    Game = apps.get_model(APP, "Game")
+    rlog = Rating.rebuild(Game=Game.objects.get(pk=game), From=From, Reason=Reason, Trigger=Trigger, Parent=parent, InMemory=InMemory)
+    return game, rlog.pk, rlog.duration
+
+
 class BackupRating(RatingModel):
     '''
-    A simple container for a complete backup of Rating.
+    A simple container for snapshots of Rating.
 
     Used when doing a rebuild of ratings so as to have the previous copy on hand, and to be able to
     compare to see what the impact of the rebuild was. This can be very relevant if rebuilding because of
     a change to TrueSkill settings for example, when tuning the settings for particular games.
 
+    Each rebuild takes a snapshot of the ratings it will touch, tagged with its RebuildLog, so that
+    several historic snapshots can be kept (they are deleted along with the log). Only the latest
+    settings.RATING_SNAPSHOTS_KEPT are kept, older ones are pruned as each is taken.
+
     # TODO: Put an option on the leaderboards view to see the Backup leaderboards, and another to show a comparison
     '''
+    rebuild_log = models.ForeignKey('RebuildLog', verbose_name='Rebuild Log', related_name='rating_snapshots', null=True, blank=True, on_delete=models.CASCADE)  # If the log is deleted, delete its snapshot
 
     @classmethod
-    def reset(cls):
+    def prune(cls, keep=None) -> int:
         '''
-        Deletes all backup ratings
+        Deletes all but the latest snapshots (and any backup ratings not tagged with a RebuildLog).
+
+        Returns the number of ratings deleted.
+
+        :param keep: The number of snapshots to keep, settings.RATING_SNAPSHOTS_KEPT by default.
         '''
-        cls.objects.all().delete()
+        if keep is None:
+            keep = getattr(settings, "RATING_SNAPSHOTS_KEPT", 10)
+
+        kept = list(cls.objects.exclude(rebuild_log=None).order_by('-rebuild_log').values_list('rebuild_log', flat=True).distinct()[:keep])
+        deleted, _ = cls.objects.exclude(rebuild_log__in=kept).delete()
+
+        if settings.DEBUG and deleted:
+            log.debug(f"Pruned {deleted} backup ratings, keeping the snapshots of RebuildLogs {kept}.")
+
+        return deleted
 
     @classmethod
-    def clone(cls, rating):
+    def snapshot(cls, rebuild_log, games=None) -> int:
         '''
-        Clones a rating into the Backup model (database table)
+        Snapshots the current ratings into the Backup model (database table) tagged with a RebuildLog.
+
+        A single set based INSERT ... SELECT, the ratings never leave the database.
+
+        Returns the number of ratings snapshotted.
 
-        :param rating: A Rating object
+        :param rebuild_log: A RebuildLog object (or pk) to tag the snapshot with
+        :param games:       Optionally, a list or QuerySet of Games (or pks) to snapshot the ratings of. All games if not provided.
         '''
-        try:
-            backup = cls.objects.get(player=rating.player, game=rating.game)
-        except ObjectDoesNotExist:
-            backup = cls()
+        fields = [f for f in Rating._meta.concrete_fields if not f.primary_key]
+
+        ratings = Rating.objects.all()
+        if games:
+            ratings = ratings.filter(game__in=games)
+
+        # values() selects the fields in the order given, followed by annotations.
+        ratings = (ratings.order_by()
+                   .annotate(snapshot=Value(getattr(rebuild_log, 'pk', rebuild_log), output_field=models.IntegerField()))
+                   .values(*[f.attname for f in fields], 'snapshot'))
+
+        select, params = ratings.query.sql_with_params()
+
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        columns = ", ".join([qn(f.column) for f in fields] + [qn(cls._meta.get_field('rebuild_log').column)])
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {table} ({columns}) {select}", params)
+            count = cursor.rowcount
+
+        if settings.DEBUG:
+            log.debug(f"Snapshotted {count} ratings for RebuildLog {getattr(rebuild_log, 'pk', rebuild_log)}.")
+
+        cls.prune()
 
-        for field in rating._meta.fields:
-            if not field.primary_key:
-                setattr(backup, field.name, getattr(rating, field.name))
+        return count
 
-        backup.save()
+    @classmethod
+    def latest_snapshot(cls):
+        '''
+        Returns the pk of the RebuildLog that tagged the most recent snapshot (or None if there is none).
+        '''
+        return cls.objects.aggregate(latest=Max('rebuild_log'))['latest']
 
     @classmethod
-    def diff(cls, show_unchanged=True):
+    def diff(cls, rebuild_log=None, show_unchanged=True):
         '''
         Returns an a dictionary summarising differences between current ratings and
         backed up ratings. It is an ordered dictionary keyed on the tuple of player id
         and game id containing a 9 tuple of the old, diff and new values for the three
         rating measures (eta, mu, sigma)
 
+        Computed with one join of the snapshot on the current ratings.
+
+        :param rebuild_log:    The RebuildLog (or pk) whose snapshot to compare with. The latest snapshot if not provided.
         :param show_unchanged: Include ratings that didn't change.
         '''
-        diffs = OrderedDict()
-        for r in cls.objects.all().order_by('game', '-trueskill_eta'):
-            R = Rating.get(r.player, r.game)
-
-            diff_eta = R.trueskill_eta - r.trueskill_eta
-            diff_mu = R.trueskill_mu - r.trueskill_mu
-            diff_sigma = R.trueskill_sigma - r.trueskill_sigma
+        if rebuild_log is None:
+            rebuild_log = cls.latest_snapshot()
+
+        qn = connection.ops.quote_name
+        backup = qn(cls._meta.db_table)
+        rating = qn(Rating._meta.db_table)
+
+        changed = "" if show_unchanged else """
+            AND (ABS(r.trueskill_eta - b.trueskill_eta) > %(tolerance)s
+              OR ABS(r.trueskill_mu - b.trueskill_mu) > %(tolerance)s
+              OR ABS(r.trueskill_sigma - b.trueskill_sigma) > %(tolerance)s)"""
+
+        sql = f"""
+            SELECT b.player_id, b.game_id,
+                   b.trueskill_eta, b.trueskill_mu, b.trueskill_sigma,
+                   r.trueskill_eta - b.trueskill_eta, r.trueskill_mu - b.trueskill_mu, r.trueskill_sigma - b.trueskill_sigma,
+                   r.trueskill_eta, r.trueskill_mu, r.trueskill_sigma
+            FROM {backup} b
+            JOIN {rating} r ON r.player_id = b.player_id AND r.game_id = b.game_id
+            WHERE b.rebuild_log_id = %(rebuild_log)s{changed}
+            ORDER BY b.game_id, b.trueskill_eta DESC"""
+
+        params = {'rebuild_log': getattr(rebuild_log, 'pk', rebuild_log), 'tolerance': FLOAT_TOLERANCE}
 
-            if (show_unchanged
-                or abs(diff_eta) > FLOAT_TOLERANCE
-                or abs(diff_mu) > FLOAT_TOLERANCE
-                or abs(diff_sigma) > FLOAT_TOLERANCE):
-                diffs[(r.player.pk, r.game.pk)] = (r.trueskill_eta, r.trueskill_mu, r.trueskill_sigma,
-                                                   diff_eta, diff_mu, diff_sigma,
-                                                   R.trueskill_eta, R.trueskill_mu, R.trueskill_sigma)
+        diffs = OrderedDict()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for player, game, *values in cursor.fetchall():
+                diffs[(player, game)] = tuple(values)
 
         return diffs
 
     @classmethod
-    def html_diff(cls, show_unchanged=True):
+    def html_diff(cls, rebuild_log=None, show_unchanged=True):
         '''
         Returns an HTML table (string) summarising differences between current ratings and
         backed up ratings.
 
+        :param rebuild_log:    The RebuildLog (or pk) whose snapshot to compare with. The latest snapshot if not provided.
         :param show_unchanged: Include ratings that didn't change.
         '''
+        Game = apps.get_model(APP, "Game")
+        Player = apps.get_model(APP, "Player")
+
         sign = lambda a: '-' if a < 0 else '+'
 
-        diffs = cls.diff(show_unchanged)
+        diffs = cls.diff(rebuild_log, show_unchanged)
+
+        games = Game.objects.in_bulk({g for p, g in diffs})
+        players = Player.objects.in_bulk({p for p, g in diffs})
 
         html = "<TABLE>"
         html += "<TR>"
@@ -671,26 +1149,22 @@ class BackupRating(RatingModel):
         html += "<TH>Mean (µ)</TH>"
         html += "<TH>Standard Deviation(µ)</TH>"
         html += "</TR>"
-        for r in cls.objects.all().order_by('game', '-trueskill_eta'):
+        for (player, game), diff in diffs.items():
             (old_eta, old_mu, old_sigma,
              diff_eta, diff_mu, diff_sigma,
-             new_eta, new_mu, new_sigma) = diffs[(r.player.pk, r.game.pk)]
+             new_eta, new_mu, new_sigma) = diff
 
             eqn_eta = f"{old_eta:.4f} {sign(diff_eta)} {abs(diff_eta):.4f} = {new_eta:.4f}"
             eqn_mu = f"{old_mu:.4f} {sign(diff_mu)} {abs(diff_mu):.4f} = {new_mu:.4f}"
             eqn_sigma = f"{old_sigma:.4f} {sign(diff_sigma)} {abs(diff_sigma):.4f} = {new_sigma:.4f}"
 
-            if (show_unchanged
-                or abs(diff_eta) > FLOAT_TOLERANCE
-                or abs(diff_mu) > FLOAT_TOLERANCE
-                or abs(diff_sigma) > FLOAT_TOLERANCE):
-                html += "<TR>"
-                html += f"<TD>{r.game.name}</TD>"
-                html += f"<TD>{r.player.name()}</TD>"
-                html += f"<TD>{eqn_eta}</TD>"
-                html += f"<TD>{eqn_mu}</TD>"
-                html += f"<TD>{eqn_sigma}</TD>"
-                html += "</TR>"
+            html += "<TR>"
+            html += f"<TD>{games[game].name}</TD>"
+            html += f"<TD>{players[player].name()}</TD>"
+            html += f"<TD>{eqn_eta}</TD>"
+            html += f"<TD>{eqn_mu}</TD>"
+            html += f"<TD>{eqn_sigma}</TD>"
+            html += "</TR>"
         html += "</TABLE>"
 
         return html
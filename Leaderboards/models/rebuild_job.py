@@ -0,0 +1,269 @@
+from . import APP, RATING_REBUILD_TRIGGER, REBUILD_JOB_STATUS
+
+from django.db import models, transaction
+from django.apps import apps
+from django.conf import settings
+from django.utils.timezone import localtime
+
+from django_model_admin_fields import AdminModel
+
+from datetime import timedelta
+
+import traceback
+
+from Site.logutils import log
+
+
+class RebuildJob(AdminModel):
+    '''
+    A queued rating rebuild.
+
+    A session edit (add, update or delete) that is not the latest session in its game for all
+    its players demands a rebuild of the ratings for all the sessions in its future (see
+    Session.future_sessions). Those rebuilds can be slow and rather than perform them in the
+    request that submits the session (holding a transaction open for the duration and keeping
+    the registrar waiting) they can be queued here and performed out of band by a worker
+    (manage.py rebuild_worker).
+
+    A job records the sessions that are pending a rebuild and the games they affect, and its
+    progress while a worker is rebuilding them, so that the session impact view can report on
+    it (see ajax_Rebuild_Progress).
+    '''
+    # AdminModel provides created_by and created_on that record who queued the rebuild when.
+
+    status = models.PositiveSmallIntegerField(choices=REBUILD_JOB_STATUS.choices.value, default=REBUILD_JOB_STATUS.pending.value, blank=False)
+
+    # The arguments for Rating.rebuild() (see RebuildLog which records the same for rebuilds performed)
+    trigger = models.PositiveSmallIntegerField(choices=RATING_REBUILD_TRIGGER.choices.value, default=RATING_REBUILD_TRIGGER.user_request.value, blank=False)
+    session = models.ForeignKey('Session', verbose_name='Session', related_name='rebuild_jobs_triggered', null=True, blank=True, on_delete=models.SET_NULL)
+    reason = models.TextField('Reason for Rebuild')
+
+    # The sessions pending a rebuild, and the games they are in.
+    sessions = models.ManyToManyField('Session', blank=True, related_name='rebuild_jobs')
+    games = models.ManyToManyField('Game', blank=True, related_name='rebuild_jobs')
+
+    # Any change logs that wait on this rebuild (they are given the rebuild log when it's done)
+    change_logs = models.ManyToManyField('ChangeLog', blank=True, related_name='rebuild_jobs')
+
+    # Progress
+    sessions_total = models.PositiveIntegerField('Number of Sessions to Rebuild', default=0)
+    sessions_done = models.PositiveIntegerField('Number of Sessions Rebuilt', default=0)
+    started = models.DateTimeField('Time the Rebuild Started', null=True, blank=True)
+    finished = models.DateTimeField('Time the Rebuild Finished', null=True, blank=True)
+
+    # The outcome
+    rebuild_log = models.ForeignKey('RebuildLog', null=True, blank=True, related_name='rebuild_jobs', on_delete=models.SET_NULL)
+    error = models.TextField('Reason for Failure', null=True, blank=True)
+
+    # The minimum interval between progress reports to the database
+    progress_interval = timedelta(seconds=1)
+
+    @property
+    def is_pending(self) -> bool:
+        return self.status in (REBUILD_JOB_STATUS.pending.value, REBUILD_JOB_STATUS.running.value)
+
+    @property
+    def eta(self) -> timedelta:
+        '''
+        An estimate of the time remaining (if one can be made, else None)
+        '''
+        Rating = apps.get_model(APP, "Rating")
+
+        if not self.is_pending:
+            return timedelta(0)
+
+        remaining = self.sessions_total - self.sessions_done
+        estimate = Rating.estimate_rebuild_cost(max(remaining, 1))
+
+        return estimate[0] if estimate else None
+
+    @property
+    def progress(self) -> dict:
+        '''
+        A JSONable summary of the progress of this job.
+        '''
+        eta = self.eta
+        return {'job': self.pk,
+                'status': REBUILD_JOB_STATUS.labels.value[self.status],
+                'pending': self.is_pending,
+                'sessions_done': self.sessions_done,
+                'sessions_total': self.sessions_total,
+                'eta': None if eta is None else eta.total_seconds(),
+                'rebuild_log': self.rebuild_log_id,
+                'error': self.error}
+
+    @classmethod
+    def enqueue(cls, sessions, reason=None, trigger=None, session=None, change_log=None):
+        '''
+        Queues a rebuild of the ratings for the nominated sessions and returns the RebuildJob.
+
+        If a job that affects any of the same games is still pending (not yet claimed by a worker)
+        the sessions join that job (the newest such) rather than queueing another. Rebuilds of a
+        game are performed in the order they are queued (see claim) and sessions added to a game
+        with a rebuild pending join that rebuild (see is_pending_for), so they are all rebuilt
+        together, after anything queued for those games before them.
+
+        :param sessions:   A list or QuerySet of Session objects
+        :param reason:     A string, to log as a reason for the rebuild
+        :param trigger:    A RATING_REBUILD_TRIGGER value
+        :param session:    A Session object if an edit (create or update) of a session triggered this rebuild
+        :param change_log: A ChangeLog to give the RebuildLog to when the rebuild is done
+        '''
+        games = {s.game_id for s in sessions}
+
+        with transaction.atomic():
+            # Locked, so that a worker cannot claim it while we add to it (claim skips locked jobs)
+            job = (cls.objects.select_for_update()
+                   .filter(status=REBUILD_JOB_STATUS.pending.value, games__in=games)
+                   .order_by('-pk').first())
+
+            if job:
+                job.reason = f"{job.reason}\n{reason}" if reason else job.reason
+                job.__bypass_admin__ = True
+                job.save()
+            else:
+                job = cls(reason=reason or "")
+
+                if not trigger is None:
+                    job.trigger = trigger.value
+                if not session is None:
+                    job.session = session
+
+                job.save()
+
+            job.sessions.add(*sessions)
+            job.games.add(*games)
+
+            job.sessions_total = job.sessions.count()
+            cls.objects.filter(pk=job.pk).update(sessions_total=job.sessions_total)
+
+            if change_log:
+                job.change_logs.add(change_log)
+
+        if settings.DEBUG:
+            log.debug(f"Queued a ratings rebuild of {len(sessions)} sessions (RebuildJob {job.pk}, {job.sessions_total} sessions in all).")
+
+        return job
+
+    @classmethod
+    def pending(cls):
+        '''
+        Returns a QuerySet of the jobs waiting on or undergoing a rebuild.
+        '''
+        return cls.objects.filter(status__in=(REBUILD_JOB_STATUS.pending.value, REBUILD_JOB_STATUS.running.value))
+
+    @classmethod
+    def pending_games(cls):
+        '''
+        Returns a QuerySet of the games whose ratings are waiting on a rebuild.
+        '''
+        Game = apps.get_model(APP, "Game")
+        return Game.objects.filter(rebuild_jobs__in=cls.pending()).distinct()
+
+    @classmethod
+    def is_pending_for(cls, game) -> bool:
+        '''
+        True if the ratings of a game are waiting on a rebuild. They are stale until it's done, and
+        a session added or edited in the meantime must join the queue (see enqueue) rather than
+        have its ratings updated from them.
+
+        :param game: A Game (or its pk)
+        '''
+        return cls.pending_games().filter(pk=getattr(game, 'pk', game)).exists()
+
+    @classmethod
+    def claim(cls):
+        '''
+        Claims the oldest pending job for a worker (marking it running) and returns it,
+        or None if there are no pending jobs. Safe with concurrent workers.
+
+        The rebuilds of a game are serialised: a job is only claimed if no older job that
+        affects any of the same games is pending or running.
+        '''
+        with transaction.atomic():
+            blocked = set()  # The games of older jobs that are pending or running
+
+            for candidate in cls.pending().order_by('pk').prefetch_related('games'):
+                games = {g.pk for g in candidate.games.all()}
+
+                if candidate.status == REBUILD_JOB_STATUS.pending.value and not games & blocked:
+                    # Another worker may be claiming it (or a request adding to it), if so it is locked
+                    job = (cls.objects.select_for_update(skip_locked=True)
+                           .filter(pk=candidate.pk, status=REBUILD_JOB_STATUS.pending.value)
+                           .first())
+
+                    if job:
+                        job.status = REBUILD_JOB_STATUS.running.value
+                        job.started = localtime()
+                        job.__bypass_admin__ = True
+                        job.save()
+                        return job
+
+                blocked |= games
+
+        return None
+
+    def report(self, done, total):
+        '''
+        A progress callback for Rating.rebuild. Records progress, but not too often.
+
+        :param done:  The number of sessions rebuilt so far
+        :param total: The number of sessions being rebuilt
+        '''
+        now = localtime()
+        last = getattr(self, "_last_report", None)
+        if done == total or last is None or now - last >= self.progress_interval:
+            self._last_report = now
+            self.sessions_done = done
+            self.sessions_total = total
+            RebuildJob.objects.filter(pk=self.pk).update(sessions_done=done, sessions_total=total)
+
+    def run(self, InMemory=False):
+        '''
+        Performs the rebuild. Intended for a worker that has claimed this job.
+
+        :param InMemory: If True use the in-memory replay engine (see Rating.rebuild)
+        '''
+        Rating = apps.get_model(APP, "Rating")
+
+        sessions = list(self.sessions.all())
+        self.__bypass_admin__ = True
+
+        try:
+            if sessions:
+                rlog = Rating.rebuild(Sessions=sessions,
+                                      Reason=self.reason,
+                                      Trigger=RATING_REBUILD_TRIGGER(self.trigger),
+                                      Session=self.session,
+                                      InMemory=InMemory,
+                                      Progress=self.report)
+
+                # The change logs recorded the impact of their change on ratings that were waiting on
+                # this rebuild, so now that it's done we record it again (and give them the rebuild log).
+                for change_log in self.change_logs.all():
+                    if change_log.session:
+                        change_log.update(rebuild_log=rlog)
+                    else:
+                        change_log.rebuild_log = rlog
+                    change_log.__bypass_admin__ = True
+                    change_log.save()
+
+                self.rebuild_log = rlog
+
+            self.status = REBUILD_JOB_STATUS.done.value
+        except Exception:
+            self.status = REBUILD_JOB_STATUS.failed.value
+            self.error = traceback.format_exc()
+            log.error(f"RebuildJob {self.pk} failed: {self.error}")
+
+        self.finished = localtime()
+        self.save()
+
+    def __unicode__(self):
+        return f"{REBUILD_JOB_STATUS.labels.value[self.status]} rebuild of {self.sessions_total} sessions: {self.reason}"
+
+    def __str__(self): return self.__unicode__()
+
+    class Meta(AdminModel.Meta):
+        verbose_name = "Rebuild Job"
+        verbose_name_plural = "Rebuild Jobs"
@@ -412,7 +412,7 @@ class Session(AdminModel, TimeZoneMixIn, NotesMixIn):
         A debugging property that prints python code that will replicate this trueskill calculation
         So that this specific trueksill calculation might be diagnosed and debugged in isolation.
         '''
-        TSS = TrueskillSettings()
+        TSS = TrueskillSettings.asat(self.date_time)
         OldRatingGroups, Weights, Ranking = self.build_trueskill_data()
 
         code = []
@@ -433,59 +433,6 @@ class Session(AdminModel, TimeZoneMixIn, NotesMixIn):
         code.append("</pre>")
         return "\n".join(code)
 
-    def _get_future_sessions(self, sessions_so_far):
-        '''
-        Internal support for the future_session property, this is a recursive method
-        that takes a list of sessions found so far so as to avoid duplicating any
-        sessions in the search.
-
-        Why recursion? Because future sessions is an influence tree where each
-        node branches a multiple of times. Consider agame that involves four
-        playes P1, P2, P3, P4. We can get all future session in this game that
-        any of these four players played in with a simple query. BUT in all
-        those sessions they maybe (probably) played with otehr people. So say
-        theres a futre session between P1, P2, P5 and P6? Well we need to find
-        all the future sessions in this game that involve P1, P2, P5 or P6! So
-        essentially future sessions fromt he simpe query can drag in new players
-        which form new influence trees.
-
-        The premise in building this tree is that it is is far more efficient than
-        reacuaulating Trueskill ratings on them all. Thus finding a count helps us
-        estimate the cost of performing a rebuild.
-
-        sessions_so_far: A list of sessions found so far, that is augmented and returned
-        '''
-        # We want session in the future only of course
-        dfilter = Q(date_time__gt=self.date_time)
-
-        # We want only sessions for this sessions game
-        gfilter = Q(game=self.game)
-
-        # For each player we find all future sessions playing this game
-        pfilter = Q(performances__player__in=self.players)
-
-        # Combine the filters
-        filters = dfilter & gfilter & pfilter
-
-        # Get the list of PKs to exclude
-        exclude_pks = list(map(lambda s: s.pk, sessions_so_far))
-
-        new_future_sessions = Session.objects.filter(filters).exclude(pk__in=exclude_pks).distinct().order_by('date_time')
-
-        if new_future_sessions.count() > 0:
-            # augment sessions_so far
-            sessions_so_far += list(new_future_sessions)
-
-            # The new future sessions may involve new players which
-            # requires that we scan them for new future sessions too
-            for session in new_future_sessions:
-                new_sessions_so_far = session._get_future_sessions(sessions_so_far)
-
-                if len(new_sessions_so_far) > len(sessions_so_far):
-                    sessions_so_far = sorted(new_sessions_so_far, key=lambda s: s.date_time)
-
-        return sessions_so_far
-
     @property
     def future_sessions(self) -> list:
         '''
@@ -495,7 +442,8 @@ class Session(AdminModel, TimeZoneMixIn, NotesMixIn):
         Namely every session that needs to be re-evaluated because this one has been inserted before
         it, or edited in some way.
         '''
-        return self._get_future_sessions([])
+        players = self.performances.values('player')
+        return self.game.future_sessions(self.date_time, players)
 
     @property
     def link_internal(self) -> str:
@@ -1236,26 +1184,22 @@ class Session(AdminModel, TimeZoneMixIn, NotesMixIn):
         Returns the previous session that the nominate player played this game in.
         Or None if no such session exists.
 
+        A single indexed fetch, using the adjacency index on Performance (see Performance.link).
+
         :param player: A Player object. Optional, returns the last session this game was played if not provided.
         '''
-        prev_sessions = self.previous_sessions(player)
-
-        if len(prev_sessions) < 2:
-            assert len(prev_sessions) == 1, f"Database error: Current session not in previous sessions list, session={self.pk}, player={player.pk}, {len(prev_sessions)=}."
-            assert prev_sessions[0] == self, f"Database error: Current session not in previous sessions list, session={self.pk}, player={player.pk}, {prev_sessions=}."
-            prev_session = None
-        else:
-            prev_session = prev_sessions[1]
-
-            if not prev_sessions[0].id == self.id: breakpoint()
+        if player:
+            performance = self.performances.filter(player=player).select_related('previous__session').first()
 
-            if not prev_session.date_time < self.date_time:
-                breakpoint()
+            if performance:
+                return performance.previous.session if performance.previous else None
 
-            assert prev_sessions[0].id == self.id, f"Query error: current session is not at start of previous sessions list for session={self.pk}, first previous session={prev_sessions[0].id}, player={player.pk}"
-            assert prev_session.date_time < self.date_time, f"Database error: Two sessions with identical time, session={self.pk}, previous session={prev_session.pk}, player={player.pk}"
+            # The player did not play this session (yet), so there's no index to consult.
+            sfilter = Q(performances__player=player)
+        else:
+            sfilter = Q()
 
-        return prev_session
+        return Session.objects.filter(sfilter & Q(game=self.game) & Q(date_time__lt=self.date_time)).order_by('-date_time').first()
 
     def following_sessions(self, player=None):
         '''
@@ -1283,20 +1227,24 @@ class Session(AdminModel, TimeZoneMixIn, NotesMixIn):
         Returns the following session that the nominate player played this game in.
         Or None if no such session exists.
 
+        A single indexed fetch, using the adjacency index on Performance (see Performance.link).
+
         :param player: A Player object. Optional, returns the last session this game was played if not provided.
         '''
-        foll_sessions = self.following_sessions(player)
+        Performance = apps.get_model(APP, "Performance")
+
+        if player:
+            following = Performance.objects.filter(previous__session=self, previous__player=player).select_related('session').first()
+
+            if following:
+                return following.session
 
-        if len(foll_sessions) < 2:
-            assert len(foll_sessions) == 1, f"Database error: Current session not in following sessions list, session={self.pk}, player={player.pk}, {len(foll_sessions)=}."
-            assert foll_sessions[0] == self, f"Database error: Current session not in following sessions list, session={self.pk}, player={player.pk}, {foll_sessions=}."
-            foll_session = None
+            # The player did not play this session (yet), or this is their last session.
+            sfilter = Q(performances__player=player)
         else:
-            foll_session = foll_sessions[1]
-            assert foll_sessions[0].date_time == self.date_time, f"Query error: current session not in following sessions list of following sessions for session={self.pk}, player={player.pk}"
-            assert foll_session.date_time > self.date_time, f"Database error: Two sessions with identical time, session={self.pk}, previous session={foll_session.pk}, player={player.pk}"
+            sfilter = Q()
 
-        return foll_session
+        return Session.objects.filter(sfilter & Q(game=self.game) & Q(date_time__gt=self.date_time)).order_by('date_time').first()
 
     @property
     def is_latest(self):
@@ -1323,9 +1271,7 @@ class Session(AdminModel, TimeZoneMixIn, NotesMixIn):
         '''
         True if this is the first session in this game (so it has no previous session).
         '''
-        first = Session.objects.filter(game=self.game).order_by('date_time').first()
-        is_first = self == first
-        return is_first
+        return not Session.objects.filter(game=self.game, date_time__lt=self.date_time).exists()
 
     def previous_victories(self, player):
         '''
@@ -1381,6 +1327,10 @@ class Session(AdminModel, TimeZoneMixIn, NotesMixIn):
         '''
         Returns the previous Performance object for the nominate player in the game of this session
         '''
+        performance = self.performances.filter(player=player).select_related('previous').first()
+        if performance:
+            return performance.previous
+
         prev_session = self.previous_session(player)
         return None if prev_session is None else prev_session.performance(player)
 
@@ -1388,13 +1338,18 @@ class Session(AdminModel, TimeZoneMixIn, NotesMixIn):
         '''
         Returns the last Performance object for the nominate player in the game of this session that was victory
         '''
-        # TODO: Test thoroughly. Tricky Query.
+        performance = self.performances.filter(player=player).select_related('latest_victory').first()
+        if performance:
+            return performance.latest_victory
+
+        # The player did not play this session (yet), so there's no index to consult.
         time_limit = self.date_time
 
         # Get the list of previous sessions including the current session! So the list must be at least length 1 (the current session).
         # The list is sorted in descening date_time order, so that the first entry is the current sessions.
         prev_victory = Session.objects.filter(Q(date_time__lte=time_limit) & Q(game=self.game) & Q(ranks__rank=1) & (Q(ranks__player=player) | Q(ranks__team__players=player))).order_by('-date_time')
-        return None if (prev_victory is None or prev_victory.count() == 0) else prev_victory[0].performance(player)
+        prev_victory = prev_victory.first()
+        return None if prev_victory is None else prev_victory.performance(player)
 
     def clean_ranks(self):
         '''
@@ -1539,7 +1494,7 @@ class Session(AdminModel, TimeZoneMixIn, NotesMixIn):
         Player = apps.get_model(APP, "Player")
         Performance = apps.get_model(APP, "Performance")
 
-        TSS = TrueskillSettings()
+        TSS = TrueskillSettings.asat(self.date_time)
         TS = trueskill.TrueSkill(mu=TSS.mu0, sigma=TSS.sigma0, beta=self.game.trueskill_beta, tau=self.game.trueskill_tau, draw_probability=self.game.trueskill_p)
 
         def RecordPerformance(rating_groups):
@@ -2241,7 +2196,7 @@ class Session(AdminModel, TimeZoneMixIn, NotesMixIn):
         for performance in self.performances.all():
             previous = self.previous_performance(performance.player)
             if previous is None:
-                TS = TrueskillSettings()
+                TS = TrueskillSettings.asat(self.date_time)
 
                 trueskill_eta = TS.mu0 - TS.mu0 / TS.sigma0 * TS.sigma0
 
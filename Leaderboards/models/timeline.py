@@ -0,0 +1,170 @@
+from . import APP
+
+from django.db import models
+from django.db.models import Q, F, Subquery, OuterRef
+from django.db.models.expressions import Window
+from django.db.models.functions import Lead
+from django.apps import apps
+from django.conf import settings
+
+from django_rich_views.html import NEVER
+from django_rich_views.datetime import safe_tz
+
+from timezone_field import TimeZoneField
+
+from Site.logutils import log
+
+
+class RatingTimeline(models.Model):
+    '''
+    The rating of a player at a game over time.
+
+    Every Performance sets a player's rating at a game, which then holds until their next play
+    of that game. A row here records one such interval, [valid_from, valid_to), with the rating
+    that held over it (valid_to is null for the current rating). A leaderboard as at any time is
+    then one indexed range query (see RatingTimeline.asat) rather than a search for the latest
+    performance of every player.
+
+    It is derived entirely from Performance and maintained alongside the ratings (see
+    RatingTimeline.record, which Rating.update and Rating.rebuild call).
+    '''
+    game = models.ForeignKey('Game', verbose_name='Game', related_name='rating_timeline', on_delete=models.CASCADE)  # If the game is deleted, so is its timeline
+    player = models.ForeignKey('Player', verbose_name='Player', related_name='rating_timeline', on_delete=models.CASCADE)  # If the player is deleted, so is their timeline
+    performance = models.OneToOneField('Performance', verbose_name='Performance', related_name='rating_timeline', on_delete=models.CASCADE)  # The performance that set this rating
+
+    valid_from = models.DateTimeField('Time this Rating was Set')
+    valid_from_tz = TimeZoneField('Time this Rating was Set, Timezone', default=settings.TIME_ZONE, editable=False)
+    valid_to = models.DateTimeField('Time this Rating was Superseded', null=True, blank=True)
+
+    trueskill_eta = models.FloatField('Trueskill Rating (η)')
+    trueskill_mu = models.FloatField('Trueskill Mean (µ)')
+    trueskill_sigma = models.FloatField('Trueskill Standard Deviation (σ)')
+
+    plays = models.PositiveIntegerField('Play Count')
+    victories = models.PositiveIntegerField('Victory Count')
+
+    @property
+    def last_play_local(self):
+        return self.valid_from.astimezone(safe_tz(self.valid_from_tz))
+
+    def as_rating(self):
+        '''
+        Returns an (unsaved) Rating object with this rating.
+        '''
+        Rating = apps.get_model(APP, "Rating")
+        performance = self.performance
+        last_victory = performance.latest_victory
+
+        return Rating(player=self.player,
+                      game=self.game,
+                      plays=self.plays,
+                      victories=self.victories,
+                      last_play=self.valid_from,
+                      last_play_tz=self.valid_from_tz,
+                      last_victory=last_victory.session.date_time if last_victory else NEVER,
+                      last_victory_tz=last_victory.session.date_time_tz if last_victory else settings.TIME_ZONE,
+                      trueskill_mu=self.trueskill_mu,
+                      trueskill_sigma=self.trueskill_sigma,
+                      trueskill_eta=self.trueskill_eta,
+                      trueskill_mu0=performance.trueskill_mu0,
+                      trueskill_sigma0=performance.trueskill_sigma0,
+                      trueskill_delta=performance.trueskill_delta,
+                      trueskill_beta=performance.trueskill_beta,
+                      trueskill_tau=performance.trueskill_tau,
+                      trueskill_p=performance.trueskill_p)
+
+    @classmethod
+    def asat(cls, game, asat, leagues=[], players=[]):
+        '''
+        Returns a QuerySet of the ratings at a game as at a given time, in leaderboard order.
+
+        :param game:    A Game object (or pk)
+        :param asat:    A datetime
+        :param leagues: Optionally, leagues (or pks) whose players to include. All players if none specified.
+        :param players: Optionally, players (or pks) to include. All players if none specified.
+        '''
+        timeline = cls.objects.filter(Q(game=game) & Q(valid_from__lte=asat) & (Q(valid_to__gt=asat) | Q(valid_to__isnull=True)))
+
+        if leagues:
+            timeline = timeline.filter(player__leagues__in=leagues).distinct()
+        if players:
+            timeline = timeline.filter(player__in=players)
+
+        return timeline.order_by('-trueskill_eta')
+
+    @classmethod
+    def record(cls, game, players=None, From=None) -> int:
+        '''
+        Brings the timeline of a game up to date with its Performances.
+
+        Returns the number of intervals recorded.
+
+        :param game:    A Game object (or pk)
+        :param players: Optionally, a list or QuerySet of Players (or pks) to record. All players if not provided.
+        :param From:    Optionally, a datetime. Only the performances from then on have changed.
+        '''
+        Performance = apps.get_model(APP, "Performance")
+
+        timeline = cls.objects.filter(game=game)
+        performances = Performance.objects.filter(session__game=game, player__isnull=False)
+
+        if players:
+            timeline = timeline.filter(player__in=players)
+            performances = performances.filter(player__in=players)
+
+        if From:
+            # The intervals that start before From are unchanged, but the last of them for
+            # each player may now end at a different time (or not at all), see below.
+            earlier = timeline.filter(valid_from__lt=From)
+            timeline = timeline.filter(valid_from__gte=From)
+            performances = performances.filter(session__date_time__gte=From)
+
+        timeline.delete()
+
+        # Each interval ends when the player next plays
+        performances = (performances.order_by()
+                        .select_related('session')
+                        .annotate(next_play=Window(expression=Lead('session__date_time'),
+                                                   partition_by=[F('player')],
+                                                   order_by=F('session__date_time').asc())))
+
+        intervals = [cls(game_id=getattr(game, 'pk', game),
+                         player_id=p.player_id,
+                         performance=p,
+                         valid_from=p.session.date_time,
+                         valid_from_tz=p.session.date_time_tz,
+                         valid_to=p.next_play,
+                         trueskill_eta=p.trueskill_eta_after,
+                         trueskill_mu=p.trueskill_mu_after,
+                         trueskill_sigma=p.trueskill_sigma_after,
+                         plays=p.play_number,
+                         victories=p.victory_count)
+                     for p in performances]
+
+        cls.objects.bulk_create(intervals, batch_size=500)
+
+        if From:
+            # Close the intervals that were open at From on the next interval (if any)
+            following = (cls.objects.filter(game=OuterRef('game'), player=OuterRef('player'), valid_from__gt=OuterRef('valid_from'))
+                         .order_by('valid_from')
+                         .values('valid_from')[:1])
+
+            earlier.filter(Q(valid_to__isnull=True) | Q(valid_to__gte=From)).update(valid_to=Subquery(following))
+
+        if settings.DEBUG:
+            log.debug(f"Recorded {len(intervals)} rating intervals for game {getattr(game, 'pk', game)} from {From}.")
+
+        return len(intervals)
+
+    def __unicode__(self): return f'{self.player} - {self.game} - {self.trueskill_eta:.1f} teeth from {self.valid_from} to {self.valid_to}'
+
+    def __str__(self): return self.__unicode__()
+
+    class Meta:
+        verbose_name = "Rating Timeline"
+        verbose_name_plural = "Rating Timelines"
+        ordering = ['game', 'player', 'valid_from']
+        indexes = [
+            models.Index(fields=['game', 'valid_from'], name='timeline_game_from'),
+            models.Index(fields=['game', 'player', 'valid_from'], name='timeline_game_player_from'),
+        ]
@@ -1,24 +1,214 @@
+from . import APP, FLOAT_TOLERANCE, RATING_REBUILD_TRIGGER
+
 import trueskill
 
-from django.db import models
+from django.db import models, transaction
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.timezone import localtime
+
+from bisect import bisect_right
+from math import isclose
+from time import time
+from datetime import timedelta
+
+from Site.logutils import log
+
 
 class TrueskillSettings(models.Model):
     '''
     The site wide TrueSkill settings to use (i.e. not Game).
+
+    Settings are versioned. Each version takes effect from a given time (or from the beginning
+    of time if it has none), and holds until the next version takes effect. A span of time under
+    one version is an era. Performances are rated with the settings of the era they fall in (see
+    TrueskillSettings.asat).
+
+    The eras are loaded once per process and cached (see TrueskillSettings.eras), as they
+    are needed for every performance rated. Each uwsgi worker has its own, so they are versioned
+    through the configured cache backend (as the PlayerDirectory is): saving or deleting a version
+    bumps the shared version, and any process that finds its eras at an older version reloads them.
+
+    TrueskillSettings() still provides an unsaved instance with the default settings (for field
+    defaults and for a database with no versions recorded).
     '''
-    # Changing these affects the entire ratings history. That is we change one of these settings, either:
-    #    a) All the ratings history needs to be recalculated to get a consistent ratings result based on the new settings
-    #    b) We keep the ratings history with the old values and move forward with the new
-    # Merits? Methods?
-    # Suggest we have a form for editing these with processing logic and don't let the admin site edit them, or create logic
-    # that can adapt to admin site edits - flagging the likelihood. Or perhaps we should make this not a one tuple table
-    # but store each version with a date. That in can of course then support staged ratings histories, so not a bad idea.
+    # Changing these affects the entire ratings history from the time the change takes effect.
+    # Saving a version re-rates all sessions from then on (see TrueskillSettings.save).
     mu0 = models.FloatField('TrueSkill Initial Mean (µ0)', default=trueskill.MU)
     sigma0 = models.FloatField('TrueSkill Initial Standard Deviation (σ0)', default=trueskill.SIGMA)
     delta = models.FloatField('TrueSkill Delta (δ)', default=trueskill.DELTA)
 
+    effective_from = models.DateTimeField('Time these settings take effect', null=True, blank=True)
+
     intrinsic_relations = None
 
+    # The process wide cache of eras, the shared version it was loaded at, and how long we trust it
+    # for before checking the shared version again (it's needed for every performance rated).
+    version_key = "trueskill_settings_version"
+    _eras = None
+    _eras_version = None
+    _eras_checked = None
+    eras_check_interval = timedelta(seconds=1)
+
+    @classmethod
+    def shared_version(cls) -> int:
+        '''
+        The version of the eras that all processes agree on.
+        '''
+        version = cache.get(cls.version_key)
+        if version is None:
+            # add() so that two processes starting up don't trample a bump
+            cache.add(cls.version_key, int(time() * 1000), timeout=None)
+            version = cache.get(cls.version_key)
+        return version
+
+    @classmethod
+    def eras(cls) -> list:
+        '''
+        Returns a list of (effective_from, settings) tuples in chronological order, loaded once
+        per process and cached. The first era always starts at None (the beginning of time) and
+        has the default settings if no version was recorded for it.
+        '''
+        now = localtime()
+        if cls._eras is not None and now - cls._eras_checked > cls.eras_check_interval:
+            cls._eras_checked = now
+            if cls.shared_version() != cls._eras_version:
+                cls._eras = None
+
+        if cls._eras is None:
+            version = cls.shared_version()
+            versions = list(cls.objects.order_by(models.F('effective_from').asc(nulls_first=True), 'pk'))
+
+            eras = []
+            for era in versions:
+                if eras and eras[-1][0] == era.effective_from:
+                    eras[-1] = (era.effective_from, era)  # The later pk of two at the same time wins
+                else:
+                    eras.append((era.effective_from, era))
+
+            if not eras or not eras[0][0] is None:
+                eras.insert(0, (None, cls()))
+
+            cls._eras = eras
+            cls._eras_version = version
+            cls._eras_checked = now
+
+            if settings.DEBUG:
+                log.debug(f"Loaded {len(eras)} TrueSkill settings eras.")
+
+        return cls._eras
+
+    @classmethod
+    def reload(cls):
+        '''
+        Discards the cached eras (they are reloaded when next needed), in this process now and in
+        all others once the change is committed (lest another process load the old versions again
+        after we bump the shared version).
+        '''
+        cls._eras = None
+        transaction.on_commit(cls.invalidate)
+
+    @classmethod
+    def invalidate(cls):
+        '''
+        Bumps the shared version of the eras, so that all processes reload them.
+        '''
+        cls._eras = None
+        try:
+            cache.incr(cls.version_key)
+        except ValueError:
+            # The version isn't in the cache (yet, or any more)
+            cache.set(cls.version_key, int(time() * 1000), timeout=None)
+
+    @classmethod
+    def asat(cls, date_time=None) -> 'TrueskillSettings':
+        '''
+        Returns the settings in effect at a given time (or now if none is given).
+
+        :param date_time: A datetime
+        '''
+        eras = cls.eras()
+
+        if date_time is None:
+            return eras[-1][1]
+
+        # eras[0] starts at None, search the remaining start times
+        starts = [e[0] for e in eras[1:]]
+        return eras[bisect_right(starts, date_time)][1]
+
+    @classmethod
+    def current(cls) -> 'TrueskillSettings':
+        '''
+        Returns the settings in effect now.
+        '''
+        return cls.asat()
+
+    def same_as(self, other) -> bool:
+        '''
+        True if these settings are the same as another version's (within tolerance).
+
+        :param other: A TrueskillSettings instance
+        '''
+        return (isclose(self.mu0, other.mu0, abs_tol=FLOAT_TOLERANCE)
+            and isclose(self.sigma0, other.sigma0, abs_tol=FLOAT_TOLERANCE)
+            and isclose(self.delta, other.delta, abs_tol=FLOAT_TOLERANCE))
+
+    @classmethod
+    def rerate(cls, From=None, Reason=None):
+        '''
+        Re-rates all the sessions from a given time (all sessions if None) with the in-memory
+        replay engine, or queues that for a rebuild worker. Performances are rated with the
+        settings of their era.
+
+        :param From:   A datetime
+        :param Reason: A string, to log as a reason for the rebuild
+        '''
+        Session = apps.get_model(APP, "Session")
+        Rating = apps.get_model(APP, "Rating")
+        RebuildJob = apps.get_model(APP, "RebuildJob")
+
+        if settings.USE_REBUILD_QUEUE:
+            sessions = Session.objects.filter(date_time__gte=From) if From else Session.objects.all()
+            RebuildJob.enqueue(list(sessions.order_by('date_time')), Reason, RATING_REBUILD_TRIGGER.settings_change)
+        else:
+            Rating.rebuild(From=From, Reason=Reason, Trigger=RATING_REBUILD_TRIGGER.settings_change, InMemory=True)
+
+    def save(self, *args, **kwargs):
+        '''
+        Saves this version, and re-rates the sessions it affects if it changes the settings in effect.
+        '''
+        old = TrueskillSettings.objects.filter(pk=self.pk).first() if self.pk else None
+
+        if old:
+            # An edit affects sessions from the earlier of the old and new effective times
+            changed = not self.same_as(old) or not self.effective_from == old.effective_from
+            From = None if old.effective_from is None or self.effective_from is None else min(old.effective_from, self.effective_from)
+        else:
+            # A version from the beginning of time replaces the first era (asat(None) is the latest)
+            in_effect = TrueskillSettings.eras()[0][1] if self.effective_from is None else TrueskillSettings.asat(self.effective_from)
+            changed = not self.same_as(in_effect)
+            From = self.effective_from
+
+        super().save(*args, **kwargs)
+        TrueskillSettings.reload()
+
+        if changed:
+            TrueskillSettings.rerate(From, f"TrueSkill settings changed to {self} from {self.effective_from or 'the beginning'}.")
+
+    def delete(self, *args, **kwargs):
+        '''
+        Deletes this version, and re-rates the sessions it affected.
+        '''
+        From = self.effective_from
+
+        result = super().delete(*args, **kwargs)
+        TrueskillSettings.reload()
+
+        TrueskillSettings.rerate(From, f"TrueSkill settings version ({self}) from {From or 'the beginning'} was deleted.")
+
+        return result
+
     def __unicode__(self): return u'µ0={} σ0={} δ={}'.format(self.mu0, self.sigma0, self.delta)
 
     def __str__(self): return self.__unicode__()
@@ -28,6 +28,51 @@ function leaderboard_metrics(LB, show_baseline) {
 	return [boardcount, maxshots, totalshots, boardshots];
 }
 
+// A reader for leaderboards streamed by the server (json/leaderboards?stream). The response is
+// one JSON document, [title, subtitle, options, [leaderboard, ...], next cursor], delivered a line
+// at a time: the [title, subtitle, options, [ prefix first, then one leaderboard per line (after
+// the first each led by a comma) and finally the closing ], next cursor]. Fed the response text
+// as it arrives, the reader parses each line once it is complete.
+class Leaderboard_Stream {
+	constructor() {
+		this.consumed = 0;		// The length of the response text consumed so far
+		this.header = null;		// [title, subtitle, options] once the first line has arrived
+		this.leaderboards = [];	// The leaderboards received so far
+		this.next_cursor = null;// The cursor of the next page of leaderboards (null if none)
+		this.complete = false;	// True once the closing ], next cursor] has arrived
+	}
+
+	// Reads the response text received so far, and returns the number of new leaderboards in it
+	read(text) {
+		let added = 0;
+		let end;
+
+		while (!this.complete && (end = text.indexOf("\n", this.consumed)) >= 0) {
+			const line = text.slice(this.consumed, end);
+			this.consumed = end + 1;
+
+			if (this.header === null)
+				this.header = JSON.parse(line + "]]").slice(0, 3);
+			else {
+				this.leaderboards.push(JSON.parse(line.replace(/^,/, "")));
+				added++;
+			}
+		}
+
+		const tail = text.slice(this.consumed);
+		if (!this.complete && this.header !== null && tail.startsWith("]")) {
+			try {
+				this.next_cursor = JSON.parse("[[]" + tail.slice(1))[1];
+				this.complete = true;
+			} catch (e) {
+				// The closing line has not all arrived yet
+			}
+		}
+
+		return added;
+	}
+}
+
 function toString(v) {
     if(v == null || v == undefined) {
         return "";
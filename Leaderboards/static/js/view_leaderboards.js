@@ -816,7 +816,25 @@ function enable_submissions(yes_or_no) {
 }
 
 function got_new_leaderboards() {
-	if (REQUEST.readyState === 4 && REQUEST.status === 200){
+	// Leaderboards are streamed, and we draw them as they arrive (a frame at a time)
+	if (REQUEST.readyState === 3 && REQUEST.status === 200) {
+		if (leaderboard_stream.read(REQUEST.responseText) > 0) {
+			$('#title').html(leaderboard_stream.header[0]);
+			$('#subtitle').html(leaderboard_stream.header[1]);
+			options = leaderboard_stream.header[2];
+			leaderboards = leaderboard_stream.leaderboards;
+
+			if (!redraw_pending) {
+				redraw_pending = true;
+				requestAnimationFrame(() => {
+					redraw_pending = false;
+					get_and_report_metrics(leaderboards, options.show_baseline);
+					DrawTables("tblLB");
+				});
+			}
+		}
+	}
+	else if (REQUEST.readyState === 4 && REQUEST.status === 200){
 		// Let everyone know we're not waiting any more
 		const url = new URL(REQUEST.responseURL);
 		const chop = new RegExp("^"+RegExp.escape(url.origin));
@@ -827,14 +845,19 @@ function got_new_leaderboards() {
 			delete waiting_for["leaderboards"]; // If the set is empty remove the entry in the dict
 		}
 
-		// the request is complete, parse data
-		const response = JSON.parse(REQUEST.responseText);
+		// the request is complete, parse data (unless it was all streamed already, the
+		// server does not stream every request, and a cached response arrives at once)
+		leaderboard_stream.read(REQUEST.responseText);
+		const response = leaderboard_stream.complete
+					   ? [...leaderboard_stream.header, leaderboard_stream.leaderboards, leaderboard_stream.next_cursor]
+					   : JSON.parse(REQUEST.responseText);
 
 		// Capture response in leaderboards
 		$('#title').html(response[0]);
 		$('#subtitle').html(response[1]);
 		options =  response[2]
 		leaderboards = response[3];
+		next_cursor = response[4];
 
 		// Set some globals to support senible layout and renderig
 		get_and_report_metrics(leaderboards, options.show_baseline);
@@ -851,19 +874,73 @@ function got_new_leaderboards() {
 
 		// Enable form elements again
 		enable_submissions(true);
+
+		// And if the first page doesn't fill the screen, fetch the next
+		fetch_next_page_if_needed();
 	}
 };
 
+// The leaderboards are paged (see ajax_Leaderboards), the first page arriving with the view or
+// a refetch and the next fetched as the user scrolls near the end of the page.
+const PAGE_REQUEST = new XMLHttpRequest();
+PAGE_REQUEST.onreadystatechange = got_next_page;
+
+// The URL options the current leaderboards were fetched with (all their pages must be too)
+let leaderboard_urlopts = null;
+
+function got_next_page() {
+	if (PAGE_REQUEST.readyState === 4 && PAGE_REQUEST.status === 200) {
+		const response = JSON.parse(PAGE_REQUEST.responseText);
+
+		// Offset cursors can repeat a game if the order changed since the last page
+		const have = new Set(leaderboards.map(game => game[0]));
+		leaderboards = leaderboards.concat(response[3].filter(game => !have.has(game[0])));
+		next_cursor = response[4];
+
+		get_and_report_metrics(leaderboards, options.show_baseline);
+		DrawTables("tblLB");
+
+		fetch_next_page_if_needed();
+	}
+}
+
+async function fetch_next_page_if_needed() {
+	const margin = window.innerHeight; // Fetch when within a screen of the end
+	const near_end = window.innerHeight + window.scrollY >= document.body.offsetHeight - margin;
+
+	if (next_cursor === null || !near_end || PAGE_REQUEST.readyState === 1 || "leaderboards" in waiting_for) return;
+
+	if (leaderboard_urlopts === null) leaderboard_urlopts = await URLopts();
+
+	// The page (or a refetch) may have arrived while we awaited the URL options
+	if (next_cursor === null || PAGE_REQUEST.readyState === 1 || "leaderboards" in waiting_for) return;
+
+	const url = url_json_leaderboards + leaderboard_urlopts + (leaderboard_urlopts.length > 1 ? "&" : "") + "cursor=" + next_cursor;
+
+	PAGE_REQUEST.open("GET", url, true);
+	PAGE_REQUEST.send(null);
+}
+
+window.addEventListener("scroll", fetch_next_page_if_needed);
+
 const REQUEST = new XMLHttpRequest();
 REQUEST.onreadystatechange = got_new_leaderboards;
 
+// The reader of the leaderboards being streamed and whether a progressive redraw is scheduled
+let leaderboard_stream = new Leaderboard_Stream();
+let redraw_pending = false;
+
 async function refetchLeaderboards(reload_icon, make_static) {
 	if (typeof reload_icon === "undefined" || reload_icon == null) reload_icon = 'reloading_icon';
 	if (typeof make_static === "undefined") make_static = false;
 
 	URLopts(make_static).then( (urlopts) => {
-		// Build the URL to fetch (AJAX)
-		const url = url_json_leaderboards + urlopts;
+		// Build the URL to fetch (AJAX), asking for the first page of leaderboards to be streamed
+		const url = url_json_leaderboards + urlopts + (urlopts.length > 1 ? "&" : "") + "cursor=0&stream";
+
+		// Any page of the leaderboards we're replacing is no longer wanted
+		PAGE_REQUEST.abort();
+		leaderboard_urlopts = urlopts;
 
 		// Display the reloading icon requeste
 		$("#"+reload_icon).css("visibility", "visible");
@@ -876,6 +953,7 @@ async function refetchLeaderboards(reload_icon, make_static) {
 		waiting_for["leaderboards"] = new Set([...waiting_for["leaderboards"], url]);
 
 		// Send the request
+		leaderboard_stream = new Leaderboard_Stream();
 		REQUEST.open("GET", url, true);
 		REQUEST.send(null);
 	} );
@@ -1100,3 +1178,6 @@ InitControls(options);
 // ===================================================================================
 
 DrawTables("tblLB");
+
+// And fetch the next page if the first doesn't fill the screen
+fetch_next_page_if_needed();
@@ -0,0 +1,532 @@
+'''
+TrueSkill Replay
+
+An in-memory replay engine for rating rebuilds.
+
+Rating.rebuild traditionally walks sessions one at a time, and each session update
+(Rating.update -> Session.calculate_trueskill_impacts -> Session.build_trueskill_data
+-> Performance.initialise -> Session.previous_performance) runs its own queries. On a
+large database that amounts to many minutes of query traffic.
+
+The replay engine here instead:
+
+1) bulk loads every Session, Rank, Performance and Team membership for the affected games
+2) replays the TrueSkill calculations in memory, in chronological order, reproducing what
+   Performance.initialise and Session.calculate_trueskill_impacts would have recorded
+3) writes the results back with bulk_update (Performance) and bulk_update/bulk_create (Rating)
+
+The results are identical to the per-session path, the Performance records and Ratings it
+writes are the same ones that path would write, only the traffic to the database differs.
+
+Sessions in the affected games that are not being rebuilt are still walked (they provide
+the previous performance of players), but their Performance records are read, not written.
+
+TrueSkillWhatIf builds on the replay to evaluate the impact of a proposed session (one not
+yet saved) entirely in memory, so that it can be reviewed before anything is saved.
+'''
+from .models import APP, FLOAT_TOLERANCE, MISSING_VALUE, MIN_TIME_DELTA, TrueskillSettings
+from .leaderboards.enums import LB_PLAYER_LIST_STYLE, LB_STRUCTURE
+from .leaderboards.style import styled_player_list
+from .leaderboards.player import player_ratings, player_rankings
+
+from django.apps import apps
+from django.conf import settings
+
+from django_rich_views.html import NEVER
+
+from collections import defaultdict
+from math import isclose
+
+import trueskill
+
+from Site.logutils import log
+
+# The number of rows per UPDATE statement that bulk_update generates.
+BULK_BATCH_SIZE = 500
+
+
+class TrueSkillReplay:
+    '''
+    Replays the TrueSkill rating of a list of sessions in memory.
+
+    Usage:
+        replay = TrueSkillReplay(sessions)
+        replay.run()
+        replay.save()
+
+    After run() replay.performances holds the (updated) Performance objects of the sessions
+    being rebuilt and replay.ratings the (updated) Rating objects of every player/game pair
+    they touch. Nothing is written to the database until save() is called.
+    '''
+    # The Performance fields that a replay (re)calculates.
+    performance_fields = ['play_number', 'victory_count',
+                          'trueskill_mu_before', 'trueskill_sigma_before', 'trueskill_eta_before',
+                          'trueskill_mu_after', 'trueskill_sigma_after', 'trueskill_eta_after',
+                          'trueskill_mu0', 'trueskill_sigma0', 'trueskill_delta',
+                          'trueskill_beta', 'trueskill_tau', 'trueskill_p']
+
+    # The Rating fields that a replay (re)calculates.
+    rating_fields = ['plays', 'victories', 'last_play', 'last_victory',
+                     'trueskill_mu', 'trueskill_sigma', 'trueskill_eta',
+                     'trueskill_mu0', 'trueskill_sigma0', 'trueskill_delta',
+                     'trueskill_beta', 'trueskill_tau', 'trueskill_p']
+
+    def __init__(self, sessions, trueskill_settings=None):
+        '''
+        :param sessions: A list or QuerySet of Session objects to rebuild the ratings for.
+        :param trueskill_settings: Optionally a TrueskillSettings instance to replay with (defaults to those of each session's era)
+        '''
+        self.sessions = sorted(sessions, key=lambda s: s.date_time)
+        self.session_pks = {s.pk for s in self.sessions}
+        self.game_pks = {s.game_id for s in self.sessions}
+        self.TSS = trueskill_settings
+
+        self.loaded = False
+
+        self.games = {}  # Game objects keyed on pk
+        self.history = []  # Every session in the affected games in chronological order
+        self.session_performances = defaultdict(list)  # Performance objects keyed on session pk
+        self.session_ranks = defaultdict(list)  # Rank objects keyed on session pk, in rank order
+        self.team_players = defaultdict(list)  # Player pks keyed on team pk, in Team.players order
+
+        self.performances = []  # The performances that the replay recalculates
+        self.ratings = {}  # Rating objects keyed on (player pk, game pk) that the replay updates
+        self.new_ratings = set()  # Keys into self.ratings for ratings not yet in the database
+
+    def load(self):
+        '''
+        Bulk loads everything the replay needs. A fixed handful of queries regardless of the
+        number of sessions being rebuilt.
+        '''
+        Game = apps.get_model(APP, "Game")
+        Session = apps.get_model(APP, "Session")
+        Rank = apps.get_model(APP, "Rank")
+        Performance = apps.get_model(APP, "Performance")
+        Team = apps.get_model(APP, "Team")
+        Player = apps.get_model(APP, "Player")
+        Rating = apps.get_model(APP, "Rating")
+
+        self.games = Game.objects.in_bulk(self.game_pks)
+
+        self.history = list(Session.objects.filter(game__in=self.game_pks).order_by('date_time', 'pk'))
+        sessions = {s.pk: s for s in self.history}
+
+        for performance in Performance.objects.filter(session__game__in=self.game_pks):
+            # Attach the session we already have to spare a query on every performance.session
+            performance.session = sessions[performance.session_id]
+            self.session_performances[performance.session_id].append(performance)
+
+        # Note: order_by session_id not session, as the latter orders by Session.Meta.ordering
+        team_pks = set()
+        for rank in Rank.objects.filter(session__game__in=self.game_pks).order_by('session_id', 'rank', 'pk'):
+            self.session_ranks[rank.session_id].append(rank)
+            if rank.team_id:
+                team_pks.add(rank.team_id)
+
+        # Team.players.all() is ordered by Player.Meta.ordering, we respect that order here
+        # so that rating groups are presented to TrueSkill exactly as Session.build_trueskill_data does.
+        members = Team.players.through.objects.filter(team_id__in=team_pks).order_by('player__name_nickname', 'player_id')
+        for team_pk, player_pk in members.values_list('team_id', 'player_id'):
+            self.team_players[team_pk].append(player_pk)
+
+        # The player/game pairs whose ratings this replay touches
+        rating_keys = {(p.player_id, s.game_id) for s in self.sessions for p in self.session_performances[s.pk]}
+
+        self.ratings = {}
+        for rating in Rating.objects.filter(game__in=self.game_pks):
+            key = (rating.player_id, rating.game_id)
+            if key in rating_keys:
+                self.ratings[key] = rating
+
+        missing = rating_keys - set(self.ratings)
+        if missing:
+            players = Player.objects.in_bulk({k[0] for k in missing})
+            for key in missing:
+                self.ratings[key] = Rating.create(players[key[0]], self.games[key[1]])
+        self.new_ratings = missing
+
+        self.loaded = True
+
+        if settings.DEBUG:
+            log.debug(f"Replay loaded {len(self.history)} sessions in {len(self.games)} games, {len(self.sessions)} to rebuild, affecting {len(self.ratings)} ratings.")
+
+    def rankers(self, session):
+        '''
+        Returns a list of (rank, [player pks]) tuples for a session in rank order, drawn from
+        the bulk loaded data. For individual play there is one player in each list.
+
+        :param session: A Session object (from self.history)
+        '''
+        rankers = []
+        for rank in self.session_ranks[session.pk]:
+            if session.team_play:
+                rankers.append((rank.rank, self.team_players[rank.team_id]))
+            else:
+                rankers.append((rank.rank, [rank.player_id]))
+        return rankers
+
+    def trueskill_settings(self, session):
+        '''
+        The TrueSkill settings to rate a session with, those of its era unless the replay was
+        given settings to use.
+
+        :param session: A Session object
+        '''
+        return self.TSS if self.TSS else TrueskillSettings.asat(session.date_time)
+
+    def initialise(self, performance, previous, victory, game):
+        '''
+        The in-memory equivalent of Performance.initialise().
+
+        :param performance: The Performance object to initialise
+        :param previous: The previous Performance object of this player at this game or None
+        :param victory: True if this performance was a victory
+        :param game: The Game object the performance is at
+        '''
+        TSS = self.trueskill_settings(performance.session)
+
+        if previous is None:
+            performance.play_number = 1
+            performance.victory_count = 1 if victory else 0
+            performance.trueskill_mu_before = TSS.mu0
+            performance.trueskill_sigma_before = TSS.sigma0
+            performance.trueskill_eta_before = 0
+        else:
+            performance.play_number = previous.play_number + 1
+            performance.victory_count = previous.victory_count + 1 if victory else previous.victory_count
+            performance.trueskill_mu_before = previous.trueskill_mu_after
+            performance.trueskill_sigma_before = previous.trueskill_sigma_after
+            performance.trueskill_eta_before = previous.trueskill_eta_after
+
+            # Crossing into a new settings era, eta (a function of µ0 and σ0) is rated anew.
+            if not TSS.same_as(previous.trueskill_settings):
+                performance.trueskill_eta_before = performance.trueskill_mu_before - TSS.mu0 / TSS.sigma0 * performance.trueskill_sigma_before
+
+        performance.trueskill_mu0 = TSS.mu0
+        performance.trueskill_sigma0 = TSS.sigma0
+        performance.trueskill_delta = TSS.delta
+        performance.trueskill_beta = game.trueskill_beta
+        performance.trueskill_tau = game.trueskill_tau
+        performance.trueskill_p = game.trueskill_p
+
+    def rate(self, session, previous):
+        '''
+        The in-memory equivalent of Session.calculate_trueskill_impacts().
+
+        :param session: A Session object (from self.history)
+        :param previous: A dict keyed on (player pk, game pk) of the latest Performance so far.
+        '''
+        TSS = self.trueskill_settings(session)
+        game = self.games[session.game_id]
+        performances = {p.player_id: p for p in self.session_performances[session.pk]}
+
+        TS = trueskill.TrueSkill(mu=TSS.mu0, sigma=TSS.sigma0, beta=game.trueskill_beta, tau=game.trueskill_tau, draw_probability=game.trueskill_p)
+
+        # See Session.build_trueskill_data for a description of these structures.
+        RGs = []
+        Weights = {}
+        Ranking = []
+        for rank, players in self.rankers(session):
+            RG = {}
+            for pk in players:
+                performance = performances[pk]
+                self.initialise(performance, previous.get((pk, game.pk), None), rank == 1, game)
+                RG[pk] = trueskill.Rating(mu=performance.trueskill_mu_before, sigma=performance.trueskill_sigma_before)
+                Weights[(len(RGs), pk)] = performance.partial_play_weighting
+            RGs.append(RG)
+            Ranking.append(rank)
+
+        NewRGs = TS.rate(RGs, Ranking, Weights, TSS.delta)
+
+        for t in NewRGs:
+            for pk in t:
+                performance = performances[pk]
+
+                mu = t[pk].mu
+                sigma = t[pk].sigma
+
+                performance.trueskill_mu_after = mu
+                performance.trueskill_sigma_after = sigma
+                performance.trueskill_eta_after = mu - TSS.mu0 / TSS.sigma0 * sigma  # µ − (µ0 ÷ σ0) × σ
+
+                # The same integrity check that Session.calculate_trueskill_impacts performs
+                previous_trueskill_eta_before = performance.trueskill_eta_before
+                performance.trueskill_eta_before = performance.trueskill_mu_before - TSS.mu0 / TSS.sigma0 * performance.trueskill_sigma_before
+                assert isclose(performance.trueskill_eta_before, previous_trueskill_eta_before, abs_tol=FLOAT_TOLERANCE), "Integrity error: suspiscious change in a TrueSkill rating."
+
+                self.performances.append(performance)
+
+    def run(self, progress=None):
+        '''
+        Replays all the sessions in the affected games in chronological order, recalculating
+        the Performances of those being rebuilt and the Ratings they touch.
+
+        :param progress: Optionally a callable that receives (sessions done, sessions total) as sessions are replayed
+        '''
+        if not self.loaded:
+            self.load()
+
+        previous = {}  # Latest Performance keyed on (player pk, game pk)
+        last_victory = {}  # Time of latest victory keyed on (player pk, game pk)
+
+        self.performances = []
+        done = 0
+        total = len(self.session_pks)
+        for session in self.history:
+            if session.pk in self.session_pks:
+                self.rate(session, previous)
+
+                done += 1
+                if progress:
+                    progress(done, total)
+
+            victors = {pk for rank, players in self.rankers(session) if rank == 1 for pk in players}
+            for performance in self.session_performances[session.pk]:
+                key = (performance.player_id, session.game_id)
+                previous[key] = performance
+                if performance.player_id in victors:
+                    last_victory[key] = session.date_time
+
+        # Bring the ratings up to date (the in-memory equivalent of Rating.reset())
+        for key, rating in self.ratings.items():
+            performance = previous.get(key, None)
+
+            # Only a what-if can remove a player's only play (see TrueSkillWhatIf)
+            if performance is None:
+                continue
+
+            rating.plays = performance.play_number
+            rating.victories = performance.victory_count
+
+            rating.last_play = performance.session.date_time
+            rating.last_victory = last_victory.get(key, NEVER)
+
+            rating.trueskill_mu = performance.trueskill_mu_after
+            rating.trueskill_sigma = performance.trueskill_sigma_after
+            rating.trueskill_eta = performance.trueskill_eta_after
+
+            rating.trueskill_mu0 = performance.trueskill_mu0
+            rating.trueskill_sigma0 = performance.trueskill_sigma0
+            rating.trueskill_beta = performance.trueskill_beta
+            rating.trueskill_delta = performance.trueskill_delta
+
+            rating.trueskill_tau = performance.trueskill_tau
+            rating.trueskill_p = performance.trueskill_p
+
+        if settings.DEBUG:
+            log.debug(f"Replay recalculated {len(self.performances)} performances.")
+
+    def save(self, ratings=True):
+        '''
+        Writes the replayed Performances and Ratings back to the database in bulk.
+
+        Admin fields are not updated (as with a rebuild which bypasses them).
+
+        :param ratings: If False, only the Performances are written (see Rating.rebuild with a Checkpoint)
+        '''
+        Performance = apps.get_model(APP, "Performance")
+        Rating = apps.get_model(APP, "Rating")
+
+        Performance.objects.bulk_update(self.performances, self.performance_fields, batch_size=BULK_BATCH_SIZE)
+
+        if not ratings:
+            if settings.DEBUG:
+                log.debug(f"Replay saved {len(self.performances)} performances.")
+            return
+
+        existing = [r for k, r in self.ratings.items() if not k in self.new_ratings]
+        created = [r for k, r in self.ratings.items() if k in self.new_ratings]
+
+        Rating.objects.bulk_update(existing, self.rating_fields, batch_size=BULK_BATCH_SIZE)
+        Rating.objects.bulk_create(created, batch_size=BULK_BATCH_SIZE)
+
+        if settings.DEBUG:
+            log.debug(f"Replay saved {len(self.performances)} performances and {len(self.ratings)} ratings ({len(created)} new).")
+
+
+class TrueSkillWhatIf(TrueSkillReplay):
+    '''
+    A "what-if" evaluator. Replays the TrueSkill ratings of a proposed session (a session dict
+    as produced by Session.dict_from_form) and of the influence tree it would have, in memory,
+    without writing anything to the database (and so without holding a transaction open).
+
+    Usage:
+        whatif = TrueSkillWhatIf(Session.dict_from_form(request.POST, pk))
+        impact = whatif.impact()
+
+    The proposed session replaces the session it edits (if its dict has an id) or is added
+    (if not). Every session of the affected games is walked, and those in the future of the
+    proposed session (and of the session it edits) are re-rated.
+    '''
+    # A pk for a proposed session that has none yet (it is never saved).
+    proposed_pk = 0
+
+    def __init__(self, session_dict, trueskill_settings=None):
+        '''
+        :param session_dict: A session dict as produced by Session.dict_from_form
+        :param trueskill_settings: Optionally a TrueskillSettings instance to replay with (defaults to those of each session's era)
+        '''
+        Session = apps.get_model(APP, "Session")
+        Game = apps.get_model(APP, "Game")
+
+        self.session_dict = session_dict
+
+        pk = session_dict.get("id", MISSING_VALUE)
+        self.edited = None if pk in (None, MISSING_VALUE) else Session.objects.get(pk=pk)
+
+        game = Game.objects.get(pk=session_dict["game"])
+        time = session_dict["time"]
+        players = [p for p in session_dict["performers"] if not p in (None, MISSING_VALUE)]
+
+        # The proposed session. Never saved, just a vessel for the replay.
+        self.proposed = Session(pk=self.proposed_pk if self.edited is None else self.edited.pk,
+                                game=game,
+                                date_time=time,
+                                team_play=session_dict["team_play"])
+
+        if self.edited:
+            self.proposed.date_time_tz = self.edited.date_time_tz
+
+        # The sessions whose ratings the proposed session would change
+        sessions = {s.pk: s for s in game.future_sessions(time, players)}
+        if self.edited:
+            for s in self.edited.future_sessions:
+                sessions[s.pk] = s
+            sessions.pop(self.edited.pk, None)
+
+        super().__init__([self.proposed] + list(sessions.values()), trueskill_settings)
+
+        # If the edit moves the session to another game, both games are affected
+        if self.edited:
+            self.game_pks.add(self.edited.game_id)
+
+    def load(self):
+        '''
+        Bulk loads everything the replay needs (see TrueSkillReplay.load) and splices the
+        proposed session into the loaded history in place of any session it edits.
+        '''
+        Performance = apps.get_model(APP, "Performance")
+        Rank = apps.get_model(APP, "Rank")
+
+        super().load()
+
+        # Capture the current state of the affected boards before splicing.
+        self.boards_before = {pk: self.board(pk) for pk in self.game_pks}
+
+        proposed = self.proposed
+        session_dict = self.session_dict
+
+        # Splice the proposed session into the history (in place of the edited one)
+        self.history = sorted([s for s in self.history if not s.pk == proposed.pk] + [proposed],
+                              key=lambda s: s.date_time)
+
+        # Build the proposed Performances and Ranks (unsaved)
+        self.session_performances[proposed.pk] = [Performance(session=proposed, player_id=player, partial_play_weighting=weight)
+                                                  for player, weight in zip(session_dict["performers"], session_dict["weights"])
+                                                  if not player in (None, MISSING_VALUE)]
+
+        ranks = []
+        for i, (ranking, rankers) in enumerate(zip(session_dict["rankings"], session_dict["rankers"])):
+            if proposed.team_play:
+                # Proposed teams may not exist yet, so we give them a pk that no real team has.
+                team = -(i + 1)
+                self.team_players[team] = sorted(rankers, key=lambda pk: self.player_order.get(pk, pk))
+                ranks.append(Rank(session=proposed, rank=ranking, team_id=team))
+            else:
+                ranks.append(Rank(session=proposed, rank=ranking, player_id=rankers))
+
+        self.session_ranks[proposed.pk] = ranks
+
+    @property
+    def player_order(self) -> dict:
+        '''
+        A dict keyed on player pk of their position in Player.Meta.ordering (so that proposed
+        teams are presented to TrueSkill as Session.build_trueskill_data would present them).
+        '''
+        Player = apps.get_model(APP, "Player")
+
+        if not hasattr(self, "_player_order"):
+            players = {pk for rankers in self.session_dict["rankers"] for pk in (rankers if isinstance(rankers, list) else [rankers])}
+            self._player_order = {pk: i for i, pk in enumerate(Player.objects.filter(pk__in=players).values_list('pk', flat=True))}
+
+        return self._player_order
+
+    def board(self, game, asat=None, style=LB_PLAYER_LIST_STYLE.data) -> tuple:
+        '''
+        Returns the leaderboard of a game from the replay's state (as loaded or as replayed)
+        as a LB_STRUCTURE.player_list, as at a given time (or latest).
+
+        :param game: A Game pk
+        :param asat: Optionally, a datetime. The board includes sessions up to and including then.
+        :param style: The LB_PLAYER_LIST_STYLE to return
+        '''
+        latest = {}
+        for session in self.history:
+            if session.game_id == game and (asat is None or session.date_time <= asat):
+                for performance in self.session_performances[session.pk]:
+                    latest[performance.player_id] = performance
+
+        lb = [(pk,
+               p.trueskill_eta_after,
+               p.trueskill_mu_after,
+               p.trueskill_sigma_after,
+               p.play_number,
+               p.victory_count,
+               p.session.date_time_local) for pk, p in latest.items()]
+
+        lb.sort(key=lambda t: t[1], reverse=True)
+
+        return None if len(lb) == 0 else styled_player_list(lb, style=style)
+
+    def impact(self, style=LB_PLAYER_LIST_STYLE.data) -> dict:
+        '''
+        Replays the proposed session and returns its impact in a dict with:
+
+            session:        The boards (LB_STRUCTURE.player_list) of the proposed game just before
+                            and just after the proposed session, as a (before, after) tuple.
+            leaderboards:   A dict keyed on game pk of the latest boards now and if the proposed
+                            session were saved, as a (before, after) tuple.
+            rating_deltas:  A dict keyed on game pk of dicts keyed on player pk of their change in rating (eta)
+            ranking_deltas: A dict keyed on game pk of dicts keyed on player pk of their change in leaderboard position
+            sessions:       A list of the pks of existing sessions that would be re-rated
+
+        :param style: The LB_PLAYER_LIST_STYLE to use in the returned boards
+        '''
+        self.run()
+
+        proposed = self.proposed
+        asat_before = proposed.date_time - MIN_TIME_DELTA
+
+        session_boards = (self.board(proposed.game_id, asat_before, style), self.board(proposed.game_id, proposed.date_time, style))
+
+        leaderboards = {}
+        rating_deltas = {}
+        ranking_deltas = {}
+        for game in self.game_pks:
+            before = self.boards_before[game]
+            after = self.board(game)
+
+            old_ratings = player_ratings(before, structure=LB_STRUCTURE.player_list) if before else {}
+            new_ratings = player_ratings(after, structure=LB_STRUCTURE.player_list) if after else {}
+            old_rankings = player_rankings(before, structure=LB_STRUCTURE.player_list) if before else {}
+            new_rankings = player_rankings(after, structure=LB_STRUCTURE.player_list) if after else {}
+
+            rating_deltas[game] = {p: new_ratings.get(p, 0) - old_ratings.get(p, 0)
+                                   for p in set(old_ratings) | set(new_ratings)
+                                   if not isclose(new_ratings.get(p, 0), old_ratings.get(p, 0), abs_tol=FLOAT_TOLERANCE)}
+
+            ranking_deltas[game] = {p: new_rankings[p] - old_rankings.get(p, len(new_rankings))
+                                    for p in new_rankings
+                                    if not new_rankings[p] == old_rankings.get(p, len(new_rankings))}
+
+            if not style == LB_PLAYER_LIST_STYLE.data:
+                before = styled_player_list(before, style=style) if before else None
+                after = self.board(game, style=style)
+
+            leaderboards[game] = (before, after)
+
+        return {"session": session_boards,
+                "leaderboards": leaderboards,
+                "rating_deltas": rating_deltas,
+                "ranking_deltas": ranking_deltas,
+                "sessions": sorted(pk for pk in self.session_pks if not pk == proposed.pk)}
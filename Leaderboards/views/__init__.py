@@ -12,7 +12,7 @@ from .events import view_Events, ajax_Events
 from .players import view_Players, ajax_Players
 from .session_impact import view_Impact
 
-from .ajax import ajax_List, ajax_Detail, ajax_Game_Properties, ajax_BGG_Game_Properties
+from .ajax import ajax_List, ajax_Detail, ajax_Game_Properties, ajax_BGG_Game_Properties, ajax_Rebuild_Progress, ajax_Session_What_If
 
 from .post_receivers import receive_ClientInfo, receive_DebugMode, receive_Filter
 
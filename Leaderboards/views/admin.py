@@ -133,7 +133,7 @@ def view_CheckIntegrity(request):
 
 def view_RebuildRatings(request):
 
-    def rebuild_ratings(Game=None, From=None, Reason=None):
+    def rebuild_ratings(Game=None, From=None, Reason=None, InMemory=False):
         activate(settings.TIME_ZONE)
 
         title = "Rebuild of ratings"
@@ -147,8 +147,8 @@ def view_RebuildRatings(request):
 
         pr = cProfile.Profile()
         pr.enable()
-        rlog = Rating.rebuild(Game=Game, From=From, Reason=Reason, Trigger=RATING_REBUILD_TRIGGER.user_request)
-        result = rlog.html
+        rlog = Rating.rebuild(Game=Game, From=From, Reason=Reason, Trigger=RATING_REBUILD_TRIGGER.user_request, InMemory=InMemory)
+        result = rlog.html if rlog else "There were no sessions to rebuild."
         pr.disable()
 
         s = io.StringIO()
@@ -195,7 +195,12 @@ def view_RebuildRatings(request):
     else:
         reason += "."
 
-    html = rebuild_ratings(game, From, reason)
+    # Request the in-memory replay engine with ?in_memory
+    in_memory = 'in_memory' in request.GET
+
+    # A rebuild partitioned across worker processes is only available from manage.py rebuild_ratings
+    # (forking a pool of them from a uWSGI worker is no good idea).
+    html = rebuild_ratings(game, From, reason, in_memory)
 
     return HttpResponse(html)
 
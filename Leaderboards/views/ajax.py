@@ -11,11 +11,13 @@
 import json
 
 from django.urls import reverse
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, HttpResponseNotAllowed
+from django.core.serializers.json import DjangoJSONEncoder
 
 from .generic import view_List, view_Detail
 
-from ..models import Game
+from ..models import Game, Player, Session, RebuildJob, MISSING_VALUE
+from ..trueskill_replay import TrueSkillWhatIf
 from ..BGG import BGG
 
 
@@ -115,3 +117,93 @@ def ajax_BGG_Game_Properties(request, pk):
     '''
     bgg = BGG(pk)
     return HttpResponse(json.dumps(bgg))
+
+
+def ajax_Rebuild_Progress(request, pk):
+    '''
+    A view that returns the progress of a queued rating rebuild (a RebuildJob) so that
+    the browser can poll it and report on it.
+
+    Returns a JSON dict with status, sessions done and total, an ETA in seconds (if one
+    can be estimated), and the pk of the RebuildLog once the rebuild is done.
+    '''
+    try:
+        job = RebuildJob.objects.get(pk=pk)
+    except RebuildJob.DoesNotExist:
+        return HttpResponse(json.dumps({'job': pk, 'status': None}), status=404)
+
+    return HttpResponse(json.dumps(job.progress))
+
+
+def what_if_errors(session_dict) -> list:
+    '''
+    Returns a list of the reasons a session dict (as produced by Session.dict_from_form) can't
+    be evaluated by TrueSkillWhatIf, empty if it can.
+
+    This is no substitute for the validation of the session form when it's saved, just enough to
+    ensure a replay of the proposed session is meaningful.
+
+    :param session_dict: A session dict as produced by Session.dict_from_form
+    '''
+    errors = []
+
+    pk = session_dict["id"]
+    if not pk == MISSING_VALUE and not Session.objects.filter(pk=pk).exists():
+        errors.append(f"There is no session {pk} to edit.")
+
+    if not Game.objects.filter(pk=session_dict["game"]).exists():
+        errors.append("A game is required.")
+
+    performers = session_dict["performers"]
+    rankers = [p for r in session_dict["rankers"] for p in (r if isinstance(r, list) else [r])]
+    if not performers or MISSING_VALUE in performers:
+        errors.append("Every performance needs a player.")
+    elif not Player.objects.filter(pk__in=performers).count() == len(set(performers)):
+        errors.append("A player in the session does not exist.")
+    elif not set(rankers) == set(performers):
+        errors.append("The ranked players must be the players in the session.")
+
+    if not session_dict["rankings"] or MISSING_VALUE in session_dict["rankings"]:
+        errors.append("Every player or team needs a rank.")
+
+    if MISSING_VALUE in session_dict["weights"]:
+        errors.append("Every performance needs a partial play weighting.")
+
+    return errors
+
+
+def ajax_Session_What_If(request, pk=None):
+    '''
+    A view that returns the impact a session submission would have if it were saved,
+    without saving anything (see TrueSkillWhatIf). Expects a POST of the session form,
+    from a user who can submit it (a logged in user).
+
+    Returns a JSON dict with the boards before and after the session, the latest boards
+    of affected games now and after, and the rating and ranking changes of players. Or
+    if the form can't be evaluated, a 400 response with a JSON dict of the errors.
+
+    :param pk: The pk of the session being edited, if any (else it's a new session)
+    '''
+    if not request.method == "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    # The same users as can add or edit a session (see view_Add and view_Edit)
+    if not request.user.is_authenticated:
+        return HttpResponse(json.dumps({'errors': ["You must be logged in to evaluate a session."]}), status=403)
+
+    if not "date_time" in request.POST:
+        return HttpResponse(json.dumps({'errors': ["A date and time is required."]}), status=400)
+
+    try:
+        session_dict = Session.dict_from_form(request.POST, pk)
+    except (ValueError, OverflowError, KeyError):
+        # Unparseable numbers or times, or performances on teams that weren't ranked
+        return HttpResponse(json.dumps({'errors': ["The session form is malformed."]}), status=400)
+
+    errors = what_if_errors(session_dict)
+    if errors:
+        return HttpResponse(json.dumps({'errors': errors}), status=400)
+
+    impact = TrueSkillWhatIf(session_dict).impact()
+
+    return HttpResponse(json.dumps(impact, cls=DjangoJSONEncoder))
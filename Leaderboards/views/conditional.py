@@ -0,0 +1,90 @@
+#===============================================================================
+# Conditional GET support for the JSON views
+#
+# The JSON leaderboard and event views are refreshed by AJAX and are expensive to
+# build, but change only when the options requested change or the data does (a
+# session is added, edited or deleted, ratings are rebuilt, a player renamed or a
+# game, league, location or event edited).
+# So they compute a cheap validator (ETag) from the options and a data stamp up
+# front and answer 304 Not Modified when the browser already has that response.
+#===============================================================================
+import json, hashlib
+
+from django.apps import apps
+from django.db.models import Max, Count
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.core.serializers.json import DjangoJSONEncoder
+
+from ..models import APP
+from ..models.leaderboards import Leaderboard_Cache
+from ..leaderboards.directory import PlayerDirectory
+
+# The models, besides sessions and ratings, whose edits change what the views render
+# (the names of games, leagues, locations and events, and the options they offer).
+RENDERED_MODELS = ("Game", "League", "Location", "Event")
+
+
+def edit_stamp():
+    '''
+    Returns a JSON serialisable stamp of the RENDERED_MODELS that changes when any of them is
+    added, edited or deleted (their latest creation and edit, and their count).
+    '''
+    stamp = {}
+    for model in RENDERED_MODELS:
+        stamp[model] = apps.get_model(APP, model).objects.aggregate(created=Max('created_on'), edited=Max('last_edited_on'), count=Count('pk'))
+    return stamp
+
+
+def validators(request, view, options):
+    '''
+    Returns an (etag, last_modified) pair that validates a response of a view.
+
+    :param request: The request being answered
+    :param view:    A name for the view (so that views with the same options don't share ETags)
+    :param options: JSON serialisable normalised options the response is built from
+    '''
+    (generation, last_modified) = Leaderboard_Cache.data_stamp()
+
+    # The same options can render differently for different users (their names and
+    # privileges) and on different days (relative dates in the options).
+    user = request.user.pk if request.user.is_authenticated else None
+    today = timezone.localdate().isoformat()
+
+    validator = json.dumps([view, options, generation, edit_stamp(), PlayerDirectory.shared_version(), user, today], sort_keys=True, cls=DjangoJSONEncoder)
+    etag = f'"{hashlib.sha1(validator.encode()).hexdigest()}"'
+
+    return (etag, last_modified.timestamp() if last_modified else None)
+
+
+def not_modified(request, etag, last_modified):
+    '''
+    Returns a 304 Not Modified response if the request's conditional headers match, else None.
+
+    :param request:       The request being answered
+    :param etag:          The ETag from validators()
+    :param last_modified: The last_modified timestamp from validators()
+    '''
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response:
+        make_cacheable(response, etag, last_modified)
+    return response
+
+
+def make_cacheable(response, etag, last_modified):
+    '''
+    Adds the validators and cache headers to a response, so that the browser keeps it and
+    revalidates it on the next request (with If-None-Match and If-Modified-Since).
+
+    :param response:      The response to mark
+    :param etag:          The ETag from validators()
+    :param last_modified: The last_modified timestamp from validators()
+    '''
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+
+    patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
@@ -19,6 +19,7 @@ from bokeh.models.callbacks import CustomJS
 from ..models import Event, League, Location, ALL_LEAGUES, ALL_LOCATIONS
 
 from .widgets import html_selector
+from .conditional import validators, not_modified, make_cacheable
 from django.utils.safestring import mark_safe
 
 
@@ -63,6 +64,13 @@ def ajax_Events(request, as_context=False):
     # The user request
     urequest = request.GET
 
+    # An AJAX refresh the browser already has (same request, same data) is answered with a 304
+    if not as_context:
+        (etag, last_modified) = validators(request, 'events', [sorted(urequest.lists()), defaults, request.session.get("timezone", "UTC")])
+        response = not_modified(request, etag, last_modified)
+        if response:
+            return response
+
     # TODO check if we can specify NO league filtering. That is where does preferred league come from?
     # This is in leaderboards view as well with same request to check behaviour
     leagues = []
@@ -217,4 +225,5 @@ def ajax_Events(request, as_context=False):
     else:
         events_table = rich_render_to_string("include/events_table.html", context).strip()
         events_stats_table = rich_render_to_string("include/events_stats_table.html", context).strip()
-        return HttpResponse(json.dumps((events_table, events_stats_table, settings, players, frequency), cls=DjangoJSONEncoder))
+        response = HttpResponse(json.dumps((events_table, events_stats_table, settings, players, frequency), cls=DjangoJSONEncoder))
+        return make_cacheable(response, etag, last_modified)
@@ -5,27 +5,33 @@
 #===============================================================================
 import pytz, json
 
+from concurrent.futures import ThreadPoolExecutor
+
+from crequest.middleware import CrequestMiddleware
+
 from dal import autocomplete
 
+from django.db import close_old_connections
 from django.conf import settings
 from django.utils import timezone
 from django.utils.formats import localize
 from django.utils.timezone import localtime
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, StreamingHttpResponse
 from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import BadRequest
 
 from django_rich_views.context import add_rich_context, add_timezone_context, add_debug_context
 from django_rich_views.datetime import datetime_format_python_to_PHP
 from django_rich_views.render import rich_render
 
 from .widgets import html_selector
+from .conditional import validators, not_modified, make_cacheable
 
 from ..models import Player, Game, League, ALL_LEAGUES, ALL_PLAYERS, ALL_GAMES
 from ..models.leaderboards import Leaderboard_Cache # import directly for PyDev
 from ..leaderboards.options import leaderboard_options
 from ..leaderboards.enums import LB_STRUCTURE, LB_PLAYER_LIST_STYLE, NameSelections, LinkSelections
 from ..leaderboards.style import restyle_leaderboard
-from ..leaderboards.util import immutable
 from ..leaderboards import augment_with_deltas
 
 from Site.logutils import log
@@ -35,9 +41,9 @@ def view_Leaderboards(request):
     '''
     The raison d'etre of the whole site, this view presents the leaderboards.
     '''
-    # Fetch the leaderboards
+    # Fetch the leaderboards (the first page of them, the rest are fetched as the user scrolls)
     # We always request raw (so it's not JSON but Python data
-    leaderboards = ajax_Leaderboards(request, as_list=True)
+    (leaderboards, next_cursor) = ajax_Leaderboards(request, as_list=True, cursor=0)
 
     session_filter = request.session.get('filter', {})
     tz = pytz.timezone(request.session.get("timezone", "UTC"))
@@ -73,6 +79,7 @@ def view_Leaderboards(request):
          'options': json.dumps(lo.as_dict()),
          'defaults': json.dumps(default.as_dict()),
          'leaderboards': json.dumps(leaderboards, cls=DjangoJSONEncoder),
+         'next_cursor': json.dumps(next_cursor),
 
          # For use in templates
          'leaderboard_options': lo,
@@ -105,13 +112,62 @@ def view_Leaderboards(request):
     return rich_render(request, 'views/leaderboards.html', context=c)
 
 
-def ajax_Leaderboards(request, as_list=False, include_baseline=True):
+def game_page(games, cursor, page_size):
+    '''
+    Returns a page of games and the cursor of the next page (None if it is the last page).
+
+    :param games:     An ordered QuerySet of games (leaderboard_options.games_queryset)
+    :param cursor:    The index of the first game on the page
+    :param page_size: The number of games on a page
+    '''
+    # One game more than the page tells us if there's a next page
+    page = list(games[cursor:cursor + page_size + 1])
+    return (page[:page_size], cursor + page_size if len(page) > page_size else None)
+
+
+# The threads that build leaderboards concurrently (see build_concurrently), shared by all requests
+# in this process. Bounded by settings.LEADERBOARD_BUILDERS, as are the database connections they hold.
+builders = ThreadPoolExecutor(max_workers=max(settings.LEADERBOARD_BUILDERS, 1), thread_name_prefix="leaderboard_builder")
+
+
+def build_concurrently(build, items):
+    '''
+    Returns an iterator of build(item) for each of items, in order, built on the shared pool of
+    builders (each thread with its own database connection). An exception building an item is
+    raised when it is reached.
+
+    The current request is passed to the builders, as models look to it for the viewer (notably
+    PrivacyMixIn models, whose private fields are masked for the viewer that loads them).
+
+    :param build:   A function that takes one item
+    :param items:   A list of items
+    '''
+    request = CrequestMiddleware.get_request()
+
+    def build_item(item):
+        CrequestMiddleware.set_request(request)
+        close_old_connections()
+        try:
+            return build(item)
+        finally:
+            CrequestMiddleware.del_request()
+            close_old_connections()
+
+    return builders.map(build_item, items)
+
+
+def ajax_Leaderboards(request, as_list=False, include_baseline=True, cursor=None):
     '''
     A view that returns a JSON string representing requested leaderboards.
 
     This is used with as_list=True as well by view_Leaderboards to get the leaderboard data,
     not JSON encoded.
 
+    The games can be paged, by a cursor (the request's "cursor", or the cursor argument) and a
+    page_size (the request's or settings.LEADERBOARD_PAGE_SIZE). The JSON then ends with the cursor
+    of the next page (null on the last page or if not paged), and with as_list a (leaderboards,
+    next cursor) tuple is returned.
+
     Should only validly be called from view_Leaderboards when a view is rendered
     or as an AJAX call when requesting a leaderboard refresh because the player name
     presentation for example has changed.
@@ -173,8 +229,35 @@ def ajax_Leaderboards(request, as_list=False, include_baseline=True):
     # The session support is legacy, global model based support was added later.
     # it is preferred as it means the first load of a leaderboard view benefits
     # from cache whcih was not the case when using session to cche them.
+    # The model is itself fronted by an L1 cache in memcached (see Leaderboard_Cache.fetch) which
+    # is all the session cache ever offered and shared across sessions.
     use_session_cache = use_cache and settings.USE_SESSION_FOR_LEADERBOARD_CACHE
 
+    # The games can be paged, unless selection options need all the boards (as with streaming below)
+    paged = cursor is not None
+    try:
+        if not paged and "cursor" in request.GET:
+            cursor = max(0, int(request.GET["cursor"] or 0))
+        page_size = int(request.GET.get("page_size", settings.LEADERBOARD_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest("The cursor and page_size must be integers.")
+    paginate = cursor is not None and page_size > 0 and not lo.select_players
+    next_cursor = None
+
+    # The JSON can be streamed, a game at a time, unless selection options need all the boards
+    # before the options (which lead the response) are final, or the session cache is in use
+    # (the session is saved before a streamed response is).
+    stream = not as_list and "stream" in request.GET and not lo.select_players and not use_session_cache
+
+    # An AJAX refresh the browser already has (same options, same data) is answered with a 304
+    if not as_list:
+        (etag, last_modified) = validators(request, 'leaderboards', [lo.as_dict(), str(tz), stream, cursor if paginate else None, page_size])
+        response = not_modified(request, etag, last_modified)
+        if response:
+            if settings.DEBUG:
+                log.debug(f"Leaderboards not modified (ETag {etag}).")
+            return response
+
     # The Session based Leaderboard Cache - delete if not being used
     if not use_session_cache and "leaderboard_cache" in request.session:
         del request.session["leaderboard_cache"]
@@ -196,14 +279,52 @@ def ajax_Leaderboards(request, as_list=False, include_baseline=True):
     #       in the specified time frame and at the same location.
     games = lo.games_queryset()
 
+    # Or just a page of them
+    if paginate:
+        (games, next_cursor) = game_page(games, cursor, page_size)
+
     #######################################################################################################
     # # FOR ALL THE GAMES WE SELECTED build a leaderboard (with any associated snapshots)
     #######################################################################################################
     if settings.DEBUG:
         log.debug(f"Preparing leaderboards for {len(games)} games.")
 
-    leaderboards = []
-    for game in games:
+    # Note: the snapshot query intentionally does not constrain sessions to the same
+    # location as does the game query. Once we have the games that were played at
+    # the event, we're happy to include all sessions during the event regardless of
+    # where. The reason being that we want to see evolution of the leaderboards during
+    # the event even if some people outside of the event are playing it and impacting
+    # the board.
+    #
+    # We collect the boards of every game up front so that the global cache can be fetched for
+    # all of them at once, and the snapshots we have to build written back at once.
+    # (boards are evaluated here, and reused below)
+    game_boards = [(game,) + tuple(lo.snapshot_queryset(game, include_baseline=include_baseline)) for game in games]
+
+    use_global_cache = use_cache and not use_session_cache
+    if use_global_cache:
+        all_boards = [board for game, boards, has_reference, has_baseline in game_boards for board in boards]
+
+        # Boards we build are stamped with the generation of their game's cache as it was before we built them
+        cache_generations = Leaderboard_Cache.generations([game for game, boards, has_reference, has_baseline in game_boards])
+
+        # Read through the L1 (memcached) and L2 (Leaderboard_Cache table) tiers, a dict of (entry, board) tuples
+        global_cache = Leaderboard_Cache.fetch(all_boards, cache_generations)
+        new_cache_entries = []
+
+        if settings.DEBUG:
+            log.debug(f"Found {len(global_cache)} of {len(all_boards)} boards/snapshots in cache.")
+
+    def game_leaderboard(game, boards, has_reference, has_baseline):
+        '''
+        Returns the wrapped leaderboard (LB_STRUCTURE.game_wrapped_session_wrapped_player_list) of a game,
+        or None if it has no boards.
+
+        :param game:          A Game
+        :param boards:        The Sessions after which the game's boards (snapshots) are wanted, newest first
+        :param has_reference: True if the boards include a reference snapshot
+        :param has_baseline:  True if the boards include a baseline snapshot
+        '''
         if settings.DEBUG:
             log.debug(f"Preparing leaderboard for: {game}")
 
@@ -218,14 +339,6 @@ def ajax_Leaderboards(request, as_list=False, include_baseline=True):
         #
         # We want to know if the session is already in a cached snapshot.
 
-        # Note: the snapshot query intentionally does not constrain sessions to the same
-        # location as does the game query. Once we have the games that were played at
-        # the event, we're happy to include all sessions during the event regardless of
-        # where. The reason being that we want to see evolution of the leaderboards during
-        # the event even if some people outside of the event are playing it and impacting
-        # the board.
-        (boards, has_reference, has_baseline) = lo.snapshot_queryset(game, include_baseline=include_baseline)
-
         # boards are Session instances (the board after a session, or alternately the session played to produce this board)
         if boards:
             #######################################################################################################
@@ -245,6 +358,9 @@ def ajax_Leaderboards(request, as_list=False, include_baseline=True):
             # (it adds a rank_delat entry, change in rank from the baseline)
             baseline = None
 
+            # And the last board in the global cache (and its entry) that the next can be stored as a delta of
+            cache_base = cache_base_snapshot = None
+
             # For each board/snapshot of this game ...
             # In temporal order so we can construct the "previous rank"
             # element on the fly, but we're reverse it back when we add the
@@ -257,9 +373,6 @@ def ajax_Leaderboards(request, as_list=False, include_baseline=True):
                 #       leaderboard presentation check on performance between asat=time (which
                 #       reads Performance) and asat=None (which reads Rating).
                 #
-                # TODO: Consider if performance here improves with a prefetch or such noting that
-                #       game.play_counts and game.session_list might run faster with one query rather
-                #       than two.
 
                 if settings.DEBUG:
                     log.debug(f"\tBoard/Snapshot for session {board.id} at {localize(localtime(board.date_time))}.")
@@ -281,19 +394,21 @@ def ajax_Leaderboards(request, as_list=False, include_baseline=True):
                             if full_snapshot:
                                 lb_cache[board.pk] = full_snapshot
                     else:
-                        # Global cache:
-                        try:
-                            full_snapshot = immutable(Leaderboard_Cache.objects.get(session=board).board)
+                        # Global cache (fetched up front for all boards):
+                        if board.pk in global_cache:
+                            cache_base, full_snapshot = global_cache[board.pk]
                             # TODO: This should now be de-temlated and richified
                             if settings.DEBUG:
                                 log.debug(f"\t\tFound it in cache!")
-                        except Leaderboard_Cache.DoesNotExist:
+                        else:
                             if settings.DEBUG:
                                 log.debug(f"\t\tBuilding it!")
                             full_snapshot = board.leaderboard_snapshot(style=LB_PLAYER_LIST_STYLE.data)
                             if full_snapshot:
-                                lb_cache = Leaderboard_Cache(session=board, board=full_snapshot)
-                                lb_cache.save()
+                                # Written back in one query when all boards are built
+                                cache_base = Leaderboard_Cache.entry(board, full_snapshot, cache_generations.get(game.pk, 0), cache_base, cache_base_snapshot)
+                                new_cache_entries.append(cache_base)
+                        cache_base_snapshot = full_snapshot
                 else:
                     if settings.DEBUG:
                         log.debug(f"\t\tBuilding it! (caching is disabled)")
@@ -331,16 +446,14 @@ def ajax_Leaderboards(request, as_list=False, include_baseline=True):
                     # in-league:    show only snapshots played in the specified leagues
                     # cross-league  show snapshots played by any players in the selected leagues
                     # global        show all snapshots
+                    #
+                    # The counts come from a series built once per game (see Game.play_count_series).
                     if lo.leagues:
-                        if lo.show_cross_league_snaps:
-                            counts = game.play_counts(leagues=lo.leagues, asat=board.date_time, broad=True)
-                        else:
-                            counts = game.play_counts(leagues=lo.leagues, asat=board.date_time)
-
+                        counts = game.play_count_series(leagues=lo.leagues, broad=lo.show_cross_league_snaps).asat(board.date_time)
                         plays = counts['total']
                         sessions = counts['sessions']
                     else:
-                        counts = game.play_counts(asat=board.date_time)
+                        counts = game.play_count_series().asat(board.date_time)
                         plays = counts['total']
                         sessions = counts['sessions']
 
@@ -370,10 +483,66 @@ def ajax_Leaderboards(request, as_list=False, include_baseline=True):
             snapshots.reverse()
 
             # Then build the game tuple with all its snapshots
-            leaderboards.append(game.wrapped_leaderboard(snapshots, snap=True, has_reference=has_reference, has_baseline=has_baseline))
+            return game.wrapped_leaderboard(snapshots, snap=True, has_reference=has_reference, has_baseline=has_baseline)
 
-    if use_session_cache:
-        request.session["leaderboard_cache"] = lb_cache
+    def save_cache():
+        '''
+        Saves the boards/snapshots we built to the cache in use.
+        '''
+        if use_session_cache:
+            request.session["leaderboard_cache"] = lb_cache
+
+        if use_global_cache and new_cache_entries:
+            # Write through both tiers
+            Leaderboard_Cache.put(new_cache_entries)
+
+            if settings.DEBUG:
+                log.debug(f"Cached {len(new_cache_entries)} new boards/snapshots.")
+
+    def game_leaderboards():
+        '''
+        A generator of the wrapped leaderboards of the games (None for a game without boards), in
+        order. Built concurrently (most of the time is spent waiting on the database) if configured.
+        '''
+        if settings.LEADERBOARD_BUILDERS > 1 and len(game_boards) > 1:
+            return build_concurrently(lambda game_board: game_leaderboard(*game_board), game_boards)
+        else:
+            return (game_leaderboard(*game_board) for game_board in game_boards)
+
+    if stream:
+        def streamed_leaderboards():
+            '''
+            Yields the JSON response a line at a time, the (title, subtitle, options, [ prefix first
+            and then each game's leaderboard as soon as it is built, and last the ], next cursor)
+            suffix. Together still one JSON document.
+            '''
+            # This runs after the response has left the middleware, which forgot the request, but
+            # models look to it for the viewer (notably PrivacyMixIn models).
+            CrequestMiddleware.set_request(request)
+            try:
+                yield json.dumps((title, subtitle, lo.as_dict()), cls=DjangoJSONEncoder)[:-1] + ", [\n"
+
+                count = 0
+                for leaderboard in game_leaderboards():
+                    if leaderboard:
+                        yield ("," if count else "") + json.dumps(leaderboard, cls=DjangoJSONEncoder) + "\n"
+                        count += 1
+
+                save_cache()
+
+                if settings.DEBUG:
+                    log.debug(f"Streamed {count} leaderboards.")
+
+                yield "], " + json.dumps(next_cursor) + "]"
+            finally:
+                CrequestMiddleware.del_request()
+
+        response = StreamingHttpResponse(streamed_leaderboards(), content_type="application/json")
+        return make_cacheable(response, etag, last_modified)
+
+    leaderboards = [leaderboard for leaderboard in game_leaderboards() if leaderboard]
+
+    save_cache()
 
     if settings.DEBUG:
         log.debug(f"Supplying {len(leaderboards)} leaderboards as {'a python object' if as_list else 'as a JSON string'}.")
@@ -382,4 +551,8 @@ def ajax_Leaderboards(request, as_list=False, include_baseline=True):
     lo.apply_selection_options(leaderboards)
 
     # as_list is asked for on a standard page load, when a true AJAX request is underway it's false.
-    return leaderboards if as_list else HttpResponse(json.dumps((title, subtitle, lo.as_dict(), leaderboards), cls=DjangoJSONEncoder))
+    if as_list:
+        return (leaderboards, next_cursor) if paged else leaderboards
+    else:
+        response = HttpResponse(json.dumps((title, subtitle, lo.as_dict(), leaderboards, next_cursor), cls=DjangoJSONEncoder))
+        return make_cacheable(response, etag, last_modified)
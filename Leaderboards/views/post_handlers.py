@@ -3,14 +3,17 @@
 #
 # These are the COGS specific handlers that the generic views call.
 #===============================================================================
-from ..models import Rating, RATING_REBUILD_TRIGGER
+from django.conf import settings
 
+from ..models import Rating, Performance, RatingTimeline, RebuildJob, Leaderboard_Cache, RATING_REBUILD_TRIGGER
 
-def post_delete_handler(self, pk=None, game=None, players=None, victors=None, rebuild=None):
+
+def post_delete_handler(self, pk=None, game=None, date_time=None, players=None, victors=None, rebuild=None):
     '''
     After deleting an object this is called (before the transaction is committed, so raising an
     exception can force a rollback on the delete.
 
+    :param date_time:  the date_time of a session being deleted
     :param players:    a set of players that were in a session being deleted
     :param victors:    a set of victors in the session being deleted
     :param rebuild:    a list of sessions to rebuild ratings for if a session is being deleted
@@ -18,10 +21,23 @@ def post_delete_handler(self, pk=None, game=None, players=None, victors=None, re
     model = self.model._meta.model_name
 
     if model == 'session':
+        # The deleted session's performances are gone, relink the adjacency index
+        # (previous plays and victories) and the rating timeline over the gap they left.
+        if players:
+            Performance.link(game, players)
+            RatingTimeline.record(game, players)
+
+        # The boards from the deleted session on are gone or changed, whether or not (and however
+        # soon) ratings are rebuilt. This also changes the stamp that validates the JSON views.
+        Leaderboard_Cache.invalidate_from(game, date_time)
+
         # Execute a requested rebuild
         if rebuild:
             reason = f"Session {pk} was deleted."
-            Rating.rebuild(Sessions=rebuild, Reason=reason, Trigger=RATING_REBUILD_TRIGGER.session_delete)
+            if settings.USE_REBUILD_QUEUE:
+                RebuildJob.enqueue(rebuild, reason, RATING_REBUILD_TRIGGER.session_delete)
+            else:
+                Rating.rebuild(Sessions=rebuild, Reason=reason, Trigger=RATING_REBUILD_TRIGGER.session_delete)
         else:
             # A rebuld of ratings finsihes with updated ratings)
             # If we have no rebuild (by implication we just deleted
@@ -17,7 +17,7 @@ from django_rich_views.views import RichCreateView, RichUpdateView
 from django_rich_views.datetime import time_str
 from django_rich_views.util import isPositiveInt
 
-from ..models import Game, Session, Player, Rating, Team, ChangeLog, RATING_REBUILD_TRIGGER, MISSING_VALUE
+from ..models import Game, Session, Player, Rating, Performance, RatingTimeline, Team, ChangeLog, RebuildJob, RATING_REBUILD_TRIGGER, MISSING_VALUE
 
 from Site.logutils import log
 
@@ -673,6 +673,7 @@ def pre_save_handler(self, change_summary=None, rebuild=None, reason=None):
     model = self.model._meta.model_name
 
     change_log = None
+    relink = None
     if model == 'session':
         if isinstance(self, RichCreateView):
             # Create a change log, but we don't have a session yet
@@ -689,8 +690,12 @@ def pre_save_handler(self, change_summary=None, rebuild=None, reason=None):
             # too.
             change_log = ChangeLog.create(old_session, change_summary)
 
+            # The session's performances may move (in time or to another game) or go (if
+            # players are removed), which the adjacency index must reflect where they were.
+            relink = (old_session.game, [p.pk for p in old_session.players], old_session.date_time)
+
     # Return the kwargs for the next handler
-    return {'change_log': change_log, 'rebuild': rebuild, 'reason': reason}
+    return {'change_log': change_log, 'rebuild': rebuild, 'reason': reason, 'relink': relink}
 
 # TODO: When
 #    <input type="checkbox" value="on" id="id_Team-0-DELETE" name="Team-0-DELETE" style="display: none;">
@@ -702,7 +707,7 @@ def pre_save_handler(self, change_summary=None, rebuild=None, reason=None):
 # 2. Fix if necessary
 
 
-def pre_commit_handler(self, change_log=None, rebuild=None, reason=None):
+def pre_commit_handler(self, change_log=None, rebuild=None, reason=None, relink=None):
     '''
     When a model form is POSTed, this function is called AFTER the form is saved.
 
@@ -718,6 +723,7 @@ def pre_commit_handler(self, change_log=None, rebuild=None, reason=None):
     :param changes: A JSON string which records changes being committed.
     :param rebuild: A list of sessions to rebuild.
     :param reason: A string. The reason for a rebuild if any is provided.
+    :param relink: A tuple of (game, players, from) to relink in the adjacency index (where an edited session was).
     '''
     model = self.model._meta.model_name
 
@@ -842,8 +848,22 @@ def pre_commit_handler(self, change_log=None, rebuild=None, reason=None):
         # thing just before calculating TrueSkill impacts.
         session.clean_ranks()
 
-        # update ratings on the saved session.
-        Rating.update(session)
+        # Relink the adjacency index (previous plays and victories) and the rating timeline where
+        # an edited session was. Rating.update links them where it is now.
+        if relink:
+            Performance.link(*relink)
+            RatingTimeline.record(*relink)
+
+        # While a queued rebuild of this game is pending its ratings are stale, and updating the
+        # ratings on this session would build on them. So it joins the queued rebuild instead.
+        if settings.USE_REBUILD_QUEUE and RebuildJob.is_pending_for(session.game):
+            rebuild = sorted(set(rebuild or []) | {session}, key=lambda s: s.date_time)
+            reason = reason or f"Session {session.pk} was submitted while a rebuild of {session.game} was pending."
+            if settings.DEBUG:
+                log.debug(f"A ratings rebuild of {session.game} is pending, deferring the rating update to it.")
+        else:
+            # update ratings on the saved session.
+            Rating.update(session)
 
         # If a rebuild request arrived from the preprocessors honour that
         # It means this submission is known to affect "future" sessions
@@ -861,9 +881,17 @@ def pre_commit_handler(self, change_log=None, rebuild=None, reason=None):
             else:
                 raise ValueError("Pre commit handler called from unsupported class.")
 
-            # This performs a rating rebuild, saves a RebuildLog and returns it
-            rebuild_log = Rating.rebuild(Sessions=rebuild, Reason=reason, Trigger=trigger, Session=session)
+            if settings.USE_REBUILD_QUEUE:
+                # This queues a rating rebuild for a rebuild worker, the RebuildLog is only
+                # available when it's done (and the ChangeLog will be given it then)
+                rebuild_job = RebuildJob.enqueue(rebuild, reason, trigger, session)
+                rebuild_log = None
+            else:
+                # This performs a rating rebuild, saves a RebuildLog and returns it
+                rebuild_job = None
+                rebuild_log = Rating.rebuild(Sessions=rebuild, Reason=reason, Trigger=trigger, Session=session)
         else:
+            rebuild_job = None
             rebuild_log = None
 
         if change_log:
@@ -888,6 +916,9 @@ def pre_commit_handler(self, change_log=None, rebuild=None, reason=None):
 
             change_log.save()
 
+            if rebuild_job:
+                rebuild_job.change_logs.add(change_log)
+
         # Now check the integrity of the save. For a sessions, this means that:
         #
         # If it is a team_play session:
@@ -930,7 +961,7 @@ def pre_delete_handler(self):
 
         # The session won't exist after it's deleted, so grab everythinhg the post delete handler
         # wants to know about a session to do its work.
-        post_kwargs = {'pk': session.pk, 'game': session.game, 'players': session.players, 'victors': session.victors}
+        post_kwargs = {'pk': session.pk, 'game': session.game, 'date_time': session.date_time, 'players': session.players, 'victors': session.victors}
 
         g = session.game
         dt = session.date_time
@@ -218,6 +218,15 @@ def view_Impact(request, model, pk):
                       "includes_diagnostic": includes_diagnostic  # A diagnostic board is included in lb_impact_after_change as a third board.
                       })
 
+        # A rebuild may have been queued rather than performed (see RebuildJob) in which case
+        # we can report on its progress until it's done.
+        rebuild_job = clog.rebuild_jobs.order_by('-pk').first() if clog and not rlog else None
+        if rebuild_job and rebuild_job.is_pending:
+            c.update({"rebuild_job": rebuild_job,
+                      "rebuild_progress": rebuild_job.progress,
+                      "rebuild_trigger": RATING_REBUILD_TRIGGER.labels.value[rebuild_job.trigger],
+                      })
+
         if rlog:
             c.update({"rebuild_log": rlog,
                       "rebuild_date_time": time_str(rlog.created_on),
@@ -16,6 +16,14 @@ from django.conf import global_settings
 USE_LEADERBOARD_CACHE = True
 USE_SESSION_FOR_LEADERBOARD_CACHE = False
 
+# A custom CoGs setting that stores leaderboards in the leaderboard cache packed (see
+# Leaderboards.leaderboards.packing) rather than as JSON. Much faster to decode.
+PACK_LEADERBOARD_CACHE = True
+
+# A custom CoGs setting, the most boards of a game stored in the leaderboard cache per keyframe
+# (full board), the others being stored as deltas (see Leaderboards.leaderboards.delta).
+LEADERBOARD_CACHE_KEYFRAME_INTERVAL = 16
+
 USE_BOOTSTRAP = False
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -48,6 +56,29 @@ SITE_IS_LIVE = HOSTNAME in [PRODUCTION, SANDBOX]
 
 TESTING = len(sys.argv) >= 2 and sys.argv[1] == 'test'
 
+# A custom CoGs setting that queues the rating rebuilds that session edits trigger, for a
+# rebuild worker (manage.py rebuild_worker) to perform, rather than performing them in the
+# request that submitted the edit. Only enable it where a worker runs, for example started
+# with uWSGI by adding to its ini file:
+#     attach-daemon2 = cmd=python manage.py rebuild_worker,stopsignal=15
+# else queued rebuilds are never performed.
+USE_REBUILD_QUEUE = False
+
+# A custom CoGs setting that warms the leaderboard cache (see Leaderboard_Cache.warm) for the
+# sessions a rating rebuild touched, after rebuilds performed by manage.py rebuild_worker and
+# manage.py rebuild_ratings (not in the web process), and the number of worker threads that warm
+# it (there and in manage.py warm_leaderboard_cache).
+WARM_LEADERBOARD_CACHE_AFTER_REBUILD = USE_LEADERBOARD_CACHE and not TESTING
+LEADERBOARD_CACHE_WARMERS = 4
+
+# A custom CoGs setting, the number of rating snapshots (BackupRating, one taken by each rating
+# rebuild to compare with) to keep. Older snapshots are pruned as new ones are taken.
+RATING_SNAPSHOTS_KEPT = 10
+
+# A custom CoGs setting, the maximum number of players held in the in-process directory of
+# player names and leagues that leaderboards use (see Leaderboards.leaderboards.directory).
+PLAYER_DIRECTORY_SIZE = 10000
+
 if HOSTNAME == PRODUCTION:
     SITE_TITLE = "CoGs Leaderboard Space"
     database = "CoGs"
@@ -186,9 +217,28 @@ CACHES = {
         'LOCATION': 'unix:/run/memcached/socket',
         'KEY_PREFIX': "Leaderboards",
         'TIMEOUT': 60 * 60 * 24 * 14  # in seconds (sec2min*min2hr*hr2day*days)
+    },
+    # A local memory stand-in for memcached (per process), see LEADERBOARD_L1_CACHE
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'Leaderboards',
+        'TIMEOUT': 60 * 60 * 24
     }
 }
 
+# A custom CoGs setting, the number of threads (each with its own database connection) that build
+# the leaderboards of the games in a leaderboards request concurrently. 1 builds them one after
+# another, as tests must (test data is in a transaction other connections can't see).
+LEADERBOARD_BUILDERS = 1 if TESTING else 4
+
+# A custom CoGs setting, the number of games per page of leaderboards (the first screen of the
+# leaderboards view, and each page fetched as the user scrolls). 0 for all games at once.
+LEADERBOARD_PAGE_SIZE = 12
+
+# A custom CoGs setting, the cache (in CACHES) used as the first tier of the leaderboard
+# cache, in front of the Leaderboard_Cache table (see Leaderboard_Cache.fetch).
+LEADERBOARD_L1_CACHE = 'local' if TESTING else 'default'
+
 ATOMIC_REQUESTS = True
 
 # Internationalization
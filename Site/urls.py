@@ -62,6 +62,9 @@ urlpatterns = [
     path('json/players/', views.ajax_Players, name='json_players'),
     path('json/game/<pk>', views.ajax_Game_Properties, name='get_game_props'),
     path('json/bgg_game/<pk>', views.ajax_BGG_Game_Properties, name='get_bgg_game_props'),
+    path('json/rebuild/<pk>', views.ajax_Rebuild_Progress, name='json_rebuild_progress'),
+    path('json/whatif/', views.ajax_Session_What_If, name='json_whatif'),
+    path('json/whatif/<pk>', views.ajax_Session_What_If, name='json_whatif_edit'),
 
     # General patterns next
     path('json/<model>', views.ajax_List, name='get_list_html'),
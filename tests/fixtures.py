@@ -0,0 +1,78 @@
+'''
+A small fixture of games, players, leagues and sessions, with their ratings rebuilt, for the
+rating and leaderboard tests.
+
+A mixin rather than a TestCase, so that test modules that use it don't collect its tests.
+'''
+from django.contrib.auth import get_user_model
+
+from Leaderboards.models import Game, Player, League, Location, Rating
+
+from .test_session import SessionTestCase
+
+
+class LeaderboardFixture:
+
+    @classmethod
+    def create_session(cls, game, players, ranking, date_time, league, location):
+        '''
+        Creates a session in the database (see SessionTestCase.create_session).
+        '''
+        return SessionTestCase.create_session(game, players, ranking, date_time, league, location)
+
+    @classmethod
+    def setUpTestData(cls):
+        # A user (to log in as for the views that need one)
+        cls.user = get_user_model().objects.create_user('tester', 'tester@leaderboard.space', 'password')
+
+        cls.location1 = Location.objects.create(name="Location1")
+        cls.location2 = Location.objects.create(name="Location2")
+
+        cls.player1 = Player.objects.create(name_nickname="Player1", name_personal="Player", name_family="One", email_address="player1@leaderboard.space")
+        cls.player2 = Player.objects.create(name_nickname="Player2", name_personal="Player", name_family="Two", email_address="player2@leaderboard.space")
+        cls.player3 = Player.objects.create(name_nickname="Player3", name_personal="Player", name_family="Three", email_address="player3@leaderboard.space")
+        cls.player4 = Player.objects.create(name_nickname="Player4", name_personal="Player", name_family="Four", email_address="player4@leaderboard.space")
+        cls.player5 = Player.objects.create(name_nickname="Player5", name_personal="Player", name_family="Five", email_address="player5@leaderboard.space")
+        cls.player6 = Player.objects.create(name_nickname="Player6", name_personal="Player", name_family="Six", email_address="player6@leaderboard.space")
+
+        cls.game0 = Game.objects.create(name="NO_SCORES", individual_play=True, team_play=False, scoring=Game.ScoringOptions.NO_SCORES.value)
+        cls.gameIH = Game.objects.create(name="INDIVIDUAL_HIGH_SCORE_WINS", individual_play=True, team_play=False, scoring=Game.ScoringOptions.INDIVIDUAL_HIGH_SCORE_WINS.value)
+        cls.gameIL = Game.objects.create(name="INDIVIDUAL_LOW_SCORE_WINS", individual_play=True, team_play=False, scoring=Game.ScoringOptions.INDIVIDUAL_LOW_SCORE_WINS.value)
+        cls.all_games = [cls.game0, cls.gameIH, cls.gameIL]
+
+        # And a team game (apart from all_games, which the tests of individual play iterate over)
+        cls.gameTH = Game.objects.create(name="TEAM_HIGH_SCORE_WINS", individual_play=False, team_play=True, scoring=Game.ScoringOptions.TEAM_HIGH_SCORE_WINS.value)
+
+        # Two overlapping leagues (players 3 and 4 are in both)
+        cls.league1 = League.objects.create(name='League1', manager=cls.player1)
+        cls.league1.locations.set([cls.location1])
+        cls.league1.players.set([cls.player1, cls.player2, cls.player3, cls.player4])
+        cls.league1.games.set(cls.all_games + [cls.gameTH])
+
+        cls.league2 = League.objects.create(name='League2', manager=cls.player6)
+        cls.league2.locations.set([cls.location2])
+        cls.league2.players.set([cls.player3, cls.player4, cls.player5, cls.player6])
+        cls.league2.games.set(cls.all_games + [cls.gameTH])
+
+        session = cls.create_session
+
+        # A series of sessions of one game, in both leagues, with players coming and going
+        cls.session01 = session(cls.game0, [cls.player1, cls.player2, cls.player3, cls.player4], [4, 3, 2, 1], '2022-01-01 08:00:00 +10:00', cls.league1, cls.location1)
+        cls.session02 = session(cls.game0, [cls.player3, cls.player4, cls.player5, cls.player6], [2, 3, 1, 4], '2022-01-01 09:00:00 +10:00', cls.league2, cls.location2)
+        cls.session03 = session(cls.game0, [cls.player1, cls.player2, cls.player5, cls.player6], [1, 3, 4, 2], '2022-01-01 10:00:00 +10:00', cls.league1, cls.location1)
+        cls.session04 = session(cls.game0, [cls.player1, cls.player4, cls.player5, cls.player3], [1, 2, 3, 4], '2022-01-01 11:00:00 +10:00', cls.league2, cls.location2)
+        cls.session05 = session(cls.game0, [cls.player2, cls.player3], [1, 2], '2022-01-02 08:00:00 +10:00', cls.league1, cls.location1)
+        cls.game0_sessions = [cls.session01, cls.session02, cls.session03, cls.session04, cls.session05]
+
+        # And a couple of others
+        cls.sessionIH1 = session(cls.gameIH, [cls.player1, cls.player2, cls.player3], [1, 2, 3], '2022-01-01 12:00:00 +10:00', cls.league1, cls.location1)
+        cls.sessionIH2 = session(cls.gameIH, [cls.player3, cls.player5, cls.player6], [1, 1, 3], '2022-01-01 13:00:00 +10:00', cls.league2, cls.location2)
+        cls.sessionIL1 = session(cls.gameIL, [cls.player4, cls.player5, cls.player6], [3, 2, 1], '2022-01-01 14:00:00 +10:00', cls.league2, cls.location2)
+
+        # And a couple of team sessions
+        cls.sessionTH1 = session(cls.gameTH, [[cls.player1, cls.player2], [cls.player3, cls.player4]], [1, 2], '2022-01-01 15:00:00 +10:00', cls.league1, cls.location1)
+        cls.sessionTH2 = session(cls.gameTH, [[cls.player3, cls.player5], [cls.player4, cls.player6]], [2, 1], '2022-01-01 16:00:00 +10:00', cls.league2, cls.location2)
+
+        # The sessions were created out of band, rebuild the ratings, the adjacency index and
+        # the rating timeline from them.
+        Rating.rebuild(Reason="Test fixture.")
@@ -0,0 +1,234 @@
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+
+from Leaderboards.models import Session, ALL_LEAGUES
+from Leaderboards.models.leaderboards import Leaderboard_Cache, Leaderboard_Cache_Invalidation
+from Leaderboards.leaderboards.enums import LB_PLAYER_LIST_STYLE
+from Leaderboards.leaderboards.delta import snapshot_delta, apply_snapshot_delta, encode_series, decode_series
+from Leaderboards.leaderboards.packing import is_packable, pack_snapshot, unpack_snapshot, PackingError
+from Leaderboards.leaderboards.util import immutable
+from Leaderboards.views.pre_handlers import pre_delete_handler
+from Leaderboards.views.post_handlers import post_delete_handler
+
+from .fixtures import LeaderboardFixture
+
+
+class LeaderboardsTestCase(LeaderboardFixture, TestCase):
+
+    def assertCountsEqual(self, first, second, msg=None):
+        '''
+        Asserts that two play counts dicts (as Game.play_counts returns them) are equal (the averages within a tolerance).
+        '''
+        self.assertEqual({k: v for k, v in first.items() if k != 'average'}, {k: v for k, v in second.items() if k != 'average'}, msg)
+        self.assertAlmostEqual(first['average'], second['average'], msg=msg)
+
+    def test_play_count_series(self):
+        '''
+        The play count series of a game holds the play counts as at any time.
+        '''
+        for game in self.all_games:
+            times = [s.date_time for s in game.session_list()]
+            times += [t + timedelta(minutes=1) for t in times] + [min(times) - timedelta(minutes=1)]
+
+            for leagues in ([], [self.league1], [self.league2], [self.league1, self.league2]):
+                for broad in (False, True):
+                    series = game.play_count_series(leagues=list(leagues), broad=broad)
+
+                    for asat in times:
+                        self.assertCountsEqual(series.asat(asat), game.play_counts(leagues=list(leagues), asat=asat, broad=broad),
+                                               f"{game} as at {asat} for {leagues} (broad={broad})")
+
+                    self.assertCountsEqual(series.asat(), game.play_counts(leagues=list(leagues), broad=broad), f"{game} now for {leagues} (broad={broad})")
+
+    def test_league_partitions(self):
+        '''
+        The league partitions of a game are its leaderboard, play counts and session list in each league (and globally).
+        '''
+        for game in self.all_games:
+            for asat in (None, self.session03.date_time, self.session05.date_time):
+                partitions = game.league_partitions(asat=asat)
+
+                self.assertEqual(set(partitions.keys()), {ALL_LEAGUES, self.league1, self.league2})
+
+                for league, partition in partitions.items():
+                    leagues = [] if league == ALL_LEAGUES else [league]
+                    msg = f"{game} as at {asat} in {league}"
+
+                    self.assertEqual(partition['leaderboard'], game.leaderboard(leagues=list(leagues), asat=asat), msg)
+                    self.assertCountsEqual(partition['plays'], game.play_counts(leagues=list(leagues), asat=asat), msg)
+                    self.assertEqual({s.pk for s in partition['sessions']}, {s.pk for s in game.session_list(leagues=list(leagues), asat=asat)}, msg)
+
+    def test_packed_snapshots(self):
+        '''
+        A packed snapshot unpacks to the snapshot, as does a packed cache entry.
+        '''
+        for session in self.game0_sessions + [self.sessionIH1, self.sessionIH2, self.sessionIL1]:
+            snapshot = session.leaderboard_snapshot(style=LB_PLAYER_LIST_STYLE.data)
+
+            self.assertTrue(is_packable(snapshot))
+            self.assertEqual(unpack_snapshot(pack_snapshot(snapshot)), immutable(snapshot))
+
+            with self.settings(PACK_LEADERBOARD_CACHE=True):
+                entry = Leaderboard_Cache.create(session)
+
+            self.assertIsNotNone(entry.packed)
+            self.assertEqual(Leaderboard_Cache.objects.get(session=session).snapshot, immutable(snapshot))
+
+        # A snapshot in another style can't be packed
+        snapshot = self.session01.leaderboard_snapshot(style=LB_PLAYER_LIST_STYLE.simple)
+        self.assertFalse(is_packable(snapshot))
+        with self.assertRaises(PackingError):
+            pack_snapshot(snapshot)
+
+    def test_delta_snapshots(self):
+        '''
+        A snapshot rebuilt from a delta is the snapshot, as is one rebuilt through a chain of delta cache entries.
+        '''
+        snapshots = [s.leaderboard_snapshot(style=LB_PLAYER_LIST_STYLE.data) for s in self.game0_sessions]
+
+        for previous, snapshot in zip(snapshots, snapshots[1:]):
+            delta = snapshot_delta(previous, snapshot)
+            if delta is not None:
+                self.assertEqual(apply_snapshot_delta(previous, delta), immutable(snapshot))
+
+        for keyframe_interval in (1, 2, len(snapshots)):
+            self.assertEqual(decode_series(encode_series(snapshots, keyframe_interval)), [immutable(s) for s in snapshots])
+
+        # Through the cache, each entry a delta from the one before where that's worth it
+        base = None
+        for session in self.game0_sessions:
+            base = Leaderboard_Cache.create(session, True, base, getattr(base, 'built', None))
+
+        entries = Leaderboard_Cache.fresh().in_bulk([s.pk for s in self.game0_sessions])
+        boards = Leaderboard_Cache.snapshots(entries)
+
+        for session, snapshot in zip(self.game0_sessions, snapshots):
+            self.assertEqual(boards[session.pk], immutable(snapshot))
+            self.assertEqual(entries[session.pk].snapshot, immutable(snapshot))
+
+        # A broken chain leaves the entries after the break unbuildable (not wrong)
+        deltas = [pk for pk, entry in entries.items() if not entry.is_keyframe]
+        if deltas:
+            broken = Leaderboard_Cache.objects.get(session=deltas[0])
+            Leaderboard_Cache.objects.filter(session=broken.base_id).delete()
+            entries = Leaderboard_Cache.fresh().in_bulk([s.pk for s in self.game0_sessions])
+            self.assertNotIn(broken.pk, Leaderboard_Cache.snapshots(entries))
+
+    def test_cache_generations(self):
+        '''
+        A cache entry is stale once its game is invalidated at or before its session, and not before.
+        '''
+        def fresh():
+            return set(Leaderboard_Cache.fresh().values_list('session', flat=True))
+
+        def generation():
+            return Leaderboard_Cache.generations([self.game0]).get(self.game0.pk, 0)
+
+        session = self.session03
+        Leaderboard_Cache.create(session)
+        Leaderboard_Cache.create(self.sessionIH1)
+        self.assertIn(session.pk, fresh())
+
+        # An invalidation of a later session, or of another game, leaves it fresh
+        before = generation()
+        Leaderboard_Cache.invalidate(self.session04)
+        Leaderboard_Cache.invalidate(self.sessionIH2)
+        self.assertEqual(generation(), before + 1)
+        self.assertIn(session.pk, fresh())
+        self.assertIn(self.sessionIH1.pk, fresh())
+
+        # One of it or an earlier session makes it stale
+        Leaderboard_Cache.invalidate(session)
+        self.assertEqual(generation(), before + 2)
+        self.assertNotIn(session.pk, fresh())
+        self.assertIn(session.pk, Leaderboard_Cache.stale().values_list('session', flat=True))
+
+        # Until it is rebuilt, in the new generation
+        entry = Leaderboard_Cache.create(session)
+        self.assertEqual(entry.generation, before + 2)
+        self.assertIn(session.pk, fresh())
+
+        # As are all of a game's entries by an invalidation of all its sessions
+        Leaderboard_Cache.invalidate_from(self.game0)
+        self.assertNotIn(session.pk, fresh())
+
+        # Garbage collection deletes the stale entries, and (once they are old enough) the
+        # invalidations that cover no entry, while the games keep their generations.
+        self.assertEqual(Leaderboard_Cache.collect_garbage(), 1)
+        self.assertFalse(Leaderboard_Cache.stale().exists())
+        self.assertTrue(Leaderboard_Cache_Invalidation.objects.filter(game=self.game0).exists())
+
+        with mock.patch.object(Leaderboard_Cache_Invalidation, 'kept_for', timedelta(0)):
+            Leaderboard_Cache.collect_garbage()
+
+        self.assertFalse(Leaderboard_Cache_Invalidation.objects.exists())
+        self.assertEqual(generation(), before + 3)
+        self.assertIn(self.sessionIH1.pk, fresh())
+
+    def test_conditional_get(self):
+        '''
+        The JSON leaderboards are answered with 304 Not Modified until the options or the data change.
+        '''
+        url = reverse('json_leaderboards')
+        options = {'games_in': ",".join(str(game.pk) for game in self.all_games)}
+
+        def get(etag, **other_options):
+            return self.client.get(url, {**options, **other_options}, HTTP_IF_NONE_MATCH=etag)
+
+        response = self.client.get(url, options)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        etag = response['ETag']
+
+        self.assertEqual(get(etag).status_code, 304)
+        self.assertEqual(get(etag, num_players_top=3).status_code, 200)
+
+        # A session edited (its game's cache invalidated)
+        Leaderboard_Cache.invalidate(self.session04)
+        response = get(etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(get(etag).status_code, 304)
+
+        # A game renamed
+        self.gameIL.name = "INDIVIDUAL_LOW_SCORE_WINS_RENAMED"
+        self.gameIL.save()
+        response = get(etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(get(etag).status_code, 304)
+
+        # The latest session of a game deleted (which needs no rebuild)
+        view = SimpleNamespace(model=Session, object=self.session05)
+        post_kwargs = pre_delete_handler(view)
+        self.assertNotIn('rebuild', post_kwargs)
+        self.session05.delete()
+        post_delete_handler(view, **post_kwargs)
+        self.assertEqual(get(etag).status_code, 200)
+
+    def test_cursor_paging(self):
+        '''
+        The JSON leaderboards page through the games by cursor, and a bad cursor is a bad request.
+        '''
+        url = reverse('json_leaderboards')
+        options = {'games_in': ",".join(str(game.pk) for game in self.all_games), 'page_size': 2}
+
+        (_, _, _, leaderboards, next_cursor) = self.client.get(url, {**options, 'cursor': 0}).json()
+        self.assertEqual(len(leaderboards), 2)
+        self.assertEqual(next_cursor, 2)
+        first_page = {board[0] for board in leaderboards}
+
+        (_, _, _, leaderboards, next_cursor) = self.client.get(url, {**options, 'cursor': next_cursor}).json()
+        self.assertEqual(len(leaderboards), 1)
+        self.assertIsNone(next_cursor)
+        last_page = {board[0] for board in leaderboards}
+
+        self.assertFalse(first_page & last_page)
+        self.assertEqual(first_page | last_page, {game.pk for game in self.all_games})
+
+        self.assertEqual(self.client.get(url, {**options, 'cursor': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {**options, 'cursor': 0, 'page_size': 'abc'}).status_code, 400)
@@ -0,0 +1,453 @@
+from datetime import timedelta, datetime
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase
+from django.core.cache import cache
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.timezone import make_aware
+
+from Leaderboards.models import Session, Rating, Performance, RatingTimeline, TrueskillSettings, RebuildLog, RATING_REBUILD_TRIGGER
+from Leaderboards.models.rating import BackupRating
+from Leaderboards.trueskill_replay import TrueSkillReplay
+
+from .fixtures import LeaderboardFixture
+
+
+class RatingAssertions:
+    '''
+    Compares all the ratings and performances, as the rebuild tests do before and after a rebuild.
+    '''
+
+    def assertRatingsEqual(self, first, second):
+        '''
+        Asserts that two dicts of rating tuples (counts, then floats) are equal, within a tolerance on the floats.
+        '''
+        self.assertEqual(first.keys(), second.keys())
+        for key in first:
+            (counts1, floats1), (counts2, floats2) = first[key], second[key]
+            self.assertEqual(counts1, counts2, f"Counts differ for {key}")
+            for f1, f2 in zip(floats1, floats2):
+                self.assertAlmostEqual(f1, f2, places=9, msg=f"Ratings differ for {key}")
+
+    def ratings(self):
+        return {(r.player_id, r.game_id): ((r.plays, r.victories, r.last_play), (r.trueskill_mu, r.trueskill_sigma, r.trueskill_eta))
+                for r in Rating.objects.all()}
+
+    def performances(self):
+        return {p.pk: ((p.play_number, p.victory_count), (p.trueskill_mu_before, p.trueskill_sigma_before, p.trueskill_mu_after, p.trueskill_sigma_after, p.trueskill_eta_after))
+                for p in Performance.objects.all()}
+
+
+class RatingsTestCase(RatingAssertions, LeaderboardFixture, TestCase):
+
+    def test_in_memory_rebuild(self):
+        '''
+        The in-memory replay engine rebuilds the same ratings and performances as the standard rebuild.
+        '''
+        Rating.rebuild(Reason="Standard rebuild.")
+        ratings, performances = self.ratings(), self.performances()
+
+        Rating.rebuild(Reason="In-memory rebuild.", InMemory=True)
+        self.assertRatingsEqual(self.ratings(), ratings)
+        self.assertRatingsEqual(self.performances(), performances)
+
+        # And so for a rebuild of one game from a given time
+        Rating.rebuild(Game=self.game0, From=self.session03.date_time, Reason="In-memory rebuild of a game.", InMemory=True)
+        self.assertRatingsEqual(self.ratings(), ratings)
+        self.assertRatingsEqual(self.performances(), performances)
+
+    def test_rating_timeline(self):
+        '''
+        The ratings the timeline holds as at any time are those of the last performances up to then,
+        and its current ratings are the Ratings.
+        '''
+        for game in self.all_games:
+            for session in game.session_list():
+                for asat in (session.date_time, session.date_time + timedelta(minutes=1)):
+                    timeline = {r.player_id: ((r.plays, r.victories), (r.trueskill_mu, r.trueskill_sigma, r.trueskill_eta))
+                                for r in RatingTimeline.asat(game, asat)}
+                    performances = {p.player_id: ((p.play_number, p.victory_count), (p.trueskill_mu_after, p.trueskill_sigma_after, p.trueskill_eta_after))
+                                    for p in game.last_performances(asat=asat)}
+                    self.assertRatingsEqual(timeline, performances)
+
+            current = {r.player_id: ((r.plays, r.victories), (r.trueskill_mu, r.trueskill_sigma, r.trueskill_eta))
+                       for r in RatingTimeline.objects.filter(game=game, valid_to__isnull=True)}
+            ratings = {r.player_id: ((r.plays, r.victories), (r.trueskill_mu, r.trueskill_sigma, r.trueskill_eta))
+                       for r in Rating.objects.filter(game=game)}
+            self.assertRatingsEqual(current, ratings)
+
+        # Before the first session there's nothing on the board
+        self.assertFalse(RatingTimeline.asat(self.game0, self.session01.date_time - timedelta(minutes=1)).exists())
+
+    def what_if(self, game, players, ranking, date_time, **form_mods):
+        '''
+        Posts a proposed session (as the session form would) to the what-if view and returns the response.
+        '''
+        form = {'game': game.pk,
+                'date_time': date_time,
+                'league': self.league1.pk,
+                'location': self.location1.pk,
+                'Rank-TOTAL_FORMS': len(players),
+                'Performance-TOTAL_FORMS': len(players)}
+
+        for i, (player, rank) in enumerate(zip(players, ranking)):
+            form.update({f'Rank-{i}-rank': rank,
+                         f'Rank-{i}-player': player.pk,
+                         f'Performance-{i}-player': player.pk,
+                         f'Performance-{i}-partial_play_weighting': 1})
+
+        form.update(form_mods)
+
+        return self.client.post(reverse('json_whatif'), form)
+
+    def test_what_if(self):
+        '''
+        The what-if view returns the boards before and after a proposed session, and saves nothing.
+        '''
+        self.client.force_login(self.user)
+
+        ratings, sessions = self.ratings(), Session.objects.count()
+
+        response = self.what_if(self.game0, [self.player1, self.player5], [1, 2], '2022-01-03 08:00:00 +10:00')
+        self.assertEqual(response.status_code, 200)
+        impact = response.json()
+
+        # The proposed session is the latest, so the board before it is the game's board now
+        (before, after) = impact['session']
+        self.assertEqual(impact['leaderboards'][str(self.game0.pk)], [before, after])
+        self.assertEqual({row[0] for row in before}, {r.player_id for r in Rating.objects.filter(game=self.game0)})
+        for (player, eta, mu, sigma, plays, victories, last_play) in before:
+            rating = Rating.objects.get(player=player, game=self.game0)
+            self.assertEqual((plays, victories), (rating.plays, rating.victories))
+            self.assertAlmostEqual(eta, rating.trueskill_eta)
+
+        # And after it the players in it have one more play (and the victor one more victory)
+        before = {row[0]: row for row in before}
+        after = {row[0]: row for row in after}
+        self.assertEqual(before.keys(), after.keys())
+        for player, row in after.items():
+            played = player in (self.player1.pk, self.player5.pk)
+            won = player == self.player1.pk
+            self.assertEqual(row[4:6], [before[player][4] + played, before[player][5] + won])
+            if not played:
+                self.assertEqual(row[1:4], before[player][1:4])
+
+        self.assertEqual(impact['sessions'], [])
+        self.assertEqual(set(impact['rating_deltas'][str(self.game0.pk)]), {str(self.player1.pk), str(self.player5.pk)})
+
+        # Nothing was saved
+        self.assertEqual(self.ratings(), ratings)
+        self.assertEqual(Session.objects.count(), sessions)
+
+        # An edit of an earlier session re-rates the sessions after it
+        response = self.what_if(self.game0, [self.player1, self.player5], [1, 2], '2022-01-01 08:00:00 +10:00', id=self.session01.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['sessions'], sorted(s.pk for s in self.game0.future_sessions(self.session01.date_time, self.session01.players)))
+
+    def test_what_if_rejects(self):
+        '''
+        The what-if view is for logged in users, and answers a form it can't evaluate with a 400.
+        '''
+        args = (self.game0, [self.player1, self.player5], [1, 2], '2022-01-03 08:00:00 +10:00')
+
+        self.assertEqual(self.what_if(*args).status_code, 403)
+        self.assertEqual(self.client.get(reverse('json_whatif')).status_code, 405)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.what_if(*args).status_code, 200)
+
+        for bad in ({'date_time': "not a time"},
+                    {'game': "not a game"},
+                    {'game': 0},
+                    {'id': 0},
+                    {'Rank-TOTAL_FORMS': "two"},
+                    {'Rank-TOTAL_FORMS': 0, 'Performance-TOTAL_FORMS': 0},
+                    {'Rank-1-player': ""},
+                    {'Rank-1-player': self.player6.pk},
+                    {'Performance-1-player': 0},
+                    {'Rank-0-rank': ""},
+                    {'Performance-0-partial_play_weighting': "all"}):
+            response = self.what_if(*args, **bad)
+            self.assertEqual(response.status_code, 400, bad)
+            self.assertTrue(response.json()['errors'], bad)
+
+    def test_performance_links(self):
+        '''
+        The adjacency index (see Performance.link) answers what the queries it replaced did, and
+        orders sessions at the same time by pk.
+        '''
+        def plays(session, player):
+            return Session.objects.filter(game=session.game, performances__player=player)
+
+        for session in Session.objects.all():
+            first = Session.objects.filter(game=session.game).order_by('date_time').first()
+            self.assertEqual(session.is_first, session == first, session)
+
+            for performance in session.performances.all():
+                player = performance.player
+                msg = f"{player} in {session}"
+
+                previous = plays(session, player).filter(date_time__lt=session.date_time).order_by('-date_time').first()
+                following = plays(session, player).filter(date_time__gt=session.date_time).order_by('date_time').first()
+                victory = (Session.objects.filter(Q(date_time__lte=session.date_time) & Q(game=session.game) & Q(ranks__rank=1) & (Q(ranks__player=player) | Q(ranks__team__players=player)))
+                           .order_by('-date_time').first())
+
+                self.assertEqual(session.previous_session(player), previous, msg)
+                self.assertEqual(session.following_session(player), following, msg)
+                self.assertEqual(performance.previous, None if previous is None else previous.performance(player), msg)
+                self.assertEqual(performance.following.first(), None if following is None else following.performance(player), msg)
+                self.assertEqual(session.previous_victory(player), None if victory is None else victory.performance(player), msg)
+
+        # Two sessions at the same time (as two tables playing at once might record them), and one after
+        tie = self.create_session(self.gameIL, [self.player4, self.player5], [1, 2], self.sessionIL1.date_time, self.league2, self.location2)
+        later = self.create_session(self.gameIL, [self.player4, self.player5], [2, 1], self.sessionIL1.date_time + timedelta(hours=1), self.league2, self.location2)
+        self.assertGreater(tie.pk, self.sessionIL1.pk)
+
+        # Linked in one walk, and from a time (seeded by the latest performances before it)
+        for From in (None, later.date_time):
+            unlinked = Performance.objects.filter(session__game=self.gameIL)
+            if From:
+                unlinked = unlinked.filter(session__date_time__gte=From)
+            unlinked.update(previous=None, latest_victory=None)
+
+            Performance.link(self.gameIL, From=From)
+
+            for player in (self.player4, self.player5):
+                self.assertIsNone(self.sessionIL1.performance(player).previous)
+                self.assertEqual(tie.performance(player).previous, self.sessionIL1.performance(player))
+                self.assertEqual(later.performance(player).previous, tie.performance(player))
+
+            self.assertEqual(later.performance(self.player4).latest_victory, tie.performance(self.player4))
+            self.assertEqual(later.performance(self.player5).latest_victory, later.performance(self.player5))
+
+    def test_future_sessions(self):
+        '''
+        The future sessions of a game for some players are the influence tree the iterative search
+        found (sessions of those players and of the players their sessions rope in), in order.
+        '''
+        def iterative_future_sessions(game, asat, players):
+            sessions = Session.objects.filter(game=game, date_time__gt=asat).order_by('date_time')
+            if not players:
+                return list(sessions)
+
+            found = {}
+            frontier = list(sessions.filter(performances__player__in=players).distinct())
+            while frontier:
+                session = frontier.pop()
+                if not session.pk in found:
+                    found[session.pk] = session
+                    frontier += sessions.filter(date_time__gt=session.date_time, performances__player__in=session.players).exclude(pk__in=found).distinct()
+
+            return sorted(found.values(), key=lambda s: s.date_time)
+
+        # Player1's sessions after session01 are session03 and session04, but session03 ropes
+        # in Player2, whose session05 follows.
+        roped_in = self.game0.future_sessions(self.session01.date_time, [self.player1])
+        self.assertIn(self.session05, roped_in)
+        self.assertNotIn(self.player1, self.session05.players)
+
+        for game in self.all_games:
+            times = [s.date_time for s in game.session_list()]
+            for asat in times + [min(times) - timedelta(minutes=1)]:
+                for players in (None, [self.player1], [self.player6], [self.player2, self.player5], list(self.league2.players.all())):
+                    self.assertEqual([s.pk for s in game.future_sessions(asat, players)],
+                                     [s.pk for s in iterative_future_sessions(game, asat, players)],
+                                     f"{game} after {asat} for {players}")
+
+    def test_rating_snapshots(self):
+        '''
+        A rebuild snapshots the ratings it touches, and the diff with the snapshot is what the rebuild changed.
+        '''
+        # Throw one rating out, the rebuild puts it back
+        rating = Rating.objects.get(player=self.player1, game=self.game0)
+        Rating.objects.filter(pk=rating.pk).update(trueskill_mu=rating.trueskill_mu + 1, trueskill_eta=rating.trueskill_eta + 1)
+
+        rlog = Rating.rebuild(Game=self.game0, Reason="Snapshot test.", Trigger=RATING_REBUILD_TRIGGER.user_request)
+
+        self.assertEqual(BackupRating.objects.filter(rebuild_log=rlog).count(), Rating.objects.filter(game=self.game0).count())
+
+        diffs = BackupRating.diff(rlog, show_unchanged=False)
+        self.assertEqual(list(diffs), [(self.player1.pk, self.game0.pk)])
+
+        (old_eta, old_mu, old_sigma, diff_eta, diff_mu, diff_sigma, new_eta, new_mu, new_sigma) = diffs[(self.player1.pk, self.game0.pk)]
+        self.assertAlmostEqual(old_mu, rating.trueskill_mu + 1)
+        self.assertAlmostEqual(diff_mu, -1)
+        self.assertAlmostEqual(diff_eta, -1)
+        self.assertAlmostEqual(diff_sigma, 0)
+        self.assertAlmostEqual(new_mu, rating.trueskill_mu)
+        self.assertAlmostEqual(new_eta, rating.trueskill_eta)
+        self.assertAlmostEqual(new_sigma, old_sigma)
+
+        # All the ratings of the game are compared when the unchanged are shown too
+        diffs = BackupRating.diff(rlog)
+        self.assertEqual(set(diffs), {(r.player_id, r.game_id) for r in Rating.objects.filter(game=self.game0)})
+        self.assertEqual(BackupRating.latest_snapshot(), rlog.pk)
+
+        self.assertIn(f"{rating.trueskill_mu + 1:.4f} - 1.0000 = {rating.trueskill_mu:.4f}", rlog.html)
+
+    def test_rating_snapshot_pruning(self):
+        '''
+        Pruning keeps the snapshots of the latest rebuilds and deletes the rest (and untagged backups).
+        '''
+        logs = [Rating.rebuild(Game=game, Reason="Pruning test.") for game in self.all_games]
+
+        # An untagged backup
+        BackupRating.objects.filter(rebuild_log=logs[0]).update(rebuild_log=None)
+
+        expected = BackupRating.objects.exclude(rebuild_log__in=[l.pk for l in logs[-2:]]).count()
+        self.assertEqual(BackupRating.prune(keep=2), expected)
+
+        self.assertEqual(set(BackupRating.objects.values_list('rebuild_log', flat=True)), {l.pk for l in logs[-2:]})
+        self.assertEqual(BackupRating.objects.count(), sum(Rating.objects.filter(game=game).count() for game in self.all_games[-2:]))
+
+        # And a snapshot prunes to settings.RATING_SNAPSHOTS_KEPT
+        with self.settings(RATING_SNAPSHOTS_KEPT=1):
+            rlog = Rating.rebuild(Game=self.game0, Reason="Pruning test.")
+
+        self.assertEqual(set(BackupRating.objects.values_list('rebuild_log', flat=True)), {rlog.pk})
+
+    def test_materialise(self):
+        '''
+        Materialised ratings are what resetting each rating to its last performance makes them.
+        '''
+        fields = ['plays', 'victories', 'last_play', 'last_victory',
+                  'trueskill_mu', 'trueskill_sigma', 'trueskill_eta',
+                  'trueskill_mu0', 'trueskill_sigma0', 'trueskill_delta',
+                  'trueskill_beta', 'trueskill_tau', 'trueskill_p']
+
+        def values(rating):
+            return {f: getattr(rating, f) for f in fields}
+
+        # A rating with no performances behind it (that reset() leaves alone and materialise() defaults)
+        orphan = Rating.create(self.player1, self.gameIL)
+        orphan.plays = orphan.victories = 3
+        orphan.save()
+
+        expected = {}
+        for rating in Rating.objects.all():
+            if rating.pk == orphan.pk:
+                rating = Rating.create(rating.player, rating.game)
+            else:
+                rating.reset()
+            expected[(rating.player_id, rating.game_id)] = values(rating)
+
+        self.assertTrue(any(game == self.gameTH.pk and e['victories'] for (player, game), e in expected.items()))
+
+        # Throw the ratings out, and lose one (of a team game)
+        Rating.objects.update(plays=0, victories=0, trueskill_mu=0, trueskill_sigma=0, trueskill_eta=0)
+        Rating.objects.filter(player=self.player1, game=self.gameTH).delete()
+
+        self.assertEqual(Rating.materialise(), (len(expected) - 1, 1))
+
+        materialised = {(r.player_id, r.game_id): values(r) for r in Rating.objects.all()}
+        self.assertEqual(materialised.keys(), expected.keys())
+        for key, e in expected.items():
+            for field, value in e.items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(materialised[key][field], value, msg=f"{field} of {key}")
+                else:
+                    self.assertEqual(materialised[key][field], value, f"{field} of {key}")
+
+
+class RebuildTestCase(RatingAssertions, LeaderboardFixture, TransactionTestCase):
+    '''
+    The rebuilds that commit as they go (and so can't be tested inside a transaction).
+    '''
+
+    def setUp(self):
+        # A TransactionTestCase flushes the database after each test, rather than rolling back to the test data.
+        self.setUpTestData()
+
+    def test_checkpointed_rebuild(self):
+        '''
+        A checkpointed rebuild that dies partway, resumed, rebuilds the same ratings and performances as one that didn't.
+        '''
+        Rating.rebuild(Reason="Uninterrupted rebuild.")
+        ratings, performances = self.ratings(), self.performances()
+
+        # Throw the ratings and performances out, the rebuild puts them back
+        Rating.objects.update(trueskill_mu=1, trueskill_sigma=1, trueskill_eta=1)
+        Performance.objects.update(trueskill_mu_before=1, trueskill_sigma_before=1, trueskill_mu_after=1, trueskill_sigma_after=1, trueskill_eta_after=1)
+
+        # Die rating the fifth session, in the second batch
+        rate = TrueSkillReplay.rate
+        rated = []
+
+        def dying_rate(replay, session, previous):
+            rated.append(session)
+            if len(rated) == 5:
+                raise RuntimeError("The rebuild died.")
+            return rate(replay, session, previous)
+
+        with mock.patch.object(TrueSkillReplay, 'rate', dying_rate):
+            with self.assertRaises(RuntimeError):
+                Rating.rebuild(Reason="Interrupted rebuild.", Checkpoint=3)
+
+        # The first batch is committed, and checkpointed, the ratings aren't touched until the end
+        rlog = RebuildLog.incomplete().get()
+        sessions = list(Session.objects.order_by('date_time', 'pk'))
+        self.assertEqual(rlog.checkpoint, sessions[2])
+        self.assertEqual(set(Rating.objects.values_list('trueskill_mu', flat=True)), {1})
+
+        rlog = Rating.resume(rlog, Checkpoint=3)
+        self.assertTrue(rlog.complete)
+        self.assertFalse(RebuildLog.incomplete().exists())
+
+        self.assertRatingsEqual(self.ratings(), ratings)
+        self.assertRatingsEqual(self.performances(), performances)
+
+    def test_partitioned_rebuild(self):
+        '''
+        A rebuild partitioned by game across worker processes rebuilds the same ratings and performances as a serial rebuild.
+        '''
+        Rating.rebuild(Reason="Serial rebuild.")
+        ratings, performances = self.ratings(), self.performances()
+
+        # Throw the ratings and performances out, the rebuild puts them back
+        Rating.objects.update(trueskill_mu=1, trueskill_sigma=1, trueskill_eta=1)
+        Performance.objects.update(trueskill_mu_before=1, trueskill_sigma_before=1, trueskill_mu_after=1, trueskill_sigma_after=1, trueskill_eta_after=1)
+
+        for InMemory in (False, True):
+            rlog = Rating.rebuild(Reason="Partitioned rebuild.", Processes=2, InMemory=InMemory)
+
+            self.assertEqual({p.game for p in rlog.partitions.all()}, {s.game for s in Session.objects.all()})
+            self.assertEqual(set(rlog.rebuilt_sessions), set(Session.objects.all()))
+
+            self.assertRatingsEqual(self.ratings(), ratings)
+            self.assertRatingsEqual(self.performances(), performances)
+
+
+class TrueskillSettingsTestCase(TestCase):
+
+    # Check the shared version on every call to TrueskillSettings.eras()
+    @mock.patch.object(TrueskillSettings, 'eras_check_interval', timedelta(seconds=-1))
+    def test_eras_cache(self):
+        '''
+        The eras are loaded once per process, and reloaded only when the shared version changes.
+        '''
+        TrueskillSettings.invalidate()
+        eras = TrueskillSettings.eras()
+        self.assertEqual(TrueskillSettings._eras_version, TrueskillSettings.shared_version())
+
+        # Not reloaded while the shared version is unchanged
+        with self.assertNumQueries(0):
+            self.assertIs(TrueskillSettings.eras(), eras)
+            self.assertIs(TrueskillSettings.eras(), eras)
+
+        # Reloaded (once) when another process bumps the shared version
+        cache.incr(TrueskillSettings.version_key)
+        with self.assertNumQueries(1):
+            self.assertIsNot(TrueskillSettings.eras(), eras)
+            eras = TrueskillSettings.eras()
+
+        # And when a version is saved, with the new version (once it's committed)
+        effective_from = make_aware(datetime(2022, 1, 1))
+        with mock.patch.object(TrueskillSettings, 'rerate'), self.captureOnCommitCallbacks(execute=True):
+            version = TrueskillSettings.objects.create(mu0=30, effective_from=effective_from)
+
+        self.assertIsNot(TrueskillSettings.eras(), eras)
+        self.assertEqual(TrueskillSettings.eras()[-1], (effective_from, version))
+
+        with self.assertNumQueries(0):
+            TrueskillSettings.eras()
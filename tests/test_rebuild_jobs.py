@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+from django.test import TestCase, override_settings
+
+from Leaderboards.models import Session, Rating, RebuildJob, RATING_REBUILD_TRIGGER, REBUILD_JOB_STATUS
+from Leaderboards.views.pre_handlers import pre_delete_handler
+from Leaderboards.views.post_handlers import post_delete_handler
+
+from .fixtures import LeaderboardFixture
+
+
+@override_settings(USE_REBUILD_QUEUE=True)
+class RebuildJobTestCase(LeaderboardFixture, TestCase):
+
+    def test_enqueue(self):
+        '''
+        Rebuilds queued for a game with a rebuild pending join that rebuild.
+        '''
+        job = RebuildJob.enqueue([self.session03, self.session04], "First edit.", RATING_REBUILD_TRIGGER.session_edit, self.session02)
+        same = RebuildJob.enqueue([self.session04, self.session05], "Second edit.", RATING_REBUILD_TRIGGER.session_edit, self.session03)
+        self.assertEqual(same.pk, job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(set(job.sessions.all()), {self.session03, self.session04, self.session05})
+        self.assertEqual(set(job.games.all()), {self.game0})
+        self.assertEqual(job.sessions_total, 3)
+        self.assertEqual(job.reason, "First edit.\nSecond edit.")
+        self.assertEqual(job.session, self.session02)
+        self.assertTrue(RebuildJob.is_pending_for(self.game0))
+        self.assertFalse(RebuildJob.is_pending_for(self.gameIH))
+
+        # Another game's rebuild is queued apart, and a rebuild of both joins the newest of them
+        other = RebuildJob.enqueue([self.sessionIH2], "An edit of another game.")
+        self.assertNotEqual(other.pk, job.pk)
+        both = RebuildJob.enqueue([self.session05, self.sessionIH2], "An edit of both games.")
+        self.assertEqual(both.pk, other.pk)
+        self.assertEqual(set(both.games.all()), {self.game0, self.gameIH})
+
+    def test_claim(self):
+        '''
+        The rebuilds of a game are claimed one at a time, in the order they were queued.
+        '''
+        first = RebuildJob.enqueue([self.session03, self.session04, self.session05], "First edit.")
+        self.assertEqual(RebuildJob.claim().pk, first.pk)
+
+        # A running job is not joined, a new job waits for it
+        second = RebuildJob.enqueue([self.session05], "Second edit.")
+        self.assertNotEqual(second.pk, first.pk)
+        other = RebuildJob.enqueue([self.sessionIH2], "An edit of another game.")
+
+        self.assertEqual(RebuildJob.claim().pk, other.pk)
+        self.assertIsNone(RebuildJob.claim())
+
+        first.refresh_from_db()
+        self.assertEqual(first.status, REBUILD_JOB_STATUS.running.value)
+        first.run()
+        self.assertEqual(first.status, REBUILD_JOB_STATUS.done.value)
+        self.assertEqual(first.sessions_done, 3)
+        self.assertIsNotNone(first.rebuild_log)
+
+        self.assertEqual(RebuildJob.claim().pk, second.pk)
+        self.assertIsNone(RebuildJob.claim())
+
+    def test_deferral(self):
+        '''
+        Sessions added or deleted while a rebuild of their game is pending join it, and their
+        ratings are left to it.
+        '''
+        job = RebuildJob.enqueue([self.session04, self.session05], "An earlier edit.")
+        plays = {r.player_id: r.plays for r in Rating.objects.filter(game=self.game0)}
+
+        # A session added (the latest, which would otherwise just update the ratings)
+        form = {'game': self.game0.pk,
+                'date_time': '2022-01-03 08:00:00 +10:00',
+                'league': self.league1.pk,
+                'location': self.location1.pk,
+                'num_players': 2,
+                'Rank-TOTAL_FORMS': 2, 'Rank-INITIAL_FORMS': 0, 'Rank-MIN_NUM_FORMS': 0, 'Rank-MAX_NUM_FORMS': 1000,
+                'Performance-TOTAL_FORMS': 2, 'Performance-INITIAL_FORMS': 0, 'Performance-MIN_NUM_FORMS': 0, 'Performance-MAX_NUM_FORMS': 1000}
+
+        for i, player in enumerate((self.player2, self.player3)):
+            form.update({f'Rank-{i}-rank': i + 1,
+                         f'Rank-{i}-player': player.pk,
+                         f'Performance-{i}-player': player.pk,
+                         f'Performance-{i}-partial_play_weighting': 1})
+
+        self.client.force_login(self.user)
+        response = self.client.post("/add/Session/", form)
+        self.assertEqual(response.status_code, 302)
+
+        added = Session.objects.filter(game=self.game0).order_by('-date_time').first()
+        self.assertEqual(set(added.players), {self.player2, self.player3})
+        self.assertIn(added, job.sessions.all())
+        self.assertEqual({r.player_id: r.plays for r in Rating.objects.filter(game=self.game0)}, plays)
+
+        # A session deleted (not the latest, so it demands a rebuild)
+        view = SimpleNamespace(model=Session, object=self.session03)
+        post_kwargs = pre_delete_handler(view)
+        self.assertIn('rebuild', post_kwargs)
+        self.session03.delete()
+        post_delete_handler(view, **post_kwargs)
+
+        self.assertEqual(RebuildJob.pending().count(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.sessions_total, job.sessions.count())
+        self.assertLessEqual(set(post_kwargs['rebuild']), set(job.sessions.all()))